@@ -0,0 +1,181 @@
+"""
+Benchmark: resolución de libros en purchases-api (scan vs clave vs BatchGetItem)
+
+Carga un catálogo sintético en una tabla de libros de DynamoDB Local y mide:
+  - legacy_scan: el scan con FilterExpression que usaba get_book_info
+  - keyed:       get_book_info por clave (get_item / query de partición)
+  - batch:       batch_get_books para un carrito completo
+
+Uso:
+    docker run -p 8000:8000 amazon/dynamodb-local
+    python benchmarks/bench_book_lookup.py --books 100000 --cart-size 10
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+import boto3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+TENANT_ID = "bench"
+
+
+def load_purchases_app():
+    """Cargar services/purchases-api/app.py como módulo"""
+    path = os.path.join(ROOT, "services", "purchases-api", "app.py")
+    spec = importlib.util.spec_from_file_location("purchases_app", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def ensure_table(dynamodb, table_name):
+    """Crear la tabla de libros con el mismo esquema de infrastructure/dynamodb.yml"""
+    existing = [table.name for table in dynamodb.tables.all()]
+    if table_name in existing:
+        return dynamodb.Table(table_name)
+
+    table = dynamodb.create_table(
+        TableName=table_name,
+        BillingMode="PAY_PER_REQUEST",
+        AttributeDefinitions=[
+            {"AttributeName": "pk", "AttributeType": "S"},
+            {"AttributeName": "sk", "AttributeType": "S"},
+        ],
+        KeySchema=[
+            {"AttributeName": "pk", "KeyType": "HASH"},
+            {"AttributeName": "sk", "KeyType": "RANGE"},
+        ],
+    )
+    table.wait_until_exists()
+    return table
+
+
+def seed_books(table, count):
+    """Insertar `count` libros sintéticos; devuelve [(book_id, isbn)]"""
+    refs = []
+    with table.batch_writer() as batch:
+        for i in range(count):
+            book_id = f"book-{i:07d}"
+            isbn = f"978{i:010d}"
+            refs.append((book_id, isbn))
+            batch.put_item(
+                Item={
+                    "pk": f"{TENANT_ID}#{book_id}",
+                    "sk": f"BOOK#{isbn}",
+                    "book_id": book_id,
+                    "tenant_id": TENANT_ID,
+                    "isbn": isbn,
+                    "title": f"Libro {i}",
+                    "author": f"Autor {i % 500}",
+                    "category": f"cat-{i % 20}",
+                    "price": Decimal("19.99"),
+                    "stock_quantity": 100,
+                    "is_active": True,
+                }
+            )
+    return refs
+
+
+def legacy_scan(table, tenant_id, book_id):
+    """Implementación anterior (con paginación para que el resultado sea correcto)"""
+    scan_params = {
+        "FilterExpression": boto3.dynamodb.conditions.Attr("tenant_id").eq(tenant_id)
+        & boto3.dynamodb.conditions.Attr("book_id").eq(book_id)
+        & boto3.dynamodb.conditions.Attr("is_active").eq(True)
+    }
+    while True:
+        response = table.scan(**scan_params)
+        if response["Items"]:
+            return response["Items"][0]
+        if "LastEvaluatedKey" not in response:
+            return None
+        scan_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(
+        f"{name:<12} runs={len(samples):<4} "
+        f"p50={statistics.median(samples):9.2f} ms  p99={p99:9.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--endpoint-url", default="http://localhost:8000")
+    parser.add_argument("--table", default="bookstore-books-bench")
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--cart-size", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--scan-runs", type=int, default=3)
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource(
+        "dynamodb",
+        endpoint_url=args.endpoint_url,
+        region_name="us-east-1",
+        aws_access_key_id="local",
+        aws_secret_access_key="local",
+    )
+    table = ensure_table(dynamodb, args.table)
+
+    if args.skip_seed:
+        refs = [(f"book-{i:07d}", f"978{i:010d}") for i in range(args.books)]
+    else:
+        start = time.perf_counter()
+        refs = seed_books(table, args.books)
+        print(f"Catálogo cargado: {args.books} libros en {time.perf_counter() - start:.1f}s")
+
+    app = load_purchases_app()
+    rng = random.Random(42)
+
+    def cart():
+        return rng.sample(refs, args.cart_size)
+
+    report(
+        "legacy_scan",
+        timed(
+            lambda: [legacy_scan(table, TENANT_ID, book_id) for book_id, _ in cart()],
+            args.scan_runs,
+        ),
+    )
+    report(
+        "keyed",
+        timed(
+            lambda: [
+                app.get_book_info(table, TENANT_ID, book_id, isbn)
+                for book_id, isbn in cart()
+            ],
+            args.runs,
+        ),
+    )
+    report(
+        "batch",
+        timed(
+            lambda: app.batch_get_books(dynamodb, table, TENANT_ID, cart()),
+            args.runs,
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
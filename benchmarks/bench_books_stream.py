@@ -0,0 +1,160 @@
+"""
+Benchmark: docs/s de books_stream_processor contra un Elasticsearch local
+
+Genera registros sintéticos del stream de libros (una importación de
+catálogo) y mide:
+  - per_record: una petición index por registro (implementación anterior)
+  - bulk:       books_stream_processor.handler, un _bulk por batch
+  - stock_only: MODIFY que sólo cambian stock_quantity (ventas), enviados
+                como _update parcial
+  - hot_books:  ventas concentradas en --hot-books libros; los MODIFY del
+                mismo libro en un batch se reducen a una escritura
+
+Uso:
+    docker run -p 9200:9200 -e discovery.type=single-node elasticsearch:7.17.9
+    python benchmarks/bench_books_stream.py --records 5000 --batch-size 100
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+sys.path.insert(0, os.path.join(ROOT, "services", "stream-processors"))
+
+TENANT_ID = "bench"
+
+
+def book_image(i, stock=100):
+    return {
+        "book_id": {"S": f"book-{i:07d}"},
+        "tenant_id": {"S": TENANT_ID},
+        "isbn": {"S": f"978{i:010d}"},
+        "title": {"S": f"Libro {i}"},
+        "author": {"S": f"Autor {i % 500}"},
+        "category": {"S": f"cat-{i % 20}"},
+        "price": {"N": "19.99"},
+        "stock_quantity": {"N": str(stock)},
+        "updated_at": {"S": "2025-01-01T00:00:00"},
+        "is_active": {"BOOL": True},
+    }
+
+
+def insert_records(count):
+    return [
+        {
+            "eventName": "INSERT",
+            "dynamodb": {
+                "SequenceNumber": str(i + 1).zfill(21),
+                "Keys": {"pk": {"S": f"{TENANT_ID}#book-{i:07d}"}},
+                "NewImage": book_image(i),
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def stock_records(count):
+    """MODIFY de una venta: sólo cambia stock_quantity"""
+    return [
+        {
+            "eventName": "MODIFY",
+            "dynamodb": {
+                "SequenceNumber": str(count + i + 1).zfill(21),
+                "Keys": {"pk": {"S": f"{TENANT_ID}#book-{i:07d}"}},
+                "NewImage": book_image(i, stock=99),
+                "OldImage": book_image(i),
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def hot_book_records(count, hot_books):
+    """Ventas sucesivas sobre unos pocos libros: el stock baja de uno en uno"""
+    records = []
+    for i in range(count):
+        book = i % hot_books
+        sold = i // hot_books
+        records.append(
+            {
+                "eventName": "MODIFY",
+                "dynamodb": {
+                    "SequenceNumber": str(2 * count + i + 1).zfill(21),
+                    "Keys": {"pk": {"S": f"{TENANT_ID}#book-{book:07d}"}},
+                    "NewImage": book_image(book, stock=99 - sold - 1),
+                    "OldImage": book_image(book, stock=99 - sold),
+                },
+            }
+        )
+    return records
+
+
+def per_record(processor, es, records):
+    """Implementación anterior: exists + index por registro"""
+    for record in records:
+        doc = processor.build_book_doc(record["dynamodb"]["NewImage"])
+        index_name = processor.index_name_for(doc["tenant_id"])
+        if not es.indices.exists(index=index_name):
+            es.indices.create(index=index_name, body=processor.INDEX_CONFIG, ignore=400)
+        es.index(index=index_name, id=doc["book_id"], body=doc)
+
+
+def run_batches(processor, records, batch_size):
+    failures = 0
+    for start in range(0, len(records), batch_size):
+        response = processor.handler({"Records": records[start:start + batch_size]}, None)
+        failures += len(response["batchItemFailures"])
+    return failures
+
+
+def report(name, count, seconds):
+    print(f"{name:<12} {count} docs en {seconds:6.2f}s  {count / seconds:8.0f} docs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--es-host", default="http://localhost:9200")
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--hot-books", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ["ELASTICSEARCH_HOST"] = args.es_host
+    import books_stream_processor as processor
+
+    es = processor.get_elasticsearch_client()
+    index_name = processor.index_name_for(TENANT_ID)
+    records = insert_records(args.records)
+
+    es.indices.delete(index=index_name, ignore=404)
+    start = time.perf_counter()
+    per_record(processor, es, records)
+    report("per_record", len(records), time.perf_counter() - start)
+
+    es.indices.delete(index=index_name, ignore=404)
+    start = time.perf_counter()
+    failures = run_batches(processor, records, args.batch_size)
+    report("bulk", len(records), time.perf_counter() - start)
+    if failures:
+        print(f"  registros fallidos: {failures}")
+
+    updates = stock_records(args.records)
+    start = time.perf_counter()
+    failures = run_batches(processor, updates, args.batch_size)
+    report("stock_only", len(updates), time.perf_counter() - start)
+    if failures:
+        print(f"  registros fallidos: {failures}")
+
+    hot = hot_book_records(args.records, args.hot_books)
+    start = time.perf_counter()
+    failures = run_batches(processor, hot, args.batch_size)
+    report("hot_books", len(hot), time.perf_counter() - start)
+    if failures:
+        print(f"  registros fallidos: {failures}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark: índice por tenant vs índice compartido con routing y alias filtrados
+
+Para cada número de tenants (por defecto 10, 100 y 1000) y cada modo de
+books_stream_processor (ES_INDEX_MODE per_tenant / shared) carga el mismo
+catálogo sintético a través del handler y mide en un Elasticsearch local:
+  - shards activos y tamaño de los metadatos del cluster state
+  - heap usado del nodo y memoria de segmentos
+  - latencia p50/p95 de una búsqueda por tenant (sobre books_{tenant})
+
+Con 1000 tenants en modo per_tenant hacen falta más shards de los que un
+nodo admite por defecto; el benchmark sube cluster.max_shards_per_node
+(transient) y crea los índices sin réplicas.
+
+Uso:
+    docker run -p 9200:9200 -e discovery.type=single-node \\
+        -e ES_JAVA_OPTS="-Xms1g -Xmx1g" elasticsearch:7.17.9
+    python benchmarks/bench_es_multitenancy.py --tenants 10,100,1000 --docs-per-tenant 50
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+sys.path.insert(0, os.path.join(ROOT, "services", "stream-processors"))
+
+MODES = ("per_tenant", "shared")
+
+
+def book_records(tenants, docs_per_tenant):
+    records = []
+    for t in range(tenants):
+        tenant_id = f"bench{t:04d}"
+        for i in range(docs_per_tenant):
+            records.append(
+                {
+                    "eventName": "INSERT",
+                    "dynamodb": {
+                        "SequenceNumber": str(len(records) + 1).zfill(21),
+                        "NewImage": {
+                            "book_id": {"S": f"{tenant_id}-book-{i:05d}"},
+                            "tenant_id": {"S": tenant_id},
+                            "title": {"S": f"Libro {i} de {tenant_id}"},
+                            "author": {"S": f"Autor {i % 50}"},
+                            "category": {"S": f"cat-{i % 10}"},
+                            "price": {"N": "19.99"},
+                            "stock_quantity": {"N": "10"},
+                        },
+                    },
+                }
+            )
+    return records
+
+
+def cleanup(es):
+    es.indices.delete(index="books*", ignore=404, expand_wildcards="all")
+
+
+def node_stats(es):
+    stats = next(iter(es.nodes.stats(metric="jvm,indices")["nodes"].values()))
+    return (
+        stats["jvm"]["mem"]["heap_used_in_bytes"],
+        stats["indices"]["segments"]["memory_in_bytes"],
+    )
+
+
+def search_latencies(processor, es, tenants, queries):
+    latencies = []
+    for _ in range(queries):
+        tenant_id = f"bench{random.randrange(tenants):04d}"
+        start = time.perf_counter()
+        es.search(
+            index=processor.index_name_for(tenant_id),
+            body={"query": {"multi_match": {"query": "libro autor", "fields": ["title", "author"]}}},
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def run(processor, es, mode, tenants, docs_per_tenant, batch_size, queries):
+    cleanup(es)
+    processor.INDEX_MODE = mode
+    processor.known_indices.clear()
+
+    records = book_records(tenants, docs_per_tenant)
+    start = time.perf_counter()
+    for offset in range(0, len(records), batch_size):
+        processor.handler({"Records": records[offset:offset + batch_size]}, None)
+    load_seconds = time.perf_counter() - start
+
+    es.indices.refresh(index="books*")
+    health = es.cluster.health()
+    state_bytes = len(json.dumps(es.cluster.state(metric="metadata")))
+    heap, segments = node_stats(es)
+    p50, p95 = search_latencies(processor, es, tenants, queries)
+    print(
+        f"{tenants:>6} {mode:<11} {health['active_shards']:>7} {state_bytes / 1024:>10.0f} "
+        f"{heap / 2**20:>9.0f} {segments / 2**20:>9.1f} {load_seconds:>8.1f} {p50:>7.2f} {p95:>7.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--es-host", default="http://localhost:9200")
+    parser.add_argument("--tenants", default="10,100,1000")
+    parser.add_argument("--docs-per-tenant", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    os.environ["ELASTICSEARCH_HOST"] = args.es_host
+    import books_stream_processor as processor
+
+    # Un nodo: sin réplicas, y margen de shards para el modo per_tenant
+    processor.INDEX_CONFIG["settings"]["number_of_replicas"] = 0
+    es = processor.get_elasticsearch_client()
+    tenant_counts = [int(value) for value in args.tenants.split(",")]
+    es.cluster.put_settings(
+        body={"transient": {"cluster.max_shards_per_node": max(tenant_counts) + 100}}
+    )
+
+    print(
+        f"{'tenants':>6} {'modo':<11} {'shards':>7} {'state KiB':>10} "
+        f"{'heap MiB':>9} {'segm MiB':>9} {'carga s':>8} {'p50 ms':>7} {'p95 ms':>7}"
+    )
+    try:
+        for tenants in tenant_counts:
+            for mode in MODES:
+                run(processor, es, mode, tenants, args.docs_per_tenant, args.batch_size, args.queries)
+    finally:
+        cleanup(es)
+        es.cluster.put_settings(body={"transient": {"cluster.max_shards_per_node": None}})
+
+
+if __name__ == "__main__":
+    main()
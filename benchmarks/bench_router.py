@@ -0,0 +1,59 @@
+"""
+Benchmark: coste del dispatch de rutas de users-api y purchases-api
+
+Mide router.resolve() para cada ruta registrada (sin llamadas a AWS), de modo
+que cada endpoint se puede medir de forma aislada.
+
+Uso:
+    python benchmarks/bench_router.py --iterations 200000
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+
+SAMPLE_PARAMS = {
+    "{cart_item_id}": "3f1c2b7e-0d7e-4c59-9a55-2f1d1d0e8a10",
+    "{order_id}": "01J9ZK3V6Q8N4W2R5T7Y9B1C3D",
+    "{book_id}": "book-0000042",
+}
+
+
+def load_app(service):
+    path = os.path.join(ROOT, "services", service, "app.py")
+    spec = importlib.util.spec_from_file_location(service.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def concrete_path(template):
+    for placeholder, value in SAMPLE_PARAMS.items():
+        template = template.replace(placeholder, value)
+    return template
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    for service in ("users-api", "purchases-api"):
+        router = load_app(service).router
+        print(service)
+        for endpoint in router.endpoints():
+            method, template = endpoint.split(" ", 1)
+            path = concrete_path(template)
+            seconds = timeit.timeit(
+                lambda: router.resolve(method, path), number=args.iterations
+            )
+            print(f"  {endpoint:<45} {seconds / args.iterations * 1e9:8.0f} ns/op")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark: throughput de verificación de tokens firmados (bookstore_common.tokens)
+
+Mide, sin ninguna llamada de red:
+  - issue:         firmar un token nuevo (login / register)
+  - verify:        verify_token() de un token válido
+  - authorization: user_from_authorization() con el header completo
+  - rotated_kid:   verificar un token firmado con una clave anterior (rotación)
+  - bad_signature: rechazar un token con la firma alterada
+
+Uso:
+    python benchmarks/bench_token_verify.py --iterations 200000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+
+from bookstore_common import tokens  # noqa: E402
+
+USER_ID = "d780c13c-60f6-48bd-95b5-6d57a05e56a4"
+
+
+def report(name, seconds, iterations):
+    per_op = seconds / iterations
+    print(f"{name:<14} {per_op * 1e6:8.2f} µs/op  {1 / per_op:12,.0f} ops/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    os.environ["TOKEN_SIGNING_KEYS"] = "2024-01:old-bench-secret"
+    os.environ["TOKEN_ACTIVE_KID"] = "2024-01"
+    old_token = tokens.issue_token(USER_ID, "tenant1", "user")
+
+    os.environ["TOKEN_SIGNING_KEYS"] = "2024-01:old-bench-secret,2025-01:new-bench-secret"
+    os.environ["TOKEN_ACTIVE_KID"] = "2025-01"
+    token = tokens.issue_token(
+        USER_ID, "tenant1", "admin", username="bench", email="bench@example.com"
+    )
+    header = f"Bearer {token}"
+    tampered = token[:-2] + ("AA" if not token.endswith("AA") else "BB")
+
+    def reject():
+        try:
+            tokens.verify_token(tampered)
+        except tokens.InvalidToken:
+            pass
+
+    n = args.iterations
+    report("issue", timeit.timeit(lambda: tokens.issue_token(USER_ID, "tenant1"), number=n), n)
+    report("verify", timeit.timeit(lambda: tokens.verify_token(token), number=n), n)
+    report(
+        "authorization",
+        timeit.timeit(lambda: tokens.user_from_authorization(header), number=n),
+        n,
+    )
+    report("rotated_kid", timeit.timeit(lambda: tokens.verify_token(old_token), number=n), n)
+    report("bad_signature", timeit.timeit(reject, number=n), n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark: latencia de invocaciones calientes con y sin el registro de clientes
+
+Simula N invocaciones calientes de un handler que lee un item de DynamoDB:
+  - before: boto3.resource("dynamodb") + Table(...) en cada invocación
+  - after:  bookstore_common.aws.get_table(...) (cacheado a nivel de módulo)
+
+Con --setup-only no se hace ninguna llamada de red y se mide sólo el coste
+de construir los objetos de botocore.
+
+Uso:
+    docker run -p 8000:8000 amazon/dynamodb-local
+    python benchmarks/bench_warm_invocation.py --invocations 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import boto3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+
+from bookstore_common import aws  # noqa: E402
+
+TABLE_NAME = "bookstore-warm-bench"
+
+
+def ensure_table(endpoint_url):
+    dynamodb = boto3.resource("dynamodb", endpoint_url=endpoint_url)
+    if TABLE_NAME not in [table.name for table in dynamodb.tables.all()]:
+        table = dynamodb.create_table(
+            TableName=TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            AttributeDefinitions=[
+                {"AttributeName": "pk", "AttributeType": "S"},
+                {"AttributeName": "sk", "AttributeType": "S"},
+            ],
+            KeySchema=[
+                {"AttributeName": "pk", "KeyType": "HASH"},
+                {"AttributeName": "sk", "KeyType": "RANGE"},
+            ],
+        )
+        table.wait_until_exists()
+        table.put_item(Item={"pk": "USER#bench#1", "sk": "PROFILE", "name": "bench"})
+
+
+def invoke_before(setup_only):
+    dynamodb = boto3.resource("dynamodb")
+    table = dynamodb.Table(TABLE_NAME)
+    if not setup_only:
+        table.get_item(Key={"pk": "USER#bench#1", "sk": "PROFILE"})
+
+
+def invoke_after(setup_only):
+    table = aws.get_table(TABLE_NAME)
+    if not setup_only:
+        table.get_item(Key={"pk": "USER#bench#1", "sk": "PROFILE"})
+
+
+def run(name, fn, invocations, setup_only):
+    fn(setup_only)  # invocación fría, fuera de la medición
+    samples = []
+    for _ in range(invocations):
+        start = time.perf_counter()
+        fn(setup_only)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(
+        f"{name:<7} invocations={invocations:<5} "
+        f"p50={statistics.median(samples):8.2f} ms  p99={p99:8.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--endpoint-url", default="http://localhost:8000")
+    parser.add_argument("--invocations", type=int, default=200)
+    parser.add_argument("--setup-only", action="store_true")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = args.endpoint_url
+
+    if not args.setup_only:
+        ensure_table(args.endpoint_url)
+
+    aws.reset()
+    run("before", invoke_before, args.invocations, args.setup_only)
+    run("after", invoke_after, args.invocations, args.setup_only)
+
+
+if __name__ == "__main__":
+    main()
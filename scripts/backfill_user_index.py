@@ -0,0 +1,89 @@
+"""
+Backfill de los índices de usuarios (listado, búsqueda y unicidad de email)
+
+Los perfiles creados antes de estos índices no tienen gsi2pk/gsi2sk (no salen
+en GET /api/v1/users), ni items SEARCH# (no salen en ?search=), ni el
+centinela EMAIL#{tenant}#{email} que el registro usa para rechazar emails
+duplicados. Este script recorre los perfiles y crea lo que falte. Es
+idempotente: un perfil ya indexado no genera escrituras de perfil ni tokens.
+
+Uso:
+    python scripts/backfill_user_index.py --stage dev
+    python scripts/backfill_user_index.py --endpoint-url http://localhost:8000
+"""
+
+import argparse
+import os
+import sys
+
+from boto3.dynamodb.conditions import Attr
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+
+from bookstore_common import aws, user_search  # noqa: E402
+
+
+def scan_profiles(table):
+    """Perfiles de la tabla (sk = PROFILE), siguiendo LastEvaluatedKey"""
+    scan_params = {"FilterExpression": Attr("sk").eq("PROFILE")}
+    while True:
+        response = table.scan(**scan_params)
+        yield from response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        scan_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stage", default="dev")
+    parser.add_argument("--table", help="Por defecto bookstore-users-{stage}")
+    parser.add_argument("--endpoint-url", help="DynamoDB Local, p. ej. http://localhost:8000")
+    args = parser.parse_args()
+
+    if args.endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = args.endpoint_url
+    table = aws.get_table(args.table or f"bookstore-users-{args.stage}")
+
+    profiles = listed = reserved = 0
+    for profile in scan_profiles(table):
+        profiles += 1
+        if "gsi2pk" not in profile:
+            keys = user_search.listing_keys(
+                profile["tenant_id"], profile["user_id"], profile.get("created_at", "")
+            )
+            table.update_item(
+                Key={"pk": profile["pk"], "sk": profile["sk"]},
+                UpdateExpression="SET gsi2pk = :gsi2pk, gsi2sk = :gsi2sk",
+                ExpressionAttributeValues={
+                    ":gsi2pk": keys["gsi2pk"],
+                    ":gsi2sk": keys["gsi2sk"],
+                },
+            )
+            listed += 1
+        user_search.sync_search_tokens(table, profile)
+
+        try:
+            table.put_item(
+                Item={
+                    "pk": f'EMAIL#{profile["tenant_id"]}#{profile["email"]}',
+                    "sk": "EMAIL",
+                    "user_id": profile["user_id"],
+                    "tenant_id": profile["tenant_id"],
+                    "entity_type": "USER_EMAIL",
+                },
+                ConditionExpression="attribute_not_exists(pk)",
+            )
+            reserved += 1
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    print(
+        f"Perfiles revisados: {profiles}, añadidos al listado: {listed}, "
+        f"emails reservados: {reserved}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Detectar (y opcionalmente reparar) diferencias entre DynamoDB y Elasticsearch
+
+El stream processor registra los errores y sigue, así que el índice de
+búsqueda puede quedar desincronizado sin que nadie se entere. Este script
+compara ambos lados sin cargar ninguno completo en memoria:
+
+  1. Digests por bucket: cada libro cae en un bucket según un hash de su
+     book_id; por (tenant, bucket) se acumulan el número de libros y la suma
+     (mod 2^64) de hash(book_id, updated_at). La suma no depende del orden,
+     así que sirve igual para el Scan paralelo de DynamoDB (un worker por
+     segmento) que para el barrido del índice con PIT + search_after.
+  2. Sólo los buckets con digest distinto se vuelven a recorrer guardando los
+     ids, para listar libros que faltan en el índice, sobran o tienen un
+     updated_at distinto.
+  3. Con --repair los que faltan o están desactualizados se reindexan desde
+     DynamoDB y los que sobran se borran del índice.
+
+El resultado es aproximado si hay escrituras durante la comprobación: un
+libro modificado entre los dos recorridos aparece como desactualizado (y
+--repair lo deja bien igualmente).
+
+Uso:
+    python scripts/check_books_drift.py --stage dev
+    python scripts/check_books_drift.py --endpoint-url http://localhost:8000 \\
+        --es-host http://localhost:9200 --tenant tenant1 --repair
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+sys.path.insert(0, os.path.join(ROOT, "services", "stream-processors"))
+
+from bookstore_common import aws  # noqa: E402
+
+DIGEST_MASK = 2 ** 64 - 1
+ES_PAGE_SIZE = 5000
+PIT_KEEP_ALIVE = "2m"
+BATCH_GET_SIZE = 100
+
+
+def bucket_of(book_id, buckets):
+    digest = hashlib.blake2b(book_id.encode(), digest_size=4).digest()
+    return int.from_bytes(digest, "big") % buckets
+
+
+def item_hash(book_id, updated_at):
+    digest = hashlib.blake2b(f"{book_id}\0{updated_at}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class Digests:
+    """(tenant, bucket) -> [libros, suma de hashes]"""
+
+    def __init__(self):
+        self.buckets = defaultdict(lambda: [0, 0])
+
+    def add(self, tenant_id, bucket, book_id, updated_at):
+        entry = self.buckets[(tenant_id, bucket)]
+        entry[0] += 1
+        entry[1] = (entry[1] + item_hash(book_id, updated_at)) & DIGEST_MASK
+
+    def merge(self, other):
+        for key, (count, total) in other.buckets.items():
+            entry = self.buckets[key]
+            entry[0] += count
+            entry[1] = (entry[1] + total) & DIGEST_MASK
+
+    def mismatched(self, other):
+        keys = set(self.buckets) | set(other.buckets)
+        return {key for key in keys if self.buckets.get(key) != other.buckets.get(key)}
+
+
+class DriftChecker:
+    def __init__(self, args, processor, es_client):
+        self.args = args
+        self.processor = processor
+        self.es = es_client
+        self.dynamodb = aws.get_client("dynamodb")
+
+    # --- DynamoDB ---
+
+    def scan_segment(self, segment):
+        """Libros de un segmento del Scan: (tenant_id, book_id, updated_at, pk, sk)"""
+        params = {
+            "TableName": self.args.table,
+            "Segment": segment,
+            "TotalSegments": self.args.segments,
+            "FilterExpression": "begins_with(sk, :book)",
+            "ProjectionExpression": "pk, sk, book_id, tenant_id, updated_at",
+            "ExpressionAttributeValues": {":book": {"S": "BOOK#"}},
+        }
+        if self.args.tenant:
+            prefixes = []
+            for i, tenant_id in enumerate(self.args.tenant):
+                prefixes.append(f"begins_with(pk, :tenant{i})")
+                params["ExpressionAttributeValues"][f":tenant{i}"] = {"S": f"{tenant_id}#"}
+            params["FilterExpression"] += f" AND ({' OR '.join(prefixes)})"
+
+        while True:
+            response = self.dynamodb.scan(**params)
+            for item in response["Items"]:
+                yield (
+                    item.get("tenant_id", {}).get("S", ""),
+                    item.get("book_id", {}).get("S", ""),
+                    item.get("updated_at", {}).get("S", ""),
+                    item["pk"]["S"],
+                    item["sk"]["S"],
+                )
+            if "LastEvaluatedKey" not in response:
+                return
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def parallel_scan(self, visit):
+        """Aplicar visit(segment_rows) a cada segmento en paralelo; devuelve los resultados"""
+        with ThreadPoolExecutor(max_workers=self.args.segments) as pool:
+            futures = [
+                pool.submit(visit, self.scan_segment(segment))
+                for segment in range(self.args.segments)
+            ]
+            return [future.result() for future in futures]
+
+    def dynamo_digests(self):
+        def visit(rows):
+            digests = Digests()
+            for tenant_id, book_id, updated_at, _, _ in rows:
+                digests.add(tenant_id, bucket_of(book_id, self.args.buckets), book_id, updated_at)
+            return digests
+
+        digests = Digests()
+        for partial in self.parallel_scan(visit):
+            digests.merge(partial)
+        return digests
+
+    def dynamo_rows(self, mismatched):
+        """book_id -> (updated_at, pk, sk) de los libros en buckets con diferencias"""
+        def visit(rows):
+            found = {}
+            for tenant_id, book_id, updated_at, pk, sk in rows:
+                if (tenant_id, bucket_of(book_id, self.args.buckets)) in mismatched:
+                    found[(tenant_id, book_id)] = (updated_at, pk, sk)
+            return found
+
+        rows = {}
+        for partial in self.parallel_scan(visit):
+            rows.update(partial)
+        return rows
+
+    # --- Elasticsearch ---
+
+    def sweep_index(self, tenant_id):
+        """(book_id, updated_at) de todo el índice del tenant con PIT + search_after"""
+        index_name = self.processor.index_name_for(tenant_id)
+        if not self.es.indices.exists(index=index_name):
+            return
+        pit_id = self.es.open_point_in_time(index=index_name, keep_alive=PIT_KEEP_ALIVE)["id"]
+        body = {
+            "size": ES_PAGE_SIZE,
+            "_source": ["book_id", "updated_at"],
+            # El filtro explícito cubre también el índice compartido
+            "query": {"term": {"tenant_id": tenant_id}},
+            "sort": [{"_shard_doc": "asc"}],
+            "track_total_hits": False,
+        }
+        try:
+            while True:
+                body["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+                response = self.es.search(body=body)
+                pit_id = response.get("pit_id", pit_id)
+                hits = response["hits"]["hits"]
+                for hit in hits:
+                    source = hit["_source"]
+                    yield source.get("book_id") or hit["_id"], source.get("updated_at", "")
+                if len(hits) < ES_PAGE_SIZE:
+                    return
+                body["search_after"] = hits[-1]["sort"]
+        finally:
+            self.es.close_point_in_time(body={"id": pit_id})
+
+    def es_digests(self, tenants):
+        def visit(tenant_id):
+            digests = Digests()
+            for book_id, updated_at in self.sweep_index(tenant_id):
+                digests.add(tenant_id, bucket_of(book_id, self.args.buckets), book_id, updated_at)
+            return digests
+
+        digests = Digests()
+        with ThreadPoolExecutor(max_workers=self.args.es_workers) as pool:
+            for partial in pool.map(visit, sorted(tenants)):
+                digests.merge(partial)
+        return digests
+
+    def es_rows(self, mismatched):
+        """book_id -> updated_at de los documentos en buckets con diferencias"""
+        rows = {}
+        for tenant_id in sorted({tenant_id for tenant_id, _ in mismatched}):
+            for book_id, updated_at in self.sweep_index(tenant_id):
+                if (tenant_id, bucket_of(book_id, self.args.buckets)) in mismatched:
+                    rows[(tenant_id, book_id)] = updated_at
+        return rows
+
+    # --- Reparación ---
+
+    def repair(self, dynamo_rows, reindex, delete):
+        """Reindexar desde DynamoDB los libros indicados y borrar los sobrantes"""
+        actions = []
+        keys = [dynamo_rows[key][1:] for key in reindex]
+        for offset in range(0, len(keys), BATCH_GET_SIZE):
+            request = {
+                self.args.table: {
+                    "Keys": [{"pk": {"S": pk}, "sk": {"S": sk}} for pk, sk in keys[offset:offset + BATCH_GET_SIZE]]
+                }
+            }
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.args.table, []):
+                    doc = self.processor.build_book_doc(item)
+                    metadata = {"_index": self.processor.index_name_for(doc["tenant_id"]), "_id": doc["book_id"]}
+                    actions.append(self.processor.BulkAction(doc["book_id"], {"index": metadata}, doc, None))
+                request = response.get("UnprocessedKeys")
+
+        for tenant_id, book_id in delete:
+            metadata = {"_index": self.processor.index_name_for(tenant_id), "_id": book_id}
+            actions.append(self.processor.BulkAction(book_id, {"delete": metadata}, None, None))
+
+        failed = []
+        for offset in range(0, len(actions), self.args.repair_batch_size):
+            failed.extend(
+                self.processor.send_bulk(self.es, actions[offset:offset + self.args.repair_batch_size])
+            )
+        return len(actions) - len(failed), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stage", default="dev")
+    parser.add_argument("--table", help="Por defecto bookstore-books-{stage}")
+    parser.add_argument("--endpoint-url", help="DynamoDB Local, p. ej. http://localhost:8000")
+    parser.add_argument("--es-host", help="Por defecto ELASTICSEARCH_HOST o http://localhost:9200")
+    parser.add_argument("--tenant", action="append", help="Limitar a un tenant (repetible)")
+    parser.add_argument("--segments", type=int, default=8, help="Segmentos del Scan de DynamoDB")
+    parser.add_argument("--es-workers", type=int, default=4, help="Índices barridos en paralelo")
+    parser.add_argument("--buckets", type=int, default=4096)
+    parser.add_argument("--repair", action="store_true")
+    parser.add_argument("--repair-batch-size", type=int, default=500)
+    parser.add_argument("--report", help="Guardar las diferencias en un fichero JSON")
+    args = parser.parse_args()
+
+    if args.endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = args.endpoint_url
+    if args.es_host:
+        os.environ["ELASTICSEARCH_HOST"] = args.es_host
+    args.table = args.table or f"bookstore-books-{args.stage}"
+
+    import books_stream_processor as processor
+
+    es_client = processor.get_elasticsearch_client()
+    if not es_client:
+        raise SystemExit("No se pudo conectar a Elasticsearch")
+    checker = DriftChecker(args, processor, es_client)
+
+    dynamo = checker.dynamo_digests()
+    tenants = {tenant_id for tenant_id, _ in dynamo.buckets} | set(args.tenant or [])
+    es = checker.es_digests(tenants)
+    mismatched = dynamo.mismatched(es)
+
+    total = sum(count for count, _ in dynamo.buckets.values())
+    indexed = sum(count for count, _ in es.buckets.values())
+    print(
+        f"DynamoDB: {total} libros, Elasticsearch: {indexed} documentos, "
+        f"{len(tenants)} tenants; buckets distintos: {len(mismatched)}/{len(set(dynamo.buckets) | set(es.buckets))}"
+    )
+    if not mismatched:
+        return
+
+    dynamo_rows = checker.dynamo_rows(mismatched)
+    es_rows = checker.es_rows(mismatched)
+    missing = sorted(set(dynamo_rows) - set(es_rows))
+    extra = sorted(set(es_rows) - set(dynamo_rows))
+    stale = sorted(
+        key for key in set(dynamo_rows) & set(es_rows) if dynamo_rows[key][0] != es_rows[key]
+    )
+    print(f"Faltan en el índice: {len(missing)}, sobran: {len(extra)}, desactualizados: {len(stale)}")
+    for label, keys in (("falta", missing), ("sobra", extra), ("desactualizado", stale)):
+        for tenant_id, book_id in keys[:10]:
+            print(f"  {label}: {tenant_id}/{book_id}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(
+                {
+                    "missing": [list(key) for key in missing],
+                    "extra": [list(key) for key in extra],
+                    "stale": [list(key) for key in stale],
+                },
+                f,
+                indent=2,
+            )
+
+    if args.repair:
+        repaired, failed = checker.repair(dynamo_rows, missing + stale, extra)
+        print(f"Reparados: {repaired}, fallidos: {len(failed)}")
+        if failed:
+            raise SystemExit(1)
+    else:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
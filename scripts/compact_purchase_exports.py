@@ -0,0 +1,104 @@
+"""
+Compactar las exportaciones de compras acumuladas en el bucket de analytics
+
+Años de exportaciones de un JSON por compra (y los .ndjson.gz por batch del
+exportador actual) dejan millones de objetos pequeños. Este script recorre
+las particiones (tenant, día) de una en una y las fusiona con
+purchases_compaction (lecturas en streaming, upload multipart, manifest y
+borrado de los originales sólo tras verificar la salida). La Lambda
+purchasesCompaction hace lo mismo cada noche con los días recientes; el
+script es para el histórico.
+
+Es reanudable: relanzarlo retoma las particiones a medias y se salta las que
+ya no tienen objetos pequeños.
+
+Uso:
+    python scripts/compact_purchase_exports.py --stage dev --dry-run
+    python scripts/compact_purchase_exports.py --stage prod --from 2021-01-01 --to 2023-12-31
+    python scripts/compact_purchase_exports.py --endpoint-url http://localhost:4566 --tenant tenant1
+    python scripts/compact_purchase_exports.py --local-dir /tmp/analytics-copy
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+sys.path.insert(0, os.path.join(ROOT, "services", "stream-processors"))
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def partition_dates(store, tenant_id):
+    """Días con datos de un tenant, según los prefijos year=/month=/day="""
+    dates = []
+    for year in store.list(f"{tenant_id}/purchases/", delimiter="/"):
+        for month in store.list(year, delimiter="/"):
+            for day in store.list(month, delimiter="/"):
+                values = [part.split("=", 1)[1] for part in day.rstrip("/").split("/")[-3:]]
+                dates.append(datetime(*(int(value) for value in values)))
+    return sorted(dates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stage", default="dev")
+    parser.add_argument("--bucket", help="Por defecto bookstore-analytics-{stage}")
+    parser.add_argument("--endpoint-url", help="S3 local, p. ej. http://localhost:4566")
+    parser.add_argument("--local-dir", help="Compactar un directorio local con el layout del bucket")
+    parser.add_argument("--tenant", action="append", help="Limitar a un tenant (repetible)")
+    parser.add_argument("--from", dest="date_from", type=parse_date, help="Primer día (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=parse_date, help="Último día (por defecto hace 2 días)")
+    parser.add_argument("--target-size-mb", type=int, default=256, help="Tamaño sin comprimir por fichero")
+    parser.add_argument("--min-objects", type=int, default=2, help="No tocar particiones con menos objetos")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_S3"] = args.endpoint_url
+
+    import purchases_compaction as compaction
+
+    if args.local_dir:
+        store = compaction.LocalStore(args.local_dir)
+    else:
+        store = compaction.S3Store(args.bucket or f"bookstore-analytics-{args.stage}")
+
+    # Los días recientes aún reciben batches: por defecto se dejan a la Lambda
+    date_to = args.date_to or datetime.utcnow() - timedelta(days=compaction.MIN_AGE_DAYS)
+    tenants = args.tenant or compaction.list_tenants(store)
+    totals = {}
+    failed = 0
+
+    for tenant_id in tenants:
+        for date in partition_dates(store, tenant_id):
+            if date > date_to or (args.date_from and date < args.date_from):
+                continue
+            try:
+                result = compaction.compact_partition(
+                    store,
+                    tenant_id,
+                    date,
+                    target_bytes=args.target_size_mb * 2 ** 20,
+                    min_objects=args.min_objects,
+                    dry_run=args.dry_run,
+                )
+            except Exception as e:
+                failed += 1
+                print(f"ERROR {tenant_id} {date:%Y-%m-%d}: {e}", file=sys.stderr)
+                continue
+            totals[result["status"]] = totals.get(result["status"], 0) + 1
+            if result["status"] != "skipped":
+                print(f"{tenant_id} {date:%Y-%m-%d}: {result}")
+
+    print(f"Particiones: {totals}, errores: {failed}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
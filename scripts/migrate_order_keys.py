@@ -0,0 +1,122 @@
+"""
+Migración: reescribir las claves de índice de las órdenes existentes
+
+  - GSI1: las órdenes creadas antes de los ULID tienen gsi1sk = ORDER#{uuid4},
+    que no ordena por fecha, así que GET /api/v1/orders (ScanIndexForward=False)
+    las devolvería desordenadas. Se reescribe como ORDER#{ulid} con el
+    timestamp de created_at.
+  - GSI2: las órdenes sin gsi2pk/gsi2sk no aparecen en los filtros por status;
+    se añade gsi2sk = STATUS#{status}#{created_at}#{order_id}.
+
+El order_id y la pk no cambian (siguen siendo válidos los enlaces y los datos
+ya exportados a S3); sólo cambian las claves de los índices. Cada update es
+condicional sobre los valores leídos, por lo que el script es idempotente y
+se puede relanzar si se interrumpe.
+
+Uso:
+    python scripts/migrate_order_keys.py --stage dev --dry-run
+    python scripts/migrate_order_keys.py --table bookstore-purchases-dev
+    python scripts/migrate_order_keys.py --endpoint-url http://localhost:8000
+"""
+
+import argparse
+import os
+import sys
+
+from boto3.dynamodb.conditions import Attr
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+
+from bookstore_common import aws, ids  # noqa: E402
+
+ORDER_PREFIX = "ORDER#"
+
+
+def key_updates(item):
+    """Atributos de índice que hay que reescribir en la orden (dict vacío si ninguno)"""
+    if not item.get("created_at"):
+        return {}
+
+    updates = {}
+    gsi1sk = item.get("gsi1sk", "")
+    if gsi1sk.startswith(ORDER_PREFIX) and not ids.is_ulid(gsi1sk[len(ORDER_PREFIX):]):
+        updates["gsi1sk"] = ORDER_PREFIX + ids.ulid_from_datetime(item["created_at"])
+
+    if "gsi2sk" not in item and item.get("gsi1pk"):
+        updates["gsi2pk"] = item["gsi1pk"]
+        updates["gsi2sk"] = "STATUS#{}#{}#{}".format(
+            item.get("status", "unknown"), item["created_at"], item.get("order_id", "")
+        )
+    return updates
+
+
+def scan_orders(table):
+    """Órdenes de la tabla (sk = DETAILS), siguiendo LastEvaluatedKey"""
+    scan_params = {
+        "FilterExpression": Attr("sk").eq("DETAILS") & Attr("pk").begins_with("ORDER#"),
+        "ProjectionExpression": "pk, sk, gsi1pk, gsi1sk, gsi2sk, order_id, #status, created_at",
+        "ExpressionAttributeNames": {"#status": "status"},
+    }
+    while True:
+        response = table.scan(**scan_params)
+        yield from response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        scan_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def migrate_order(table, item, updates):
+    """Aplicar `updates`; devuelve False si otro proceso ya cambió la orden"""
+    values = {f":{name}": value for name, value in updates.items()}
+    conditions = []
+    if "gsi1sk" in updates:
+        conditions.append("gsi1sk = :old_gsi1sk")
+        values[":old_gsi1sk"] = item["gsi1sk"]
+    if "gsi2sk" in updates:
+        conditions.append("attribute_not_exists(gsi2sk)")
+
+    try:
+        table.update_item(
+            Key={"pk": item["pk"], "sk": item["sk"]},
+            UpdateExpression="SET " + ", ".join(f"{name} = :{name}" for name in updates),
+            ConditionExpression=" AND ".join(conditions),
+            ExpressionAttributeValues=values,
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stage", default="dev")
+    parser.add_argument("--table", help="Por defecto bookstore-purchases-{stage}")
+    parser.add_argument("--endpoint-url", help="DynamoDB Local, p. ej. http://localhost:8000")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = args.endpoint_url
+    table = aws.get_table(args.table or f"bookstore-purchases-{args.stage}")
+
+    scanned = migrated = skipped = 0
+    for item in scan_orders(table):
+        scanned += 1
+        updates = key_updates(item)
+        if not updates:
+            continue
+        if args.dry_run:
+            print(f"{item['pk']}: {updates}")
+            migrated += 1
+        elif migrate_order(table, item, updates):
+            migrated += 1
+        else:
+            skipped += 1
+
+    action = "a migrar" if args.dry_run else "migradas"
+    print(f"Órdenes revisadas: {scanned}, {action}: {migrated}, cambiadas por otro proceso: {skipped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Consultas de analytics sobre las compras exportadas, sin Athena
+
+Lee las particiones {tenant}/purchases/year=/month=/day=/ que escribe
+purchases_stream_processor (NDJSON comprimido, los JSON sueltos del
+exportador antiguo y los compacted-*.ndjson.gz) desde un directorio local o
+un S3 (también uno local con --s3-endpoint-url), y calcula agregados por grupo:
+
+  1. Poda de particiones: sólo se listan los tenants, años, meses y días
+     dentro del filtro (--tenant, --from, --to).
+  2. Cada partición se parsea con el lector JSON de pyarrow (en C++, sin
+     pasar por dicts de Python) y se queda con la última versión de cada
+     compra, igual que purchases_parquet.
+  3. Filtros, explosión de items y group-by con kernels de pyarrow.compute;
+     cada partición se reduce a un agregado parcial y se descarta, así que la
+     memoria depende del tamaño de un día de un tenant, no del rango.
+
+Medidas: orders (compras distintas), revenue e items, con la misma semántica
+que el cubo de rollups: agrupando por book o category, revenue es la suma de
+subtotales de las líneas y orders el número de compras que las incluyen.
+
+--check-rollups compara el resultado con las celdas ROLLUP# de DynamoDB y
+sirve de prueba de regresión del cubo (sólo cuadran los periodos completos
+procesados desde que existe el cubo; para month, usar meses completos).
+
+Uso:
+    python scripts/query_purchases.py --local-dir /data/analytics \\
+        --from 2025-07-01 --to 2025-07-31 --group-by day,category
+    python scripts/query_purchases.py --stage prod --tenant tenant1 \\
+        --from 2025-07-01 --to 2025-07-31 --group-by payment_method --status completed
+    python scripts/query_purchases.py --stage dev --endpoint-url http://localhost:8000 \\
+        --tenant tenant1 --from 2025-07-01 --to 2025-07-07 --check-rollups day:category
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv
+import pyarrow.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+sys.path.insert(0, os.path.join(ROOT, "services", "stream-processors"))
+
+ITEM_TYPE = pa.struct(
+    [
+        ("book_id", pa.string()),
+        ("quantity", pa.int64()),
+        ("subtotal", pa.float64()),
+        ("category", pa.string()),
+    ]
+)
+
+# Columnas que se leen de cada fila exportada; el resto se ignora
+SCHEMA = pa.schema(
+    [
+        ("purchase_id", pa.string()),
+        ("tenant_id", pa.string()),
+        ("user_id", pa.string()),
+        ("total_amount", pa.float64()),
+        ("status", pa.string()),
+        ("payment_method", pa.string()),
+        ("created_at", pa.string()),
+        ("updated_at", pa.string()),
+        ("items", pa.list_(ITEM_TYPE)),
+    ]
+)
+
+# Claves de agrupación: periodos (prefijo de created_at), columnas de la
+# compra y columnas de las líneas (éstas explotan los items)
+PERIOD_KEYS = {"hour": 13, "day": 10, "month": 7}
+PURCHASE_KEYS = ("tenant_id", "status", "payment_method", "user_id")
+ITEM_KEYS = {"book": "book_id", "category": "category"}
+GROUP_KEYS = (*PERIOD_KEYS, *PURCHASE_KEYS, *ITEM_KEYS)
+
+# Valores vacíos que el cubo de rollups cuenta como "unknown"
+UNKNOWN_DEFAULTS = ("payment_method", "book", "category")
+
+MEASURES = ("orders", "revenue", "items")
+REDUCE_EVERY = 64
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def _in_range(value, low, high):
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+def partitions(store, compaction, tenants=None, date_from=None, date_to=None):
+    """(tenant, fecha, prefijo) de las particiones dentro del filtro, podando al listar"""
+    for tenant_id in tenants or compaction.list_tenants(store):
+        for year_prefix in store.list(f"{tenant_id}/purchases/", delimiter="/"):
+            year = int(year_prefix.rstrip("/").rsplit("=", 1)[1])
+            if not _in_range(year, date_from and date_from.year, date_to and date_to.year):
+                continue
+            for month_prefix in store.list(year_prefix, delimiter="/"):
+                month = (year, int(month_prefix.rstrip("/").rsplit("=", 1)[1]))
+                if not _in_range(
+                    month,
+                    date_from and (date_from.year, date_from.month),
+                    date_to and (date_to.year, date_to.month),
+                ):
+                    continue
+                for day_prefix in store.list(month_prefix, delimiter="/"):
+                    date = datetime(*month, int(day_prefix.rstrip("/").rsplit("=", 1)[1]))
+                    if _in_range(date, date_from, date_to):
+                        yield tenant_id, date, day_prefix
+
+
+def read_partition(store, prefix):
+    """Todas las filas de una partición como tabla de Arrow (con duplicados)"""
+    tables = []
+    legacy_rows = []
+    parse_options = pyarrow.json.ParseOptions(
+        explicit_schema=SCHEMA, unexpected_field_behavior="ignore"
+    )
+    for key, _ in store.list(prefix):
+        if key.endswith(".json"):
+            # Exportador antiguo: un documento (pequeño) por objeto
+            with store.open(key) as body:
+                legacy_rows.append(json.loads(body.read()))
+            continue
+        with store.open(key) as body:
+            stream = gzip.GzipFile(fileobj=body) if key.endswith(".gz") else body
+            tables.append(pyarrow.json.read_json(stream, parse_options=parse_options))
+    if legacy_rows:
+        tables.append(pa.Table.from_pylist(legacy_rows, schema=SCHEMA))
+    if not tables:
+        return SCHEMA.empty_table()
+    return pa.concat_tables(tables)
+
+
+def latest_versions(table):
+    """Última versión de cada compra (mayor updated_at; a igualdad, la última leída)"""
+    if table.num_rows == 0:
+        return table
+    table = table.append_column("_row", pa.array(range(table.num_rows), pa.int64()))
+    table = table.sort_by(
+        [("purchase_id", "ascending"), ("updated_at", "descending"), ("_row", "descending")]
+    )
+    ids = table.column("purchase_id").combine_chunks()
+    first = pc.not_equal(ids[1:], ids[:-1]).fill_null(True)
+    mask = pa.concat_arrays([pa.array([True]), first])
+    return table.filter(mask).drop_columns(["_row"])
+
+
+def filter_rows(table, date_from=None, date_to=None, equals=None):
+    """created_at en [date_from, date_to] (días completos) y columnas == valor"""
+    conditions = []
+    created_at = table.column("created_at")
+    if date_from:
+        conditions.append(pc.greater_equal(created_at, f"{date_from:%Y-%m-%d}"))
+    if date_to:
+        conditions.append(pc.less(created_at, f"{date_to + timedelta(days=1):%Y-%m-%d}"))
+    for column, value in (equals or {}).items():
+        conditions.append(pc.equal(table.column(column), value))
+    if not conditions:
+        return table
+    mask = conditions[0]
+    for condition in conditions[1:]:
+        mask = pc.and_(mask, condition)
+    return table.filter(mask)
+
+
+def _or_unknown(values):
+    values = pc.fill_null(values, "unknown")
+    return pc.if_else(pc.equal(values, ""), "unknown", values)
+
+
+def partial_aggregate(table, group_by):
+    """Agregado (claves + orders/revenue/items) de las compras de una partición"""
+    items = table.column("items").combine_chunks()
+    parents = pc.list_parent_indices(items)
+    lines = pc.list_flatten(items)
+
+    if any(key in ITEM_KEYS for key in group_by):
+        # Una fila por línea, con las columnas de su compra
+        source = table.take(parents)
+        columns = {
+            "purchase_id": source.column("purchase_id"),
+            "revenue": lines.field("subtotal").fill_null(0),
+            "items": lines.field("quantity").fill_null(0),
+        }
+        for key, field in ITEM_KEYS.items():
+            if key in group_by:
+                columns[key] = lines.field(field)
+    else:
+        source = table
+        # Unidades por compra: suma de quantity agrupando las líneas por compra
+        per_purchase = (
+            pa.table({"_row": parents, "quantity": lines.field("quantity").fill_null(0)})
+            .group_by("_row")
+            .aggregate([("quantity", "sum")])
+        )
+        units = (
+            pa.table({"_row": pa.array(range(table.num_rows), pa.int64())})
+            .join(per_purchase, "_row", join_type="left outer")
+            .sort_by("_row")
+            .column("quantity_sum")
+        )
+        columns = {
+            "purchase_id": source.column("purchase_id"),
+            "revenue": source.column("total_amount").fill_null(0),
+            "items": units.fill_null(0),
+        }
+
+    for key in group_by:
+        if key in PERIOD_KEYS:
+            columns[key] = pc.utf8_slice_codeunits(source.column("created_at"), 0, PERIOD_KEYS[key])
+        elif key in PURCHASE_KEYS:
+            columns[key] = source.column(key)
+    for key in UNKNOWN_DEFAULTS:
+        if key in columns:
+            columns[key] = _or_unknown(columns[key])
+
+    aggregated = (
+        pa.table(columns)
+        .group_by(list(group_by))
+        .aggregate([("purchase_id", "count_distinct"), ("revenue", "sum"), ("items", "sum")])
+    )
+    return _measure_names(aggregated, {"purchase_id_count_distinct": "orders"})
+
+
+def _measure_names(table, names=None):
+    """Quitar el sufijo _sum de las medidas (el orden de columnas cambia entre versiones de pyarrow)"""
+    names = {**{f"{measure}_sum": measure for measure in MEASURES}, **(names or {})}
+    return table.rename_columns([names.get(name, name) for name in table.column_names])
+
+
+def reduce_partials(partials, group_by):
+    """
+    Fusionar agregados parciales sumando medidas. Sumar orders es exacto porque
+    una compra sólo aparece en la partición de su created_at
+    """
+    if not partials:
+        return pa.table(
+            {
+                **{key: pa.array([], pa.string()) for key in group_by},
+                "orders": pa.array([], pa.int64()),
+                "revenue": pa.array([], pa.float64()),
+                "items": pa.array([], pa.int64()),
+            }
+        )
+    aggregated = (
+        pa.concat_tables(partials)
+        .group_by(list(group_by))
+        .aggregate([(measure, "sum") for measure in MEASURES])
+    )
+    return _measure_names(aggregated)
+
+
+def run_query(store, compaction, group_by=(), tenants=None, date_from=None, date_to=None,
+              equals=None, stats=None):
+    """Tabla con las claves de group_by y orders/revenue/items, ordenada por claves"""
+    unknown = [key for key in group_by if key not in GROUP_KEYS]
+    if unknown:
+        raise ValueError(f"Claves de agrupación desconocidas: {', '.join(unknown)}")
+    stats = stats if stats is not None else {}
+    stats.update(partitions=0, rows=0)
+
+    partials = []
+    for _, _, prefix in partitions(store, compaction, tenants, date_from, date_to):
+        table = latest_versions(read_partition(store, prefix))
+        table = filter_rows(table, date_from, date_to, equals)
+        stats["partitions"] += 1
+        stats["rows"] += table.num_rows
+        if table.num_rows:
+            partials.append(partial_aggregate(table, group_by))
+        if len(partials) >= REDUCE_EVERY:
+            partials = [reduce_partials(partials, group_by)]
+
+    result = reduce_partials(partials, group_by)
+    result = result.set_column(
+        result.schema.get_field_index("revenue"), "revenue", pc.round(result.column("revenue"), 2)
+    )
+    result = result.select([*group_by, *MEASURES])
+    if group_by:
+        result = result.sort_by([(key, "ascending") for key in group_by])
+    return result
+
+
+def check_rollups(result, cells, grain, dimension):
+    """Diferencias entre el resultado de las exportaciones y las celdas del cubo"""
+    exported = {
+        (row[grain], row.get(dimension, "ALL")): (row["orders"], round(row["revenue"], 2), row["items"])
+        for row in result.to_pylist()
+    }
+    stored = {
+        (cell["period"], cell["value"]): (cell["orders"], cell["revenue"], cell["items"])
+        for cell in cells
+    }
+    differences = []
+    for cell in sorted(exported.keys() | stored.keys()):
+        expected = exported.get(cell)
+        actual = stored.get(cell)
+        if expected is None or actual is None or any(
+            abs(a - b) > 0.01 for a, b in zip(expected, actual)
+        ):
+            differences.append({"cell": cell, "exports": expected, "rollup": actual})
+    return differences
+
+
+def print_table(result, output_format):
+    if output_format == "json":
+        print(json.dumps(result.to_pylist(), indent=2))
+    elif output_format == "csv":
+        buffer = pa.BufferOutputStream()
+        pyarrow.csv.write_csv(result, buffer)
+        sys.stdout.write(buffer.getvalue().to_pybytes().decode())
+    else:
+        rows = [[str(value) if not isinstance(value, float) else f"{value:.2f}" for value in row.values()]
+                for row in result.to_pylist()]
+        widths = [
+            max([len(name)] + [len(row[index]) for row in rows])
+            for index, name in enumerate(result.column_names)
+        ]
+        print("  ".join(name.ljust(width) for name, width in zip(result.column_names, widths)))
+        for row in rows:
+            print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stage", default="dev")
+    parser.add_argument("--bucket", help="Por defecto bookstore-analytics-{stage}")
+    parser.add_argument("--s3-endpoint-url", help="S3 local, p. ej. http://localhost:4566")
+    parser.add_argument("--local-dir", help="Directorio local con el layout del bucket")
+    parser.add_argument("--tenant", action="append", help="Limitar a un tenant (repetible)")
+    parser.add_argument("--from", dest="date_from", type=parse_date, help="Primer día (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=parse_date, help="Último día (YYYY-MM-DD)")
+    parser.add_argument("--status")
+    parser.add_argument("--payment-method")
+    parser.add_argument("--user-id")
+    parser.add_argument("--group-by", default="", help=f"Separadas por comas: {', '.join(GROUP_KEYS)}")
+    parser.add_argument("--format", choices=("table", "json", "csv"), default="table")
+    parser.add_argument(
+        "--check-rollups",
+        metavar="GRAIN:DIMENSION",
+        help="Comparar con el cubo de DynamoDB, p. ej. day:category (requiere un --tenant)",
+    )
+    parser.add_argument("--table", help="Tabla de compras; por defecto bookstore-purchases-{stage}")
+    parser.add_argument("--endpoint-url", help="DynamoDB Local para --check-rollups")
+    args = parser.parse_args()
+
+    if args.s3_endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_S3"] = args.s3_endpoint_url
+    if args.endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = args.endpoint_url
+
+    import purchases_compaction as compaction
+
+    if args.local_dir:
+        store = compaction.LocalStore(args.local_dir)
+    else:
+        store = compaction.S3Store(args.bucket or f"bookstore-analytics-{args.stage}")
+
+    group_by = [key for key in args.group_by.split(",") if key]
+    if args.check_rollups:
+        grain, _, dimension = args.check_rollups.partition(":")
+        dimension = dimension or "total"
+        if not args.tenant or len(args.tenant) != 1:
+            parser.error("--check-rollups necesita exactamente un --tenant")
+        if not args.date_from or not args.date_to:
+            parser.error("--check-rollups necesita --from y --to")
+        group_by = [grain] + ([dimension] if dimension != "total" else [])
+
+    equals = {
+        column: value
+        for column, value in (
+            ("status", args.status),
+            ("payment_method", args.payment_method),
+            ("user_id", args.user_id),
+        )
+        if value
+    }
+
+    stats = {}
+    start = time.perf_counter()
+    try:
+        result = run_query(
+            store, compaction, group_by, args.tenant, args.date_from, args.date_to, equals, stats
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print(
+        f"{stats['partitions']} particiones, {stats['rows']} compras, "
+        f"{time.perf_counter() - start:.2f} s",
+        file=sys.stderr,
+    )
+
+    if not args.check_rollups:
+        print_table(result, args.format)
+        return
+
+    from bookstore_common import aws, pagination, purchase_analytics
+
+    table = aws.get_table(args.table or f"bookstore-purchases-{args.stage}")
+    cells = pagination.query_all(
+        table,
+        **purchase_analytics.rollup_query(
+            args.tenant[0], grain, dimension,
+            f"{args.date_from:%Y-%m-%d}", f"{args.date_to:%Y-%m-%d}",
+        ),
+    )
+    differences = check_rollups(
+        result, [purchase_analytics.format_rollup_cell(cell) for cell in cells], grain, dimension
+    )
+    for difference in differences:
+        print(json.dumps(difference))
+    print(f"Celdas distintas: {len(differences)}", file=sys.stderr)
+    if differences:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Reconstruir el agregado de analytics de compras (ANALYTICS#{tenant}#{user})
+
+El checkout mantiene el agregado con ADD atómicos, pero las órdenes creadas
+antes de introducirlo no están contadas. Este script recorre todas las
+órdenes, recalcula los contadores de cada usuario en memoria y escribe el
+agregado completo con put_item.
+
+Conviene ejecutarlo con poco tráfico: un checkout que ocurra entre el scan y
+el put_item de su usuario quedaría sin contar (basta con relanzarlo).
+
+Uso:
+    python scripts/rebuild_purchase_analytics.py --stage dev --dry-run
+    python scripts/rebuild_purchase_analytics.py --endpoint-url http://localhost:8000
+"""
+
+import argparse
+import os
+import sys
+from collections import defaultdict
+
+from boto3.dynamodb.conditions import Attr
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+
+from bookstore_common import aws, purchase_analytics  # noqa: E402
+
+
+def scan_orders(table):
+    """Órdenes de la tabla (sk = DETAILS), siguiendo LastEvaluatedKey"""
+    scan_params = {
+        "FilterExpression": Attr("sk").eq("DETAILS") & Attr("pk").begins_with("ORDER#"),
+        "ProjectionExpression": "tenant_id, user_id, #total, #status, created_at",
+        "ExpressionAttributeNames": {"#total": "total", "#status": "status"},
+    }
+    while True:
+        response = table.scan(**scan_params)
+        yield from response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        scan_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stage", default="dev")
+    parser.add_argument("--table", help="Por defecto bookstore-purchases-{stage}")
+    parser.add_argument("--endpoint-url", help="DynamoDB Local, p. ej. http://localhost:8000")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = args.endpoint_url
+    table = aws.get_table(args.table or f"bookstore-purchases-{args.stage}")
+
+    summaries = defaultdict(lambda: defaultdict(int))
+    orders = 0
+    for order in scan_orders(table):
+        if not order.get("created_at") or not order.get("user_id"):
+            continue
+        orders += 1
+        summary = summaries[(order["tenant_id"], order["user_id"])]
+        for attribute, amount in purchase_analytics.order_counters(order).items():
+            summary[attribute] += amount
+
+    with table.batch_writer() as batch:
+        for (tenant_id, user_id), summary in summaries.items():
+            item = {**purchase_analytics.summary_key(tenant_id, user_id), **summary}
+            if args.dry_run:
+                print(item)
+            else:
+                batch.put_item(Item=item)
+
+    print(f"Órdenes: {orders}, agregados {'calculados' if args.dry_run else 'escritos'}: {len(summaries)}")
+
+
+if __name__ == "__main__":
+    main()
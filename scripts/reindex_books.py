@@ -0,0 +1,395 @@
+"""
+Reconstruir los índices books_{tenant} de Elasticsearch desde DynamoDB
+
+El stream de la tabla de libros empieza en LATEST, así que un índice perdido
+o con un mapping nuevo no se puede rehacer reproduciendo eventos. Este
+script recorre la tabla con un Scan paralelo (Segment/TotalSegments, un
+worker por segmento) y reindexa con _bulk en índices versionados
+books_{tenant}_v{version}:
+
+  1. Los índices nuevos se crean con refresh_interval=-1 y 0 réplicas.
+  2. Cada página del scan se indexa y se guarda en el checkpoint el
+     LastEvaluatedKey de su segmento; con --resume se continúa desde ahí.
+  3. Al terminar se restauran refresh_interval y réplicas, se hace refresh y
+     el alias books_{tenant} pasa al índice nuevo en una única llamada a
+     _aliases (si books_{tenant} era un índice concreto, se elimina en esa
+     misma llamada).
+  4. Catch-up: los libros con updated_at posterior al inicio del backfill se
+     vuelven a indexar a través del alias, para no perder las escrituras del
+     stream que fueron al índice anterior durante el scan. Los borrados
+     hechos durante el backfill no se recuperan: conviene lanzarlo con poco
+     tráfico de escritura en el catálogo.
+
+Con ES_INDEX_MODE=shared se carga un único índice {ES_SHARED_INDEX}_v{version}
+con routing=tenant_id y en la misma llamada a _aliases se mueven el alias
+ES_SHARED_INDEX y los alias filtrados books_{tenant}. Sirve también para
+migrar de índices por tenant al modo shared.
+
+Los índices anteriores se conservan para poder volver atrás (--delete-old
+para borrarlos tras el cambio de alias).
+
+Uso:
+    python scripts/reindex_books.py --stage dev --segments 8
+    python scripts/reindex_books.py --endpoint-url http://localhost:8000 \\
+        --es-host http://localhost:9200 --tenant tenant1
+    python scripts/reindex_books.py --stage dev --resume
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "common", "python"))
+sys.path.insert(0, os.path.join(ROOT, "services", "stream-processors"))
+
+from bookstore_common import aws  # noqa: E402
+
+DEFAULT_REPLICAS = 1
+PROGRESS_INTERVAL = 5
+
+
+class Checkpoint:
+    """
+    Progreso del backfill en un fichero JSON (escritura atómica con os.replace):
+    version, started_at, tenants vistos y, por segmento, el LastEvaluatedKey
+    de la última página indexada completa o done=True
+    """
+
+    def __init__(self, path, state):
+        self.path = path
+        self.state = state
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load_or_create(cls, path, resume, segments, version):
+        if resume:
+            if not os.path.exists(path):
+                raise SystemExit(f"No existe el checkpoint {path}")
+            with open(path) as f:
+                state = json.load(f)
+            if state["segments"] != segments:
+                raise SystemExit(
+                    f"El checkpoint usa {state['segments']} segmentos; relanzar con "
+                    f"--segments {state['segments']}"
+                )
+            return cls(path, state)
+
+        state = {
+            "version": version,
+            "started_at": datetime.utcnow().isoformat(),
+            "segments": segments,
+            "tenants": [],
+            "indexed": 0,
+            "progress": {str(segment): {"last_key": None, "done": False} for segment in range(segments)},
+        }
+        checkpoint = cls(path, state)
+        checkpoint.save()
+        return checkpoint
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def segment(self, segment):
+        return self.state["progress"][str(segment)]
+
+    def page_done(self, segment, last_key, tenants, indexed):
+        with self.lock:
+            progress = self.segment(segment)
+            progress["last_key"] = last_key
+            progress["done"] = last_key is None
+            self.state["tenants"] = sorted(set(self.state["tenants"]) | tenants)
+            self.state["indexed"] += indexed
+            self.save()
+
+
+class Reindexer:
+    def __init__(self, args, processor, es_client, checkpoint):
+        self.args = args
+        self.processor = processor
+        self.es = es_client
+        self.checkpoint = checkpoint
+        self.dynamodb = aws.get_client("dynamodb")
+        self.version = checkpoint.state["version"]
+        self.created = set()
+        self.lock = threading.Lock()
+
+    def versioned_index(self, tenant_id):
+        if self.processor.INDEX_MODE == "shared":
+            return f"{self.processor.SHARED_INDEX}_v{self.version}"
+        return f"{self.processor.index_name_for(tenant_id)}_v{self.version}"
+
+    def create_index(self, tenant_id):
+        """Índice versionado del tenant, sin refresh ni réplicas mientras se carga"""
+        index_name = self.versioned_index(tenant_id)
+        with self.lock:
+            if index_name in self.created:
+                return index_name
+            if not self.es.indices.exists(index=index_name):
+                config = self.processor.INDEX_CONFIG
+                settings = {"refresh_interval": "-1", "number_of_replicas": 0}
+                if self.processor.INDEX_MODE == "shared":
+                    settings["number_of_shards"] = self.processor.SHARED_INDEX_SHARDS
+                body = {
+                    "mappings": config["mappings"],
+                    "settings": {**config["settings"], "index": settings},
+                }
+                self.es.indices.create(index=index_name, body=body, ignore=400)
+                print(f"Índice creado: {index_name}")
+            self.created.add(index_name)
+        return index_name
+
+    def scan_params(self, segment=None, since=None):
+        params = {
+            "TableName": self.args.table,
+            "Limit": self.args.page_size,
+            "FilterExpression": "begins_with(sk, :book)",
+            "ExpressionAttributeValues": {":book": {"S": "BOOK#"}},
+        }
+        if segment is not None:
+            params["Segment"] = segment
+            params["TotalSegments"] = self.args.segments
+        if since:
+            params["FilterExpression"] += " AND updated_at >= :since"
+            params["ExpressionAttributeValues"][":since"] = {"S": since}
+        if self.args.tenant:
+            prefixes = []
+            for i, tenant_id in enumerate(self.args.tenant):
+                prefixes.append(f"begins_with(pk, :tenant{i})")
+                params["ExpressionAttributeValues"][f":tenant{i}"] = {"S": f"{tenant_id}#"}
+            params["FilterExpression"] += f" AND ({' OR '.join(prefixes)})"
+        return params
+
+    def index_items(self, items, index_for, routed=False):
+        """
+        Indexar una página del scan; devuelve (indexados, tenants, book_ids fallidos).
+        routed=True añade routing=tenant_id (escritura directa al índice
+        compartido; a través del alias el routing lo pone el propio alias)
+        """
+        actions = []
+        tenants = set()
+        for item in items:
+            doc = self.processor.build_book_doc(item)
+            tenants.add(doc["tenant_id"])
+            metadata = {"_index": index_for(doc["tenant_id"]), "_id": doc["book_id"]}
+            if routed:
+                metadata["routing"] = doc["tenant_id"]
+            actions.append(self.processor.BulkAction(doc["book_id"], {"index": metadata}, doc, None))
+        failed = self.processor.send_bulk(self.es, actions) if actions else []
+        return len(actions) - len(failed), tenants, failed
+
+    def run_segment(self, segment):
+        progress = self.checkpoint.segment(segment)
+        if progress["done"]:
+            return
+        params = self.scan_params(segment)
+        if progress["last_key"]:
+            params["ExclusiveStartKey"] = progress["last_key"]
+
+        while True:
+            response = self.dynamodb.scan(**params)
+            indexed, tenants, failed = self.index_items(
+                response["Items"], self.create_index, routed=self.processor.INDEX_MODE == "shared"
+            )
+            if failed:
+                # El checkpoint no avanza: con --resume se repite esta página
+                raise RuntimeError(
+                    f"Segmento {segment}: {len(failed)} libros no indexados ({failed[:10]})"
+                )
+            last_key = response.get("LastEvaluatedKey")
+            self.checkpoint.page_done(segment, last_key, tenants, indexed)
+            if not last_key:
+                return
+            params["ExclusiveStartKey"] = last_key
+
+    def restore_settings(self, index_name, current):
+        """refresh_interval por defecto y las réplicas del índice actual (o --replicas)"""
+        replicas = self.args.replicas
+        if replicas is None:
+            replicas = DEFAULT_REPLICAS
+            if self.es.indices.exists(index=current):
+                settings = self.es.indices.get_settings(index=current, name="index.number_of_replicas")
+                for index_settings in settings.values():
+                    replicas = int(index_settings["settings"]["index"]["number_of_replicas"])
+
+        self.es.indices.put_settings(
+            index=index_name,
+            body={"index": {"refresh_interval": None, "number_of_replicas": replicas}},
+        )
+        self.es.indices.refresh(index=index_name)
+
+    def alias_actions(self, alias, index_name, definition):
+        """Acciones de _aliases para mover `alias` a index_name; devuelve (acciones, índices anteriores)"""
+        previous = []
+        actions = [{"add": {"index": index_name, "alias": alias, **definition}}]
+        if self.es.indices.exists_alias(name=alias):
+            previous = [name for name in self.es.indices.get_alias(name=alias) if name != index_name]
+            actions = [{"remove": {"index": name, "alias": alias}} for name in previous] + actions
+        elif self.es.indices.exists(index=alias):
+            # Todavía es un índice concreto (anterior a los alias o al modo shared)
+            actions.insert(0, {"remove_index": {"index": alias}})
+        return actions, previous
+
+    def finish(self, tenants):
+        """Restaurar settings y mover todos los alias al índice nuevo"""
+        if self.processor.INDEX_MODE == "shared":
+            # Un solo _aliases para el índice compartido y todos los tenants
+            index_name = self.versioned_index(None)
+            self.restore_settings(index_name, self.processor.SHARED_INDEX)
+            actions, previous = self.alias_actions(self.processor.SHARED_INDEX, index_name, {})
+            for tenant_id in tenants:
+                tenant_actions, tenant_previous = self.alias_actions(
+                    self.processor.index_name_for(tenant_id),
+                    index_name,
+                    self.processor.tenant_alias(tenant_id),
+                )
+                actions.extend(tenant_actions)
+                previous.extend(tenant_previous)
+            self.es.indices.update_aliases(body={"actions": actions})
+            print(f"Alias de {len(tenants)} tenants -> {index_name}")
+            self.delete_old(set(previous))
+            return
+
+        for tenant_id in tenants:
+            alias = self.processor.index_name_for(tenant_id)
+            index_name = self.versioned_index(tenant_id)
+            self.restore_settings(index_name, alias)
+            actions, previous = self.alias_actions(alias, index_name, {})
+            self.es.indices.update_aliases(body={"actions": actions})
+            print(f"Alias {alias} -> {index_name}")
+            self.delete_old(previous)
+
+    def delete_old(self, index_names):
+        if not self.args.delete_old:
+            return
+        for name in index_names:
+            self.es.indices.delete(index=name, ignore=404)
+            print(f"Índice anterior borrado: {name}")
+
+    def catch_up(self):
+        """Reindexar vía alias los libros modificados desde el inicio del backfill"""
+        params = self.scan_params(since=self.checkpoint.state["started_at"])
+        total = 0
+        failed = []
+        while True:
+            response = self.dynamodb.scan(**params)
+            indexed, _, page_failed = self.index_items(
+                response["Items"], self.processor.index_name_for
+            )
+            total += indexed
+            failed.extend(page_failed)
+            if "LastEvaluatedKey" not in response:
+                break
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        print(f"Catch-up: {total} libros reindexados, {len(failed)} fallidos")
+        return failed
+
+
+def report_progress(checkpoint, total_items, started, stop):
+    """Imprimir docs indexados, docs/s y ETA (sobre el ItemCount aproximado de la tabla)"""
+    initial = checkpoint.state["indexed"]
+    while not stop.wait(PROGRESS_INTERVAL):
+        indexed = checkpoint.state["indexed"]
+        elapsed = time.perf_counter() - started
+        rate = (indexed - initial) / elapsed if elapsed else 0
+        remaining = max(total_items - indexed, 0)
+        eta = f"{remaining / rate:6.0f}s" if rate else "     ?"
+        done = sum(1 for p in checkpoint.state["progress"].values() if p["done"])
+        print(
+            f"  {indexed}/~{total_items} docs  {rate:8.0f} docs/s  ETA {eta}  "
+            f"segmentos terminados {done}/{checkpoint.state['segments']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stage", default="dev")
+    parser.add_argument("--table", help="Por defecto bookstore-books-{stage}")
+    parser.add_argument("--endpoint-url", help="DynamoDB Local, p. ej. http://localhost:8000")
+    parser.add_argument("--es-host", help="Por defecto ELASTICSEARCH_HOST o http://localhost:9200")
+    parser.add_argument("--tenant", action="append", help="Limitar a un tenant (repetible)")
+    parser.add_argument("--segments", type=int, default=8, help="Segmentos del scan = workers")
+    parser.add_argument("--page-size", type=int, default=500, help="Items por página del scan")
+    parser.add_argument("--replicas", type=int, help="Réplicas finales (por defecto las del índice actual)")
+    parser.add_argument("--checkpoint", help="Por defecto reindex_books_{stage}.checkpoint.json")
+    parser.add_argument("--resume", action="store_true", help="Continuar desde el checkpoint")
+    parser.add_argument("--no-catch-up", action="store_true")
+    parser.add_argument("--delete-old", action="store_true")
+    args = parser.parse_args()
+
+    if args.endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = args.endpoint_url
+    if args.es_host:
+        os.environ["ELASTICSEARCH_HOST"] = args.es_host
+    args.table = args.table or f"bookstore-books-{args.stage}"
+    args.checkpoint = args.checkpoint or f"reindex_books_{args.stage}.checkpoint.json"
+
+    import books_stream_processor as processor
+
+    if processor.INDEX_MODE == "shared" and args.tenant:
+        # El índice compartido nuevo sólo tendría esos tenants y el alias
+        # ES_SHARED_INDEX se movería igualmente
+        raise SystemExit("--tenant no está soportado con ES_INDEX_MODE=shared")
+
+    es_client = processor.get_elasticsearch_client()
+    if not es_client:
+        raise SystemExit("No se pudo conectar a Elasticsearch")
+    processor.ensure_index_template(es_client)
+
+    checkpoint = Checkpoint.load_or_create(
+        args.checkpoint, args.resume, args.segments, datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    )
+    reindexer = Reindexer(args, processor, es_client, checkpoint)
+    total_items = aws.get_client("dynamodb").describe_table(TableName=args.table)["Table"].get("ItemCount", 0)
+    print(
+        f"Reindexando {args.table} (~{total_items} items) en versión {reindexer.version} "
+        f"con {args.segments} segmentos"
+    )
+
+    started = time.perf_counter()
+    stop = threading.Event()
+    reporter = threading.Thread(
+        target=report_progress, args=(checkpoint, total_items, started, stop), daemon=True
+    )
+    reporter.start()
+    errors = []
+    try:
+        with ThreadPoolExecutor(max_workers=args.segments) as pool:
+            futures = [pool.submit(reindexer.run_segment, s) for s in range(args.segments)]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(str(e))
+    finally:
+        stop.set()
+
+    elapsed = time.perf_counter() - started
+    state = checkpoint.state
+    if errors:
+        for error in errors:
+            print(f"Error: {error}")
+        raise SystemExit(
+            f"Backfill incompleto ({state['indexed']} docs indexados); el alias no se ha "
+            f"cambiado. Relanzar con --resume --checkpoint {args.checkpoint}"
+        )
+    print(f"Backfill terminado: {state['indexed']} docs en {elapsed:.1f}s")
+
+    reindexer.finish(state["tenants"])
+
+    if not args.no_catch_up and reindexer.catch_up():
+        raise SystemExit("El catch-up tuvo documentos fallidos")
+
+    os.remove(args.checkpoint)
+
+
+if __name__ == "__main__":
+    main()
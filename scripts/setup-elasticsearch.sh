@@ -28,10 +28,17 @@ echo "🐳 Docker encontrado"
 echo "📡 Creando red Docker para Elasticsearch..."
 docker network create elastic-network 2>/dev/null || echo "Red ya existe"
 
+# Modo de índices (ver ES_INDEX_MODE en stream-processors):
+#   per_tenant (default) un contenedor de 512 MB por tenant
+#   shared               un único contenedor con el índice compartido "books"
+#                        y un alias filtrado books_{tenant} por tenant
+ES_INDEX_MODE=${ES_INDEX_MODE:-per_tenant}
+
 # Función para crear contenedor de Elasticsearch para un tenant
 create_elasticsearch_container() {
     local tenant_id=$1
     local port=$2
+    local heap=${3:-512m}
     local container_name="elasticsearch_${tenant_id}"
     
     echo "🔍 Creando Elasticsearch para tenant: $tenant_id en puerto $port"
@@ -45,7 +52,7 @@ create_elasticsearch_container() {
         --network elastic-network \
         -p $port:9200 \
         -e "discovery.type=single-node" \
-        -e "ES_JAVA_OPTS=-Xms512m -Xmx512m" \
+        -e "ES_JAVA_OPTS=-Xms${heap} -Xmx${heap}" \
         -e "xpack.security.enabled=false" \
         -v "$(pwd)/elasticsearch_data/${tenant_id}:/usr/share/elasticsearch/data" \
         elasticsearch:7.17.9
@@ -60,14 +67,21 @@ create_elasticsearch_container() {
 # Crear contenedores para diferentes tenants
 echo "🚀 Iniciando contenedores de Elasticsearch..."
 
-# Tenant 1
-create_elasticsearch_container "tenant1" 9201
+if [ "$ES_INDEX_MODE" = "shared" ]; then
+    # Todos los tenants en un nodo; los índices y alias los crea el stream processor
+    create_elasticsearch_container "shared" 9200 "${ES_HEAP:-1g}"
+    PORTS="9200"
+else
+    # Tenant 1
+    create_elasticsearch_container "tenant1" 9201
 
-# Tenant 2  
-create_elasticsearch_container "tenant2" 9202
+    # Tenant 2
+    create_elasticsearch_container "tenant2" 9202
 
-# Tenant 3 (ejemplo)
-create_elasticsearch_container "tenant3" 9203
+    # Tenant 3 (ejemplo)
+    create_elasticsearch_container "tenant3" 9203
+    PORTS="9201 9202 9203"
+fi
 
 # Esperar a que los servicios estén listos
 echo "⏳ Esperando a que Elasticsearch esté listo..."
@@ -76,7 +90,7 @@ sleep 30
 # Verificar que los servicios estén funcionando
 echo "🔍 Verificando servicios..."
 
-for port in 9201 9202 9203; do
+for port in $PORTS; do
     echo "Verificando puerto $port..."
     response=$(curl -s -o /dev/null -w "%{http_code}" http://localhost:$port)
     if [ "$response" = "200" ]; then
@@ -96,9 +110,13 @@ docker ps | grep elasticsearch
 
 echo ""
 echo "🔗 URLs de Elasticsearch:"
-echo "Tenant1: http://localhost:9201"
-echo "Tenant2: http://localhost:9202"
-echo "Tenant3: http://localhost:9203"
+if [ "$ES_INDEX_MODE" = "shared" ]; then
+    echo "Todos los tenants: http://localhost:9200 (desplegar stream-processors con ES_INDEX_MODE=shared)"
+else
+    echo "Tenant1: http://localhost:9201"
+    echo "Tenant2: http://localhost:9202"
+    echo "Tenant3: http://localhost:9203"
+fi
 
 echo ""
 echo "📝 Comandos útiles:"
@@ -0,0 +1,7 @@
+"""
+Código compartido por los servicios Python del bookstore.
+
+Se despliega como Lambda Layer (ver `layers.common` en el serverless.yml de
+cada servicio); en Lambda queda disponible en /opt/python. Para ejecutar un
+servicio en local basta con añadir services/common/python al PYTHONPATH.
+"""
@@ -0,0 +1,114 @@
+"""
+Registro de clientes y tablas AWS a nivel de módulo.
+
+Los objetos se crean de forma perezosa la primera vez que se piden y se
+reutilizan en todas las invocaciones de un contenedor Lambda caliente, de
+modo que no se repite el setup de botocore ni se pierde el pool de
+conexiones HTTPS entre requests.
+
+Configuración (variables de entorno):
+    AWS_MAX_POOL_CONNECTIONS  tamaño del pool de conexiones (default 50)
+    AWS_TCP_KEEPALIVE         keep-alive TCP en los sockets (default true)
+    AWS_RETRY_MODE            standard | adaptive | legacy (default adaptive)
+    AWS_MAX_ATTEMPTS          intentos totales por llamada (default 5)
+    AWS_CONNECT_TIMEOUT       segundos (default 2)
+    AWS_READ_TIMEOUT          segundos (default 10)
+
+Para apuntar a DynamoDB Local o a un S3 alternativo se usan las variables
+estándar de botocore (AWS_ENDPOINT_URL, AWS_ENDPOINT_URL_DYNAMODB, ...).
+"""
+
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+DEFAULT_REGION = "us-east-1"
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_resources = {}
+_tables = {}
+
+
+def client_config():
+    """Config de botocore compartida por todos los clientes del registro"""
+    return Config(
+        max_pool_connections=int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "50")),
+        tcp_keepalive=os.environ.get("AWS_TCP_KEEPALIVE", "true").lower() == "true",
+        connect_timeout=float(os.environ.get("AWS_CONNECT_TIMEOUT", "2")),
+        read_timeout=float(os.environ.get("AWS_READ_TIMEOUT", "10")),
+        retries={
+            "mode": os.environ.get("AWS_RETRY_MODE", "adaptive"),
+            "max_attempts": int(os.environ.get("AWS_MAX_ATTEMPTS", "5")),
+        },
+    )
+
+
+def default_region(service_name):
+    """Región por servicio; DynamoDB respeta DYNAMODB_REGION como hasta ahora"""
+    if service_name == "dynamodb" and os.environ.get("DYNAMODB_REGION"):
+        return os.environ["DYNAMODB_REGION"]
+    return os.environ.get("REGION") or os.environ.get("AWS_REGION") or DEFAULT_REGION
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+
+def get_client(service_name, region_name=None):
+    """Cliente de bajo nivel (p. ej. "s3") compartido por el contenedor"""
+    region_name = region_name or default_region(service_name)
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _get_session().client(
+                    service_name, region_name=region_name, config=client_config()
+                )
+                _clients[key] = client
+    return client
+
+
+def get_resource(service_name, region_name=None):
+    """Resource de alto nivel (p. ej. "dynamodb") compartido por el contenedor"""
+    region_name = region_name or default_region(service_name)
+    key = (service_name, region_name)
+    resource = _resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = _get_session().resource(
+                    service_name, region_name=region_name, config=client_config()
+                )
+                _resources[key] = resource
+    return resource
+
+
+def get_table(table_name, region_name=None):
+    """Tabla DynamoDB cacheada; todas comparten el cliente del resource"""
+    region_name = region_name or default_region("dynamodb")
+    key = (table_name, region_name)
+    table = _tables.get(key)
+    if table is None:
+        table = get_resource("dynamodb", region_name).Table(table_name)
+        _tables[key] = table
+    return table
+
+
+def reset():
+    """Descartar todos los objetos cacheados (benchmarks y pruebas locales)"""
+    global _session
+    with _lock:
+        _clients.clear()
+        _resources.clear()
+        _tables.clear()
+        _session = None
@@ -0,0 +1,109 @@
+"""
+Identificadores ordenables por tiempo (formato ULID).
+
+Un ULID son 26 caracteres en base32 de Crockford: 48 bits con los
+milisegundos desde epoch seguidos de 80 bits aleatorios. Como el timestamp va
+primero y el alfabeto está en orden ASCII, el orden lexicográfico del string
+coincide con el orden de creación, así que sirve directamente como sort key
+de DynamoDB (p. ej. gsi1sk = ORDER#{ulid}).
+
+Dentro del mismo milisegundo los ids de un mismo proceso se generan de forma
+monótona (se incrementa la parte aleatoria), para que dos órdenes creadas
+seguidas no queden desordenadas.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+ENCODING = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ULID_LENGTH = 26
+TIMESTAMP_LENGTH = 10
+RANDOM_BITS = 80
+MAX_TIMESTAMP_MS = (1 << 48) - 1
+
+_DECODING = {char: index for index, char in enumerate(ENCODING)}
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+
+def _encode(value, length):
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, 32)
+        chars.append(ENCODING[remainder])
+    return "".join(reversed(chars))
+
+
+def _datetime_ms(value):
+    if value.tzinfo is None:
+        # Los timestamps del proyecto se guardan con datetime.utcnow()
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def new_ulid(timestamp_ms=None):
+    """Generar un ULID; monótono dentro del mismo milisegundo"""
+    global _last_ms, _last_random
+
+    if timestamp_ms is None:
+        timestamp_ms = time.time_ns() // 1_000_000
+    if not 0 <= timestamp_ms <= MAX_TIMESTAMP_MS:
+        raise ValueError(f"Timestamp out of range: {timestamp_ms}")
+
+    with _lock:
+        if timestamp_ms == _last_ms and _last_random < (1 << RANDOM_BITS) - 1:
+            _last_random += 1
+        else:
+            _last_ms = timestamp_ms
+            _last_random = int.from_bytes(os.urandom(RANDOM_BITS // 8), "big")
+        random_part = _last_random
+
+    return _encode(timestamp_ms, TIMESTAMP_LENGTH) + _encode(
+        random_part, ULID_LENGTH - TIMESTAMP_LENGTH
+    )
+
+
+def ulid_from_datetime(value):
+    """ULID cuyo timestamp es `value` (datetime o string ISO 8601)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return new_ulid(_datetime_ms(value))
+
+
+def is_ulid(value):
+    """True si `value` tiene formato ULID"""
+    return (
+        isinstance(value, str)
+        and len(value) == ULID_LENGTH
+        and value[0] in "01234567"
+        and all(char in _DECODING for char in value)
+    )
+
+
+def ulid_timestamp(value):
+    """Datetime UTC (naive, como utcnow) codificado en un ULID"""
+    if not is_ulid(value):
+        raise ValueError(f"Invalid ULID: {value}")
+    timestamp_ms = 0
+    for char in value[:TIMESTAMP_LENGTH]:
+        timestamp_ms = timestamp_ms * 32 + _DECODING[char]
+    return datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc).replace(
+        tzinfo=None
+    )
+
+
+def ulid_lower_bound(value):
+    """Menor ULID posible con el timestamp de `value` (inicio de un rango)"""
+    return _encode(_datetime_ms(value), TIMESTAMP_LENGTH) + ENCODING[0] * (
+        ULID_LENGTH - TIMESTAMP_LENGTH
+    )
+
+
+def ulid_upper_bound(value):
+    """Mayor ULID posible con el timestamp de `value` (fin de un rango)"""
+    return _encode(_datetime_ms(value), TIMESTAMP_LENGTH) + ENCODING[-1] * (
+        ULID_LENGTH - TIMESTAMP_LENGTH
+    )
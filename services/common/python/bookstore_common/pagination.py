@@ -0,0 +1,120 @@
+"""
+Paginación por cursor sobre Query de DynamoDB.
+
+El cursor es el LastEvaluatedKey serializado en JSON, codificado en base64url
+y firmado con HMAC-SHA256 junto con un "scope" (normalmente la partition key
+consultada). Así el cliente no puede alterarlo ni reutilizarlo sobre la
+partición de otro usuario, y cada página cuesta O(tamaño de página) en RCUs.
+
+El secreto se toma de CURSOR_SECRET (o JWT_SECRET si no está definido).
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+
+SIGNATURE_BYTES = 16
+
+
+class InvalidCursor(ValueError):
+    """El cursor recibido no es válido, está alterado o es de otro scope"""
+
+
+def _secret():
+    return (
+        os.environ.get("CURSOR_SECRET") or os.environ.get("JWT_SECRET") or "dev-secret"
+    ).encode()
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(scope, payload):
+    return hmac.new(
+        _secret(), scope.encode() + b"\0" + payload, hashlib.sha256
+    ).digest()[:SIGNATURE_BYTES]
+
+
+def encode_cursor(last_evaluated_key, scope):
+    """Convertir un LastEvaluatedKey en un next_cursor opaco"""
+    if not last_evaluated_key:
+        return None
+    payload = json.dumps(
+        last_evaluated_key, separators=(",", ":"), sort_keys=True
+    ).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_sign(scope, payload))}"
+
+
+def decode_cursor(cursor, scope):
+    """Recuperar el ExclusiveStartKey de un cursor; lanza InvalidCursor"""
+    try:
+        payload_part, signature_part = cursor.split(".", 1)
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (AttributeError, ValueError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+    if not hmac.compare_digest(signature, _sign(scope, payload)):
+        raise InvalidCursor("Invalid cursor")
+
+    try:
+        key = json.loads(payload)
+    except ValueError as e:
+        raise InvalidCursor("Invalid cursor") from e
+    if not isinstance(key, dict):
+        raise InvalidCursor("Invalid cursor")
+    return key
+
+
+def query_page(table, limit, cursor=None, scope="", **query_params):
+    """
+    Leer una página de `limit` items con Limit + ExclusiveStartKey.
+    Si hay FilterExpression la query puede devolver menos items que Limit, así
+    que se sigue leyendo hasta completar la página o agotar la partición.
+    Devuelve (items, next_cursor).
+    """
+    if cursor:
+        query_params["ExclusiveStartKey"] = decode_cursor(cursor, scope)
+
+    items = []
+    last_evaluated_key = None
+    while len(items) < limit:
+        query_params["Limit"] = limit - len(items)
+        response = table.query(**query_params)
+        items.extend(response["Items"])
+        last_evaluated_key = response.get("LastEvaluatedKey")
+        if not last_evaluated_key:
+            break
+        query_params["ExclusiveStartKey"] = last_evaluated_key
+
+    return items, encode_cursor(last_evaluated_key, scope)
+
+
+def query_all(table, **query_params):
+    """Leer todos los items de una Query siguiendo LastEvaluatedKey (límite de 1 MB)"""
+    items = []
+    while True:
+        response = table.query(**query_params)
+        items.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return items
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def create_cursor_response(items, limit, next_cursor):
+    """Respuesta paginada por cursor (mismo envoltorio items/pagination)"""
+    return {
+        "items": items,
+        "pagination": {
+            "items_per_page": limit,
+            "has_next": next_cursor is not None,
+            "next_cursor": next_cursor,
+        },
+    }
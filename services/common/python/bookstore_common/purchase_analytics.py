@@ -0,0 +1,355 @@
+"""
+Agregado de analytics de compras por usuario.
+
+Un único item en la tabla de compras con contadores que se actualizan con
+ADD atómicos, de modo que GET /api/v1/analytics/purchases es un get_item:
+
+    pk = ANALYTICS#{tenant_id}#{user_id}, sk = SUMMARY
+    total_orders, total_spent
+    status_{status}                 órdenes en cada status
+    month_{YYYY-MM}_orders / _total buckets mensuales
+
+Los buckets son atributos de primer nivel (y no un map) porque ADD no puede
+crear un path anidado cuyo map padre todavía no existe.
+
+Resumen diario por tenant, mantenido por el stream processor de compras con
+un ADD por (tenant, día) y batch:
+
+    pk = DAILY#{tenant_id}#{YYYY-MM-DD}, sk = SUMMARY
+    total_purchases, total_revenue, total_items_sold
+    payment_{método}                compras por método de pago
+    category_{categoría}            unidades vendidas por categoría
+
+Cubo de rollups por tenant, también del stream processor: una celda por
+(granularidad, dimensión, periodo, valor) con orders, revenue e items. Cada
+batch acumula sus parciales y hace un único ADD por celda:
+
+    pk = ROLLUP#{tenant_id}#{hour|day|month}#{total|payment_method|category|book}
+    sk = {periodo}#{valor}          periodo: 2025-07-12T14, 2025-07-12 o 2025-07
+
+Una serie (p. ej. ingresos por hora de un día, o por categoría de un mes) es
+una Query sobre un pk con el rango de periodos en el sk. En las dimensiones
+category y book, revenue es la suma de subtotales de las líneas y orders el
+número de compras que las incluyen.
+
+Sketches por tenant y día/mes (ver sketches.py), junto a los rollups:
+
+    pk = SKETCH#{tenant_id}#{day|month}, sk = {periodo}
+    buyers_hll                      HyperLogLog de user_id (binario)
+    top_books / top_books_error     SpaceSaving de unidades por book_id
+    version                         control de concurrencia optimista
+
+No hay un ADD para "máximo por registro", así que se escriben leyendo,
+fusionando y con un put condicionado a la versión leída.
+
+Ni los ADD ni top_books son idempotentes. Cuando el stream processor
+devuelve batchItemFailures, Lambda reenvía el batch desde el primer registro
+fallido, incluidos otros cuyas escrituras ya se aplicaron. Para no contarlos
+dos veces, la invocación deja un registro de reintento con el sequence
+number por el que empezará el reenvío:
+
+    pk = RETRY#{sequence_number}, sk = LEDGER
+    layers                          [{last_sequence, keys}]: las escrituras
+                                    de `keys` ya incluyen los registros del
+                                    reenvío hasta last_sequence
+"""
+
+from decimal import Decimal
+
+from bookstore_common.sketches import HyperLogLog, SpaceSaving
+
+SUMMARY_SK = "SUMMARY"
+PENDING_STATUSES = ("processing", "pending")
+_MONTH_PREFIX = "month_"
+_DAILY_PREFIX = "DAILY#"
+_PAYMENT_PREFIX = "payment_"
+_CATEGORY_PREFIX = "category_"
+_ROLLUP_PREFIX = "ROLLUP#"
+
+# Granularidad -> longitud del prefijo de created_at (ISO 8601) que la define
+ROLLUP_GRAINS = {"hour": 13, "day": 10, "month": 7}
+ROLLUP_DIMENSIONS = ("total", "payment_method", "category", "book")
+ROLLUP_TOTAL = "ALL"
+_SKETCH_PREFIX = "SKETCH#"
+SKETCH_GRAINS = {"day": 10, "month": 7}
+_RETRY_PREFIX = "RETRY#"
+
+
+def summary_key(tenant_id, user_id):
+    return {"pk": f"ANALYTICS#{tenant_id}#{user_id}", "sk": SUMMARY_SK}
+
+
+def is_summary_key(pk):
+    return pk.startswith("ANALYTICS#")
+
+
+def daily_summary_key(tenant_id, date):
+    return {"pk": f"{_DAILY_PREFIX}{tenant_id}#{date}", "sk": SUMMARY_SK}
+
+
+def is_daily_summary_key(pk):
+    return pk.startswith(_DAILY_PREFIX)
+
+
+def _add_update(counters):
+    """UpdateExpression ADD para un dict {atributo: incremento}"""
+    names = {}
+    values = {}
+    clauses = []
+    for index, (attribute, amount) in enumerate(counters.items()):
+        names[f"#a{index}"] = attribute
+        values[f":v{index}"] = amount
+        clauses.append(f"#a{index} :v{index}")
+    return {
+        "UpdateExpression": "ADD " + ", ".join(clauses),
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
+    }
+
+
+def order_counters(order):
+    """Incrementos que aporta una orden nueva al agregado"""
+    total = Decimal(str(order.get("total", 0)))
+    month = order["created_at"][:7]  # YYYY-MM
+    return {
+        "total_orders": 1,
+        "total_spent": total,
+        f"status_{order.get('status', 'unknown')}": 1,
+        f"{_MONTH_PREFIX}{month}_orders": 1,
+        f"{_MONTH_PREFIX}{month}_total": total,
+    }
+
+
+def order_created_update(order):
+    """Parámetros de update_item / Update de TransactWriteItems para una orden nueva"""
+    return {
+        "Key": summary_key(order["tenant_id"], order["user_id"]),
+        **_add_update(order_counters(order)),
+    }
+
+
+def status_changed_update(tenant_id, user_id, old_status, new_status):
+    """Mover una orden de un contador de status a otro"""
+    return {
+        "Key": summary_key(tenant_id, user_id),
+        **_add_update({f"status_{old_status}": -1, f"status_{new_status}": 1}),
+    }
+
+
+def format_summary(item):
+    """Convertir el item agregado en el bloque `analytics` de la API"""
+    item = item or {}
+    total_orders = int(item.get("total_orders", 0))
+    total_spent = float(item.get("total_spent", 0))
+
+    monthly_stats = {}
+    for attribute, value in item.items():
+        if not attribute.startswith(_MONTH_PREFIX):
+            continue
+        month, field = attribute[len(_MONTH_PREFIX):].rsplit("_", 1)
+        stats = monthly_stats.setdefault(month, {"orders": 0, "total": 0})
+        stats[field] = int(value) if field == "orders" else float(value)
+
+    return {
+        "summary": {
+            "total_orders": total_orders,
+            "total_spent": round(total_spent, 2),
+            "average_order_value": (
+                round(total_spent / total_orders, 2) if total_orders > 0 else 0
+            ),
+            "completed_orders": int(item.get("status_completed", 0)),
+            "pending_orders": sum(
+                int(item.get(f"status_{status}", 0)) for status in PENDING_STATUSES
+            ),
+        },
+        "monthly_stats": dict(sorted(monthly_stats.items())),
+    }
+
+
+def daily_counters(purchase):
+    """Incrementos que aporta una compra al resumen diario de su tenant"""
+    return {
+        "total_purchases": 1,
+        "total_revenue": Decimal(str(purchase.get("total_amount", 0))),
+        "total_items_sold": sum(int(item.get("quantity", 0)) for item in purchase.get("items", [])),
+        f"{_PAYMENT_PREFIX}{purchase.get('payment_method') or 'unknown'}": 1,
+        **{
+            f"{_CATEGORY_PREFIX}{category}": quantity
+            for category, quantity in _category_quantities(purchase).items()
+        },
+    }
+
+
+def _category_quantities(purchase):
+    quantities = {}
+    for item in purchase.get("items", []):
+        category = item.get("category") or "unknown"
+        quantities[category] = quantities.get(category, 0) + int(item.get("quantity", 0))
+    return quantities
+
+
+def daily_summary_update(tenant_id, date, counters):
+    """Parámetros de update_item con los contadores acumulados de un batch"""
+    return {"Key": daily_summary_key(tenant_id, date), **_add_update(counters)}
+
+
+def format_daily_summary(item):
+    """Resumen diario con el formato de daily_summary/.../summary.json"""
+    tenant_id, _, date = item["pk"][len(_DAILY_PREFIX):].rpartition("#")
+    return {
+        "date": date,
+        "tenant_id": tenant_id,
+        "total_purchases": int(item.get("total_purchases", 0)),
+        "total_revenue": round(float(item.get("total_revenue", 0)), 2),
+        "total_items_sold": int(item.get("total_items_sold", 0)),
+        "categories": {
+            attribute[len(_CATEGORY_PREFIX):]: int(value)
+            for attribute, value in sorted(item.items())
+            if attribute.startswith(_CATEGORY_PREFIX)
+        },
+        "payment_methods": {
+            attribute[len(_PAYMENT_PREFIX):]: int(value)
+            for attribute, value in sorted(item.items())
+            if attribute.startswith(_PAYMENT_PREFIX)
+        },
+    }
+
+
+def rollup_key(tenant_id, grain, dimension, period, value=ROLLUP_TOTAL):
+    return {"pk": f"{_ROLLUP_PREFIX}{tenant_id}#{grain}#{dimension}", "sk": f"{period}#{value}"}
+
+
+def is_rollup_key(pk):
+    return pk.startswith(_ROLLUP_PREFIX)
+
+
+def rollup_cells(purchase):
+    """
+    [((granularidad, dimensión, periodo, valor), incrementos)] que aporta una
+    compra al cubo (el tenant lo añade quien acumula)
+    """
+    items = purchase.get("items", [])
+    whole = {
+        "orders": 1,
+        "revenue": Decimal(str(purchase.get("total_amount", 0))),
+        "items": sum(int(item.get("quantity", 0)) for item in items),
+    }
+    # Dimensión -> valor -> incrementos de esta compra
+    values = {
+        "total": {ROLLUP_TOTAL: whole},
+        "payment_method": {purchase.get("payment_method") or "unknown": whole},
+        "category": {},
+        "book": {},
+    }
+    for item in items:
+        for dimension, value in (
+            ("category", item.get("category") or "unknown"),
+            ("book", item.get("book_id") or "unknown"),
+        ):
+            # Una compra cuenta una vez por valor aunque tenga varias líneas
+            counters = values[dimension].setdefault(
+                value, {"orders": 1, "revenue": Decimal("0"), "items": 0}
+            )
+            counters["revenue"] += Decimal(str(item.get("subtotal", 0)))
+            counters["items"] += int(item.get("quantity", 0))
+
+    return [
+        ((grain, dimension, purchase["created_at"][:length], value), counters)
+        for grain, length in ROLLUP_GRAINS.items()
+        for dimension in ROLLUP_DIMENSIONS
+        for value, counters in values[dimension].items()
+    ]
+
+
+def rollup_update(tenant_id, cell, counters):
+    """Parámetros de update_item con los parciales de un batch para una celda"""
+    grain, dimension, period, value = cell
+    return {"Key": rollup_key(tenant_id, grain, dimension, period, value), **_add_update(counters)}
+
+
+def rollup_query(tenant_id, grain, dimension, period_from, period_to):
+    """
+    Parámetros de Query para las celdas de una serie entre dos periodos
+    (inclusive; se recortan a la longitud de la granularidad)
+    """
+    length = ROLLUP_GRAINS[grain]
+    return {
+        "KeyConditionExpression": "pk = :pk AND sk BETWEEN :from AND :to",
+        "ExpressionAttributeValues": {
+            ":pk": rollup_key(tenant_id, grain, dimension, "")["pk"],
+            ":from": period_from[:length],
+            ":to": period_to[:length] + "~",
+        },
+    }
+
+
+def format_rollup_cell(item):
+    period, _, value = item["sk"].partition("#")
+    return {
+        "period": period,
+        "value": value,
+        "orders": int(item.get("orders", 0)),
+        "revenue": round(float(item.get("revenue", 0)), 2),
+        "items": int(item.get("items", 0)),
+    }
+
+
+def sketch_key(tenant_id, grain, period):
+    return {"pk": f"{_SKETCH_PREFIX}{tenant_id}#{grain}", "sk": period}
+
+
+def is_sketch_key(pk):
+    return pk.startswith(_SKETCH_PREFIX)
+
+
+def sketch_query(tenant_id, grain, period_from, period_to):
+    """Parámetros de Query para los sketches de los periodos entre from y to (inclusive)"""
+    length = SKETCH_GRAINS[grain]
+    return {
+        "KeyConditionExpression": "pk = :pk AND sk BETWEEN :from AND :to",
+        "ExpressionAttributeValues": {
+            ":pk": sketch_key(tenant_id, grain, "")["pk"],
+            ":from": period_from[:length],
+            ":to": period_to[:length],
+        },
+    }
+
+
+def read_sketches(item):
+    """(HyperLogLog, SpaceSaving) de un item de sketches (vacíos si no existe)"""
+    item = item or {}
+    registers = item.get("buyers_hll")
+    buyers = HyperLogLog(registers=getattr(registers, "value", registers))
+    top_books = SpaceSaving(
+        counts={book_id: int(count) for book_id, count in item.get("top_books", {}).items()},
+        errors={book_id: int(error) for book_id, error in item.get("top_books_error", {}).items()},
+    )
+    return buyers, top_books
+
+
+def sketch_item(tenant_id, grain, period, buyers, top_books, version):
+    return {
+        **sketch_key(tenant_id, grain, period),
+        "buyers_hll": buyers.to_bytes(),
+        "top_books": top_books.counts,
+        "top_books_error": top_books.errors,
+        "version": version,
+    }
+
+
+def format_sketches(buyers, top_books, limit=10):
+    return {
+        "unique_buyers": buyers.count(),
+        "top_books": [
+            {"book_id": book_id, "units": count, "max_error": error}
+            for book_id, count, error in top_books.top(limit)
+        ],
+    }
+
+
+def retry_ledger_key(sequence_number):
+    return {"pk": f"{_RETRY_PREFIX}{sequence_number}", "sk": "LEDGER"}
+
+
+def is_retry_ledger_key(pk):
+    return pk.startswith(_RETRY_PREFIX)
@@ -0,0 +1,146 @@
+"""
+Router por tabla para los lambda_handler de API Gateway.
+
+Las rutas se registran una sola vez al importar el módulo del servicio:
+
+    router = Router()
+
+    @router.route("GET", "/api/v1/orders/{order_id}")
+    def get_order(request):
+        order_id = request.params["order_id"]
+        ...
+
+Las rutas sin parámetros se resuelven con un único lookup en un dict
+(method, path); las que tienen parámetros recorren un trie por segmentos, de
+modo que el coste depende de la profundidad del path y no del número de
+rutas. Un segmento literal tiene prioridad sobre un parámetro en la misma
+posición, pero si la rama literal no tiene handler para el método se prueba
+la rama del parámetro.
+"""
+
+import json
+
+# Método comodín: la ruta acepta cualquier método HTTP
+ANY = "*"
+
+
+class Request:
+    """Datos del evento de API Gateway que usan los handlers"""
+
+    __slots__ = ("event", "method", "path", "params", "query", "headers", "body")
+
+    def __init__(self, event):
+        self.event = event
+        self.method = event.get("httpMethod", "GET")
+        self.path = event.get("path", "/")
+        self.query = event.get("queryStringParameters") or {}
+        self.headers = event.get("headers") or {}
+        self.params = {}
+
+        body = event.get("body", "{}")
+        try:
+            self.body = json.loads(body) if body else {}
+        except (TypeError, ValueError):
+            self.body = {}
+
+    @property
+    def authorization(self):
+        """Header Authorization (API Gateway puede entregarlo en minúsculas)"""
+        return self.headers.get("authorization", "") or self.headers.get(
+            "Authorization", ""
+        )
+
+
+class _Node:
+    __slots__ = ("children", "param", "handlers")
+
+    def __init__(self):
+        self.children = {}
+        self.param = None  # (nombre, _Node)
+        self.handlers = {}
+
+
+def _segments(path):
+    return path.split("/")
+
+
+class Router:
+    """Dispatch por (method, path template) compilado al importar"""
+
+    def __init__(self):
+        self._static = {}
+        self._root = _Node()
+        self._endpoints = []
+
+    def route(self, method, template):
+        """Decorador que registra `handler(request)` para method + template"""
+
+        def decorator(handler):
+            self.add(method, template, handler)
+            return handler
+
+        return decorator
+
+    def add(self, method, template, handler):
+        self._endpoints.append(f"{method} {template}")
+
+        if "{" not in template:
+            self._static[(method, template)] = handler
+            return
+
+        node = self._root
+        for segment in _segments(template):
+            if segment.startswith("{") and segment.endswith("}"):
+                name = segment[1:-1]
+                if node.param is None:
+                    node.param = (name, _Node())
+                elif node.param[0] != name:
+                    raise ValueError(
+                        f"Conflicting path parameters {{{node.param[0]}}} and "
+                        f"{{{name}}} in {template}"
+                    )
+                node = node.param[1]
+            else:
+                node = node.children.setdefault(segment, _Node())
+
+        if method in node.handlers:
+            raise ValueError(f"Route already registered: {method} {template}")
+        node.handlers[method] = handler
+
+    def resolve(self, method, path):
+        """Devuelve (handler, params) o (None, {}) si ninguna ruta coincide"""
+        handler = self._static.get((method, path)) or self._static.get((ANY, path))
+        if handler is not None:
+            return handler, {}
+
+        params = {}
+        handler = self._match(self._root, _segments(path), 0, method, params)
+        if handler is None:
+            return None, {}
+        return handler, params
+
+    def _match(self, node, segments, index, method, params):
+        if index == len(segments):
+            return node.handlers.get(method) or node.handlers.get(ANY)
+
+        child = node.children.get(segments[index])
+        if child is not None:
+            handler = self._match(child, segments, index + 1, method, params)
+            if handler is not None:
+                return handler
+
+        if node.param is not None:
+            name, child = node.param
+            params[name] = segments[index]
+            handler = self._match(child, segments, index + 1, method, params)
+            if handler is not None:
+                return handler
+            del params[name]
+
+        return None
+
+    def endpoints(self):
+        """Rutas registradas, en el formato "METHOD /path" de los 404"""
+        return [
+            endpoint.replace(f"{ANY} ", "GET ", 1) for endpoint in self._endpoints
+        ]
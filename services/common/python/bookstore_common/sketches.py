@@ -0,0 +1,108 @@
+"""
+Sketches probabilísticos fusionables para los resúmenes de analytics.
+
+HyperLogLog cuenta elementos distintos (compradores únicos) con memoria fija:
+2^precision registros de un byte. Con la precisión por defecto (12) son 4 KiB
+y el error típico ronda el 1.6%. Fusionar dos sketches es tomar el máximo de
+cada registro, así que el de un mes es la fusión de los de sus días, y
+volver a fusionar el mismo batch no cambia nada.
+
+SpaceSaving guarda los `capacity` elementos más frecuentes (top ventas) con
+su cuenta y una cota del error: la cuenta real está entre count - error y
+count. Se fusiona según Agarwal et al., "Mergeable Summaries" (2012): cada
+lado aporta su mínimo a los elementos que no tiene y se conservan los
+`capacity` mayores. A diferencia de HyperLogLog no es idempotente: añadir
+dos veces el mismo batch suma dos veces sus cuentas.
+"""
+
+import hashlib
+import math
+
+HLL_PRECISION = 12
+TOP_K_CAPACITY = 200
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError("Número de registros incompatible con la precisión")
+
+    def add(self, value):
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        # Posición del primer 1 en los bits que no son índice (1-based)
+        rank = remaining_bits - (hashed & ((1 << remaining_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("No se pueden fusionar HyperLogLog de distinta precisión")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Rango pequeño: linear counting sobre los registros vacíos
+            return round(self.size * math.log(self.size / zeros))
+        return round(estimate)
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+
+class SpaceSaving:
+    def __init__(self, capacity=TOP_K_CAPACITY, counts=None, errors=None):
+        self.capacity = capacity
+        self.counts = dict(counts or {})
+        self.errors = dict(errors or {})
+
+    def _floor(self):
+        """Cuenta máxima que puede tener un elemento que no está en el sketch"""
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def add(self, item, weight=1):
+        if item in self.counts:
+            self.counts[item] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = weight
+            self.errors[item] = 0
+        else:
+            # Sustituye al mínimo y hereda su cuenta como error
+            evicted = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(evicted)
+            self.errors.pop(evicted, None)
+            self.counts[item] = floor + weight
+            self.errors[item] = floor
+
+    def merge(self, other):
+        own_floor = self._floor()
+        other_floor = other._floor()
+        counts = {}
+        errors = {}
+        for item in self.counts.keys() | other.counts.keys():
+            counts[item] = self.counts.get(item, own_floor) + other.counts.get(item, other_floor)
+            errors[item] = (
+                (self.errors.get(item, 0) if item in self.counts else own_floor)
+                + (other.errors.get(item, 0) if item in other.counts else other_floor)
+            )
+        kept = sorted(counts, key=lambda item: (-counts[item], item))[: self.capacity]
+        self.counts = {item: counts[item] for item in kept}
+        self.errors = {item: errors[item] for item in kept}
+        return self
+
+    def top(self, limit=10):
+        """[(elemento, cuenta, error)] de mayor a menor cuenta"""
+        ranked = sorted(self.counts, key=lambda item: (-self.counts[item], item))[:limit]
+        return [(item, self.counts[item], self.errors.get(item, 0)) for item in ranked]
@@ -0,0 +1,176 @@
+"""
+Tokens de sesión firmados (HMAC-SHA256, formato compacto JWT HS256).
+
+    base64url(header) . base64url(payload) . base64url(firma)
+
+    header  = {"alg": "HS256", "typ": "JWT", "kid": "<id de la clave>"}
+    payload = {"sub": user_id, "tid": tenant_id, "role": ..., "iat": ..., "exp": ...}
+
+Verificar un token es sólo CPU (una HMAC y un json.loads), sin lecturas de
+DynamoDB: el rol y el tenant viajan firmados en el propio token. Como
+contrapartida, un cambio de rol o la desactivación de una cuenta no afectan
+a los tokens ya emitidos hasta que expiran (TOKEN_TTL_SECONDS).
+
+Claves y rotación:
+  - TOKEN_SIGNING_KEYS = "kid1:secreto1,kid2:secreto2" (todas se aceptan al verificar)
+  - TOKEN_ACTIVE_KID   = kid con el que se firman los tokens nuevos
+  Para rotar: añadir la clave nueva, desplegar, cambiar TOKEN_ACTIVE_KID y
+  retirar la antigua cuando hayan expirado sus tokens. Sin TOKEN_SIGNING_KEYS
+  se usa JWT_SECRET con kid "default".
+
+ACCEPT_LEGACY_TOKENS=true acepta además los simple_token_{user_id}_{tenant_id}
+anteriores (sin firma, rol "user") durante la migración de los clientes.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+DEFAULT_TTL_SECONDS = 24 * 3600
+LEGACY_PREFIX = "simple_token_"
+
+_keys_cache = {}
+# header (base64) -> kid: sólo hay tantos headers distintos como claves
+_header_cache = {}
+_HEADER_CACHE_SIZE = 64
+
+
+class InvalidToken(ValueError):
+    """El token no es válido: formato, firma, clave desconocida o expirado"""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signing_keys():
+    """(kid activo, {kid: secreto}); se parsea una vez por valor de entorno"""
+    raw = os.environ.get("TOKEN_SIGNING_KEYS", "")
+    active = os.environ.get("TOKEN_ACTIVE_KID", "")
+    cache_key = (raw, active, os.environ.get("JWT_SECRET", ""))
+    if cache_key not in _keys_cache:
+        keys = {}
+        for entry in raw.split(","):
+            kid, _, secret = entry.strip().partition(":")
+            if kid and secret:
+                keys[kid] = secret.encode()
+        if not keys:
+            keys["default"] = os.environ.get("JWT_SECRET", "dev-secret").encode()
+        if active not in keys:
+            active = next(iter(keys))
+        _keys_cache.clear()
+        _keys_cache[cache_key] = (active, keys)
+    return _keys_cache[cache_key]
+
+
+def _sign(secret, signing_input):
+    return hmac.digest(secret, signing_input, hashlib.sha256)
+
+
+def _header_kid(header_part):
+    kid = _header_cache.get(header_part)
+    if kid is None:
+        header = json.loads(_b64decode(header_part))
+        if not isinstance(header, dict) or header.get("alg") != "HS256":
+            raise InvalidToken("Unsupported token algorithm")
+        kid = str(header.get("kid"))
+        if len(_header_cache) >= _HEADER_CACHE_SIZE:
+            _header_cache.clear()
+        _header_cache[header_part] = kid
+    return kid
+
+
+def issue_token(user_id, tenant_id, role="user", ttl_seconds=None, now=None, **claims):
+    """Firmar un token para el usuario; `claims` añade campos extra al payload"""
+    kid, keys = _signing_keys()
+    issued_at = int(now if now is not None else time.time())
+    if ttl_seconds is None:
+        ttl_seconds = int(os.environ.get("TOKEN_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+
+    header = {"alg": "HS256", "typ": "JWT", "kid": kid}
+    payload = {
+        **claims,
+        "sub": user_id,
+        "tid": tenant_id,
+        "role": role,
+        "iat": issued_at,
+        "exp": issued_at + ttl_seconds,
+    }
+    signing_input = (
+        _b64encode(json.dumps(header, separators=(",", ":")).encode())
+        + "."
+        + _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+    ).encode()
+    return signing_input.decode() + "." + _b64encode(_sign(keys[kid], signing_input))
+
+
+def verify_token(token, now=None):
+    """Verificar firma y expiración; devuelve el payload o lanza InvalidToken"""
+    try:
+        header_part, payload_part, signature_part = token.split(".")
+        kid = _header_kid(header_part)
+        signature = _b64decode(signature_part)
+    except InvalidToken:
+        raise
+    except (AttributeError, ValueError) as e:
+        raise InvalidToken("Malformed token") from e
+
+    _, keys = _signing_keys()
+    secret = keys.get(kid)
+    if secret is None:
+        raise InvalidToken("Unknown signing key")
+
+    signing_input = f"{header_part}.{payload_part}".encode()
+    if not hmac.compare_digest(signature, _sign(secret, signing_input)):
+        raise InvalidToken("Invalid signature")
+
+    try:
+        payload = json.loads(_b64decode(payload_part))
+    except ValueError as e:
+        raise InvalidToken("Malformed token") from e
+
+    if not isinstance(payload, dict) or not payload.get("sub") or not payload.get("tid"):
+        raise InvalidToken("Malformed token")
+    if payload.get("exp", 0) <= (now if now is not None else time.time()):
+        raise InvalidToken("Token expired")
+    return payload
+
+
+def _legacy_user(token):
+    if os.environ.get("ACCEPT_LEGACY_TOKENS", "false").lower() != "true":
+        return None
+    user_id, _, tenant_id = token[len(LEGACY_PREFIX):].partition("_")
+    if not user_id or not tenant_id:
+        return None
+    return {"user_id": user_id, "tenant_id": tenant_id, "role": "user"}
+
+
+def user_from_authorization(auth_header):
+    """
+    Usuario autenticado a partir del header "Authorization: Bearer <token>".
+    Devuelve {"user_id", "tenant_id", "role", ...claims} o None si no es válido
+    """
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None
+
+    token = auth_header[len("Bearer "):].strip()
+    if token.startswith(LEGACY_PREFIX):
+        return _legacy_user(token)
+
+    try:
+        payload = verify_token(token)
+    except InvalidToken:
+        return None
+
+    user = {key: value for key, value in payload.items() if key not in ("sub", "tid")}
+    user["user_id"] = payload["sub"]
+    user["tenant_id"] = payload["tid"]
+    user.setdefault("role", "user")
+    return user
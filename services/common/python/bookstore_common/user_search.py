@@ -0,0 +1,116 @@
+"""
+Índices de usuarios para el listado y la búsqueda de administración.
+
+Listado por tenant (GSI2 de la tabla de usuarios), en el item PROFILE:
+
+    gsi2pk = USERS#{tenant_id}, gsi2sk = {created_at}#{user_id}
+
+Búsqueda por prefijo: por cada token normalizado de username, email,
+first_name y last_name se escribe un item junto al perfil, que se indexa en
+GSI1 (sobrecargado: el perfil usa gsi1pk = EMAIL#...):
+
+    pk = USER#{tenant_id}#{user_id}, sk = SEARCH#{token}
+    gsi1pk = SEARCH#{tenant_id}#{token[0]}, gsi1sk = {token}#{user_id}
+
+Buscar "jo" es una Query begins_with(gsi1sk, "jo") sobre la partición
+SEARCH#{tenant}#j, así que el coste depende de los resultados y no del
+número de usuarios del tenant.
+"""
+
+import re
+import unicodedata
+
+from boto3.dynamodb.conditions import Key
+
+SEARCH_SK_PREFIX = "SEARCH#"
+SEARCHABLE_FIELDS = ("username", "email", "first_name", "last_name")
+MAX_TOKEN_LENGTH = 64
+# El registro escribe perfil, centinela de email y tokens en una sola
+# TransactWriteItems (máximo 100 operaciones)
+MAX_TOKENS_PER_USER = 40
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text):
+    """Minúsculas y sin acentos: "José" -> "jose" """
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(char for char in text if not unicodedata.combining(char)).lower().strip()
+
+
+def search_tokens(user):
+    """
+    Tokens buscables de un perfil: el sufijo de cada campo que empieza en
+    cada una de sus palabras, de modo que el prefijo de cualquier palabra
+    (o de varias seguidas) encuentra el perfil:
+    "ana@x.com" -> ana@x.com, x.com, com
+    """
+    tokens = {}
+    for field in SEARCHABLE_FIELDS:
+        value = normalize(user.get(field, ""))
+        for word in _WORD.finditer(value):
+            tokens.setdefault(value[word.start():][:MAX_TOKEN_LENGTH])
+    return set(list(tokens)[:MAX_TOKENS_PER_USER])
+
+
+def listing_keys(tenant_id, user_id, created_at):
+    """Atributos de GSI2 para el item PROFILE"""
+    return {"gsi2pk": f"USERS#{tenant_id}", "gsi2sk": f"{created_at}#{user_id}"}
+
+
+def token_item(tenant_id, user_id, token):
+    return {
+        "pk": f"USER#{tenant_id}#{user_id}",
+        "sk": f"{SEARCH_SK_PREFIX}{token}",
+        "gsi1pk": f"SEARCH#{tenant_id}#{token[0]}",
+        "gsi1sk": f"{token}#{user_id}",
+        "user_id": user_id,
+        "tenant_id": tenant_id,
+        "entity_type": "USER_SEARCH_TOKEN",
+    }
+
+
+def token_items(user):
+    return [
+        token_item(user["tenant_id"], user["user_id"], token)
+        for token in sorted(search_tokens(user))
+    ]
+
+
+def listing_query(tenant_id):
+    """Parámetros de Query para listar los usuarios de un tenant"""
+    return {
+        "IndexName": "GSI2",
+        "KeyConditionExpression": Key("gsi2pk").eq(f"USERS#{tenant_id}"),
+    }
+
+
+def search_query(tenant_id, term):
+    """Parámetros de Query sobre GSI1 para los tokens que empiezan por `term`"""
+    term = normalize(term)[:MAX_TOKEN_LENGTH]
+    return {
+        "IndexName": "GSI1",
+        "KeyConditionExpression": Key("gsi1pk").eq(f"SEARCH#{tenant_id}#{term[0]}")
+        & Key("gsi1sk").begins_with(term),
+    }
+
+
+def sync_search_tokens(table, user):
+    """
+    Dejar los items SEARCH# del usuario iguales a search_tokens(user): se
+    leen los existentes (una Query sobre su partición) y sólo se escriben
+    las diferencias
+    """
+    pk = f'USER#{user["tenant_id"]}#{user["user_id"]}'
+    response = table.query(
+        KeyConditionExpression=Key("pk").eq(pk) & Key("sk").begins_with(SEARCH_SK_PREFIX),
+        ProjectionExpression="sk",
+    )
+    existing = {item["sk"][len(SEARCH_SK_PREFIX):] for item in response["Items"]}
+    wanted = search_tokens(user)
+
+    with table.batch_writer() as batch:
+        for token in existing - wanted:
+            batch.delete_item(Key={"pk": pk, "sk": f"{SEARCH_SK_PREFIX}{token}"})
+        for token in wanted - existing:
+            batch.put_item(Item=token_item(user["tenant_id"], user["user_id"], token))
@@ -1,11 +1,12 @@
 import json
-import boto3
 import os
 import base64
 import uuid
 from datetime import datetime
 import hashlib
 import re
+from bookstore_common import aws
+from bookstore_common.tokens import user_from_authorization
 
 
 def lambda_handler(event, context):
@@ -14,8 +15,8 @@ def lambda_handler(event, context):
     Soporta upload, update, delete y get de imágenes en S3
     """
 
-    # Configuración
-    s3_client = boto3.client("s3")
+    # Configuración (cliente S3 reutilizado entre invocaciones)
+    s3_client = aws.get_client("s3")
     images_bucket = os.environ.get("IMAGES_BUCKET", "bookstore-images-dev-328458381283")
 
     # Obtener información del request
@@ -41,21 +42,6 @@ def lambda_handler(event, context):
         "Access-Control-Allow-Methods": "GET,HEAD,OPTIONS,POST,PUT,DELETE",
     }
 
-    # Función para extraer información del token
-    def extract_user_from_token(auth_header):
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return None
-
-        token = auth_header.split(" ")[1]
-        # Token simple format: simple_token_{user_id}_{tenant_id}
-        if token.startswith("simple_token_"):
-            parts = token.split("_")
-            if len(parts) >= 3:
-                user_id = parts[2]
-                tenant_id = parts[3] if len(parts) > 3 else "tenant1"
-                return {"user_id": user_id, "tenant_id": tenant_id}
-        return None
-
     # Función para validar formato de imagen
     def validate_image_data(image_data):
         # Verificar que sea base64 válido
@@ -111,7 +97,7 @@ def lambda_handler(event, context):
             auth_header = event.get("headers", {}).get(
                 "authorization", ""
             ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+            user = user_from_authorization(auth_header)
 
             if not user:
                 return {
@@ -215,7 +201,7 @@ def lambda_handler(event, context):
             auth_header = event.get("headers", {}).get(
                 "authorization", ""
             ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+            user = user_from_authorization(auth_header)
 
             if not user:
                 return {
@@ -318,7 +304,7 @@ def lambda_handler(event, context):
             auth_header = event.get("headers", {}).get(
                 "authorization", ""
             ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+            user = user_from_authorization(auth_header)
 
             if not user:
                 return {
@@ -367,7 +353,7 @@ def lambda_handler(event, context):
             auth_header = event.get("headers", {}).get(
                 "authorization", ""
             ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+            user = user_from_authorization(auth_header)
 
             if not user:
                 return {
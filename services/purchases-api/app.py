@@ -3,9 +3,19 @@ import os
 import uuid
 import hashlib
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from bookstore_common import aws, ids, purchase_analytics
+from bookstore_common.pagination import (
+    InvalidCursor,
+    create_cursor_response,
+    query_all,
+    query_page,
+)
+from bookstore_common.routing import ANY, Request, Router
+from bookstore_common.tokens import user_from_authorization
 
 
 def decimal_serializer(obj):
@@ -17,959 +27,1447 @@ def decimal_serializer(obj):
     )
 
 
-def lambda_handler(event, context):
+CART_TABLE = os.environ.get("CART_TABLE", "bookstore-shopping-cart-dev")
+PURCHASES_TABLE = os.environ.get("PURCHASES_TABLE", "bookstore-purchases-dev")
+BOOKS_TABLE = os.environ.get("BOOKS_TABLE", "bookstore-books-dev")
+
+# Headers de respuesta básicos
+HEADERS = {
+    "Content-Type": "application/json",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+    "Access-Control-Allow-Methods": "GET,HEAD,OPTIONS,POST,PUT,DELETE",
+}
+
+
+def create_pagination_response(items, page, limit, total_items):
+    """Crear respuesta de paginación"""
+    total_pages = (total_items + limit - 1) // limit
+    has_next = page < total_pages
+    has_previous = page > 1
+
+    return {
+        "items": items,
+        "pagination": {
+            "current_page": page,
+            "total_pages": total_pages,
+            "total_items": total_items,
+            "items_per_page": limit,
+            "has_next": has_next,
+            "has_previous": has_previous,
+        },
+    }
+
+
+# BatchGetItem acepta como máximo 100 claves por request
+BOOK_BATCH_GET_LIMIT = 100
+BOOK_BATCH_GET_MAX_RETRIES = 5
+
+
+def book_key(tenant_id, book_id, isbn):
+    """Clave primaria de un libro (mismo esquema que books-api: pk/sk)"""
+    return {"pk": f"{tenant_id}#{book_id}", "sk": f"BOOK#{isbn}"}
+
+
+def get_book_info(books_table, tenant_id, book_id, isbn=None):
     """
-    Handler mejorado para AWS Lambda que mane                # Verificar stock_quantity disponible
-                if book.get('stock_quantity_quantity', 0) < quantity: requests HTTP para compras
-    Incluye funcionalidades completas para carrito, checkout, órdenes y analytics
+    Obtener un libro activo usando las claves de la tabla en lugar de un scan.
+    Con isbn es un get_item directo; sin isbn se consulta la partición del libro.
     """
+    try:
+        book = None
+        if isbn:
+            response = books_table.get_item(Key=book_key(tenant_id, book_id, isbn))
+            book = response.get("Item")
+
+        if not book:
+            response = books_table.query(
+                KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
+                    f"{tenant_id}#{book_id}"
+                )
+                & boto3.dynamodb.conditions.Key("sk").begins_with("BOOK#"),
+                Limit=1,
+            )
+            book = response["Items"][0] if response["Items"] else None
 
-    # Configuración básica
-    dynamodb = boto3.resource(
-        "dynamodb", region_name=os.environ.get("DYNAMODB_REGION", "us-east-1")
-    )
-    cart_table = dynamodb.Table(
-        os.environ.get("CART_TABLE", "bookstore-shopping-cart-dev")
-    )
-    purchases_table = dynamodb.Table(
-        os.environ.get("PURCHASES_TABLE", "bookstore-purchases-dev")
+        if book and book.get("is_active", False) is True:
+            return book
+        return None
+    except:
+        return None
+
+
+# TransactWriteItems admite hasta 100 operaciones: la orden, el agregado de
+# analytics del usuario y un decremento de stock y un borrado de carrito por
+# cada línea
+TRANSACT_MAX_ITEMS = 100
+MAX_CHECKOUT_LINES = (TRANSACT_MAX_ITEMS - 2) // 2
+
+deserializer = TypeDeserializer()
+
+
+def deserialize_item(item):
+    """
+    Convertir atributos en formato DynamoDB a un dict de Python. El cliente del
+    resource ya (de)serializa requests y respuestas, pero no los Item que
+    llegan dentro de CancellationReasons
+    """
+    return {key: deserializer.deserialize(value) for key, value in item.items()}
+
+
+def build_checkout_transaction(
+    purchases_table, books_table, cart_table, order_item, book_keys, cart_items
+):
+    """
+    Construir los TransactItems del checkout. El orden es fijo: la orden en la
+    posición 0 y luego el decremento de cada línea en la posición 1 + i, de
+    modo que checkout_failure puede mapear CancellationReasons a la línea.
+    Al final van los borrados del carrito y los ADD del agregado de analytics.
+    """
+    transact_items = [
+        {
+            "Put": {
+                "TableName": purchases_table.name,
+                "Item": order_item,
+                "ConditionExpression": "attribute_not_exists(pk)",
+            }
+        }
+    ]
+
+    for key, line in zip(book_keys, order_item["items"]):
+        transact_items.append(
+            {
+                "Update": {
+                    "TableName": books_table.name,
+                    "Key": key,
+                    "UpdateExpression": "SET stock_quantity = stock_quantity - :quantity, updated_at = :updated_at",
+                    "ConditionExpression": "attribute_exists(pk) AND is_active = :active AND stock_quantity >= :quantity",
+                    "ExpressionAttributeValues": {
+                        ":quantity": line["quantity"],
+                        ":active": True,
+                        ":updated_at": order_item["created_at"],
+                    },
+                    "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+                }
+            }
+        )
+
+    for cart_item in cart_items:
+        transact_items.append(
+            {
+                "Delete": {
+                    "TableName": cart_table.name,
+                    "Key": {"pk": cart_item["pk"], "sk": cart_item["sk"]},
+                }
+            }
+        )
+
+    transact_items.append(
+        {
+            "Update": {
+                "TableName": purchases_table.name,
+                **purchase_analytics.order_created_update(order_item),
+            }
+        }
     )
-    books_table = dynamodb.Table(os.environ.get("BOOKS_TABLE", "bookstore-books-dev"))
 
-    # Obtener información del request
-    method = event.get("httpMethod", "GET")
-    path = event.get("path", "/")
-    body = event.get("body", "{}")
-    query_params = event.get("queryStringParameters") or {}
+    return transact_items
 
-    # Parsear body si existe
-    try:
-        if body:
-            request_body = json.loads(body)
+
+def checkout_failure(cancellation_reasons, order_items):
+    """Traducir CancellationReasons a un error que señala sólo la línea que falló"""
+    for index, reason in enumerate(cancellation_reasons):
+        code = reason.get("Code", "None")
+        line_index = index - 1
+
+        if code == "ConditionalCheckFailed" and 0 <= line_index < len(order_items):
+            line = order_items[line_index]
+            book = deserialize_item(reason.get("Item") or {})
+
+            if not book or book.get("is_active") is not True:
+                return {
+                    "statusCode": 400,
+                    "error": f'Book {line["title"]} is no longer available',
+                    "book_id": line["book_id"],
+                }
+
+            return {
+                "statusCode": 400,
+                "error": f'Insufficient stock_quantity for {line["title"]}',
+                "book_id": line["book_id"],
+                "requested_quantity": line["quantity"],
+                "available_stock_quantity": book.get("stock_quantity", 0),
+            }
+
+        if code == "TransactionConflict":
+            return {
+                "statusCode": 409,
+                "error": "Checkout conflicted with a concurrent update, please retry",
+            }
+
+    return {"statusCode": 500, "error": "Checkout transaction was cancelled"}
+
+
+def batch_get_books(dynamodb, books_table, tenant_id, book_refs):
+    """
+    Resolver todos los libros de un carrito con BatchGetItem.
+    book_refs es una lista de (book_id, isbn); devuelve {book_id: libro activo}.
+    Las UnprocessedKeys se reintentan con backoff exponencial y los libros
+    sin isbn (o que no aparecen por clave completa) se buscan por partición.
+    """
+    books = {}
+    keys = []
+    book_ids = []
+
+    for book_id, isbn in book_refs:
+        if book_id in book_ids:
+            continue
+        book_ids.append(book_id)
+        if isbn:
+            keys.append(book_key(tenant_id, book_id, isbn))
+
+    for start in range(0, len(keys), BOOK_BATCH_GET_LIMIT):
+        request_items = {
+            books_table.name: {"Keys": keys[start : start + BOOK_BATCH_GET_LIMIT]}
+        }
+        retries = 0
+
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response.get("Responses", {}).get(books_table.name, []):
+                books[item["book_id"]] = item
+
+            request_items = response.get("UnprocessedKeys") or {}
+            if request_items:
+                retries += 1
+                if retries > BOOK_BATCH_GET_MAX_RETRIES:
+                    raise RuntimeError("BatchGetItem: unprocessed keys after retries")
+                time.sleep(min(0.05 * (2**retries), 1.0))
+
+    for book_id in book_ids:
+        if book_id not in books:
+            book = get_book_info(books_table, tenant_id, book_id)
+            if book:
+                books[book_id] = book
+
+    return {
+        book_id: book
+        for book_id, book in books.items()
+        if book.get("is_active", False) is True
+    }
+
+
+def format_order_summary(item):
+    """Resumen de una orden para el historial"""
+    return {
+        "order_id": item.get("order_id"),
+        "status": item.get("status", "unknown"),
+        "payment_status": item.get("payment_status", "pending"),
+        "total": float(item.get("total", 0)),
+        "items_count": item.get("items_count", 0),
+        "created_at": item.get("created_at"),
+        "updated_at": item.get("updated_at"),
+    }
+
+
+# GSI2: gsi2pk = USER#{tenant}#{user}, gsi2sk = STATUS#{status}#{created_at}#{order_id}
+# Cualquier cambio de status de una orden debe reescribir también gsi2sk
+ORDER_STATUS_INDEX = "GSI2"
+
+
+def order_status_key(status, created_at, order_id):
+    """Sort key de GSI2: filtra por status y rango de fechas en la KeyCondition"""
+    return f"STATUS#{status}#{created_at}#{order_id}"
+
+
+def parse_utc_datetime(value):
+    """
+    ISO 8601 a datetime UTC sin zona (sin offset se asume UTC). El sufijo Z se
+    traduce a +00:00: fromisoformat no lo acepta hasta Python 3.11
+    """
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_date_range(query):
+    """
+    Leer ?from= y ?to= (fecha YYYY-MM-DD o datetime ISO 8601, ambos inclusive).
+    Devuelve (date_from, date_to) como datetime naive en UTC o None; ValueError
+    si no son válidos. Los datetime con offset (+02:00, Z) se pasan a UTC para
+    compararlos con created_at, que se guarda en UTC sin zona
+    """
+    date_from = date_to = None
+    if query.get("from"):
+        date_from = parse_utc_datetime(query["from"])
+    if query.get("to"):
+        date_to = parse_utc_datetime(query["to"])
+        if len(query["to"]) == 10:
+            # Sólo fecha: incluir el día completo
+            date_to += timedelta(days=1) - timedelta(milliseconds=1)
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("from must be before to")
+    return date_from, date_to
+
+
+def orders_query(tenant_id, user_id, status="", date_from=None, date_to=None):
+    """
+    Parámetros de Query para las órdenes de un usuario, más recientes primero.
+    Con status se usa GSI2 (STATUS#...#created_at) y sin él GSI1 (ORDER#{ulid});
+    en ambos casos el rango de fechas va en la KeyConditionExpression
+    """
+    Key = boto3.dynamodb.conditions.Key
+    user_pk = f"USER#{tenant_id}#{user_id}"
+
+    if status:
+        prefix = f"STATUS#{status}#"
+        sort_key = Key("gsi2sk")
+        if date_from and date_to:
+            sort_condition = sort_key.between(
+                prefix + date_from.isoformat(), prefix + date_to.isoformat() + "~"
+            )
+        elif date_from:
+            sort_condition = sort_key.between(prefix + date_from.isoformat(), prefix + "~")
+        elif date_to:
+            sort_condition = sort_key.between(prefix, prefix + date_to.isoformat() + "~")
         else:
-            request_body = {}
-    except:
-        request_body = {}
-
-    # Headers de respuesta básicos
-    headers = {
-        "Content-Type": "application/json",
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-        "Access-Control-Allow-Methods": "GET,HEAD,OPTIONS,POST,PUT,DELETE",
+            sort_condition = sort_key.begins_with(prefix)
+        condition = Key("gsi2pk").eq(user_pk) & sort_condition
+        index_name = ORDER_STATUS_INDEX
+    else:
+        condition = Key("gsi1pk").eq(user_pk)
+        if date_from or date_to:
+            condition = condition & Key("gsi1sk").between(
+                "ORDER#" + ids.ulid_lower_bound(date_from or datetime(1970, 1, 1)),
+                "ORDER#" + ids.ulid_upper_bound(date_to or datetime.utcnow()),
+            )
+        index_name = "GSI1"
+
+    return {
+        "IndexName": index_name,
+        "KeyConditionExpression": condition,
+        "ScanIndexForward": False,
     }
 
-    # Función para extraer user_id del token simple
-    def extract_user_from_token(auth_header):
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return None
 
-        token = auth_header.replace("Bearer ", "")
-        if not token.startswith("simple_token_"):
-            return None
+router = Router()
+
+
+# ===========================================
+# HEALTH CHECK ENDPOINT
+# ===========================================
+@router.route(ANY, "/")
+@router.route(ANY, "/health")
+def health_check(request):
+    return {
+        "statusCode": 200,
+        "headers": HEADERS,
+        "body": json.dumps(
+            {
+                "message": "Purchases API v2.0.0 - Enhanced",
+                "status": "healthy",
+                "timestamp": datetime.utcnow().isoformat(),
+                "method": request.method,
+                "path": request.path,
+                "features": [
+                    "Shopping Cart Management",
+                    "Order Processing & Checkout",
+                    "Purchase History & Analytics",
+                    "Inventory Management",
+                    "Payment Processing Integration",
+                ],
+            }
+        ),
+    }
 
-        try:
-            token_parts = token.replace("simple_token_", "").split("_")
-            if len(token_parts) < 2:
-                return None
-            return {"user_id": token_parts[0], "tenant_id": token_parts[1]}
-        except:
-            return None
-
-    # Función para crear respuesta de paginación
-    def create_pagination_response(items, page, limit, total_items):
-        total_pages = (total_items + limit - 1) // limit
-        has_next = page < total_pages
-        has_previous = page > 1
-
-        return {
-            "items": items,
-            "pagination": {
-                "current_page": page,
-                "total_pages": total_pages,
-                "total_items": total_items,
-                "items_per_page": limit,
-                "has_next": has_next,
-                "has_previous": has_previous,
-            },
+
+# ===========================================
+# SHOPPING CART ENDPOINTS
+# ===========================================
+
+# GET CART
+@router.route("GET", "/api/v1/cart")
+def get_cart(request):
+    cart_table = aws.get_table(CART_TABLE)
+
+    user = user_from_authorization(request.authorization)
+
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
         }
 
-    # Función para obtener información del libro
-    def get_book_info(tenant_id, book_id):
-        try:
-            response = books_table.scan(
-                FilterExpression=boto3.dynamodb.conditions.Attr("tenant_id").eq(
-                    tenant_id
-                )
-                & boto3.dynamodb.conditions.Attr("book_id").eq(book_id)
-                & boto3.dynamodb.conditions.Attr("is_active").eq(True)
+    try:
+        response = cart_table.query(
+            KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
+                f"CART#{user['tenant_id']}#{user['user_id']}"
             )
-            return response["Items"][0] if response["Items"] else None
-        except:
-            return None
+        )
 
-    try:
-        # ===========================================
-        # HEALTH CHECK ENDPOINT
-        # ===========================================
-        if path == "/" or path == "/health":
-            return {
-                "statusCode": 200,
-                "headers": headers,
-                "body": json.dumps(
+        cart_items = []
+        total = Decimal("0")
+
+        for item in response["Items"]:
+            if item["sk"].startswith("ITEM#"):
+                item_total = Decimal(str(item.get("price", 0))) * int(
+                    item.get("quantity", 1)
+                )
+                cart_items.append(
                     {
-                        "message": "Purchases API v2.0.0 - Enhanced",
-                        "status": "healthy",
-                        "timestamp": datetime.utcnow().isoformat(),
-                        "method": method,
-                        "path": path,
-                        "features": [
-                            "Shopping Cart Management",
-                            "Order Processing & Checkout",
-                            "Purchase History & Analytics",
-                            "Inventory Management",
-                            "Payment Processing Integration",
-                        ],
+                        "cart_item_id": item.get("cart_item_id"),
+                        "book_id": item.get("book_id"),
+                        "title": item.get("title", "Unknown"),
+                        "author": item.get("author", "Unknown"),
+                        "price": float(
+                            item.get("price", 0)
+                        ),  # Mantener float para JSON
+                        "quantity": int(item.get("quantity", 1)),
+                        "subtotal": float(
+                            item_total
+                        ),  # Mantener float para JSON
+                        "added_at": item.get("added_at"),
+                        "isbn": item.get("isbn", ""),
+                        "image_url": item.get("image_url", ""),
                     }
-                ),
-            }
-
-        # ===========================================
-        # SHOPPING CART ENDPOINTS
-        # ===========================================
+                )
+                total += item_total
 
-        # GET CART
-        elif path == "/api/v1/cart" and method == "GET":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+        # Calcular resumen con Decimal
+        tax = (total * Decimal("0.08")).quantize(Decimal("0.01"))
+        shipping = Decimal("5.99") if total < 50 else Decimal("0")
+        final_total = (total + tax + shipping).quantize(Decimal("0.01"))
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "cart_items": cart_items,
+                    "summary": {
+                        "subtotal": float(total),
+                        "tax": float(tax),
+                        "shipping": float(shipping),
+                        "total": float(final_total),
+                    },
+                    "item_count": len(cart_items),
+                    "updated_at": datetime.utcnow().isoformat(),
                 }
+            ),
+        }
 
-            try:
-                response = cart_table.query(
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
-                        f"CART#{user['tenant_id']}#{user['user_id']}"
-                    )
-                )
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-                cart_items = []
-                total = Decimal("0")
-
-                for item in response["Items"]:
-                    if item["sk"].startswith("ITEM#"):
-                        item_total = Decimal(str(item.get("price", 0))) * int(
-                            item.get("quantity", 1)
-                        )
-                        cart_items.append(
-                            {
-                                "cart_item_id": item.get("cart_item_id"),
-                                "book_id": item.get("book_id"),
-                                "title": item.get("title", "Unknown"),
-                                "author": item.get("author", "Unknown"),
-                                "price": float(
-                                    item.get("price", 0)
-                                ),  # Mantener float para JSON
-                                "quantity": int(item.get("quantity", 1)),
-                                "subtotal": float(
-                                    item_total
-                                ),  # Mantener float para JSON
-                                "added_at": item.get("added_at"),
-                                "isbn": item.get("isbn", ""),
-                                "image_url": item.get("image_url", ""),
-                            }
-                        )
-                        total += item_total
-
-                # Calcular resumen con Decimal
-                tax = (total * Decimal("0.08")).quantize(Decimal("0.01"))
-                shipping = Decimal("5.99") if total < 50 else Decimal("0")
-                final_total = (total + tax + shipping).quantize(Decimal("0.01"))
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {
-                            "cart_items": cart_items,
-                            "summary": {
-                                "subtotal": float(total),
-                                "tax": float(tax),
-                                "shipping": float(shipping),
-                                "total": float(final_total),
-                            },
-                            "item_count": len(cart_items),
-                            "updated_at": datetime.utcnow().isoformat(),
-                        }
-                    ),
-                }
+# ADD TO CART
+@router.route("POST", "/api/v1/cart")
+def add_to_cart(request):
+    cart_table = aws.get_table(CART_TABLE)
+    books_table = aws.get_table(BOOKS_TABLE)
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+    user = user_from_authorization(request.authorization)
 
-        # ADD TO CART
-        elif path == "/api/v1/cart" and method == "POST":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+    book_id = request.body.get("book_id")
+    quantity = int(request.body.get("quantity", 1))
+
+    if not book_id or quantity <= 0:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {"error": "Valid book_id and quantity are required"}
+            ),
+        }
 
-            book_id = request_body.get("book_id")
-            quantity = int(request_body.get("quantity", 1))
+    try:
+        # Obtener información del libro
+        book = get_book_info(books_table, user["tenant_id"], book_id)
+
+        if not book:
+            return {
+                "statusCode": 404,
+                "headers": HEADERS,
+                "body": json.dumps(
+                    {"error": "Book not found or not available"}
+                ),
+            }
+
+        # Verificar stock_quantity disponible
+        if book.get("stock_quantity", 0) < quantity:
+            return {
+                "statusCode": 400,
+                "headers": HEADERS,
+                "body": json.dumps(
+                    {
+                        "error": "Insufficient stock_quantity",
+                        "available_stock_quantity": book.get(
+                            "stock_quantity", 0
+                        ),
+                    }
+                ),
+            }
 
-            if not book_id or quantity <= 0:
+        # Verificar si el item ya existe en el carrito
+        existing_response = cart_table.query(
+            KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
+                f"CART#{user['tenant_id']}#{user['user_id']}"
+            ),
+            FilterExpression=boto3.dynamodb.conditions.Attr("book_id").eq(
+                book_id
+            ),
+        )
+
+        if existing_response["Items"]:
+            # Actualizar cantidad existente
+            existing_item = existing_response["Items"][0]
+            new_quantity = int(existing_item.get("quantity", 0)) + quantity
+
+            if book.get("stock_quantity", 0) < new_quantity:
                 return {
                     "statusCode": 400,
-                    "headers": headers,
+                    "headers": HEADERS,
                     "body": json.dumps(
-                        {"error": "Valid book_id and quantity are required"}
+                        {
+                            "error": "Insufficient stock_quantity for total quantity",
+                            "available_stock_quantity": book.get(
+                                "stock_quantity", 0
+                            ),
+                            "current_in_cart": existing_item.get("quantity", 0),
+                        }
                     ),
                 }
 
-            try:
-                # Obtener información del libro
-                book = get_book_info(user["tenant_id"], book_id)
+            cart_table.update_item(
+                Key={"pk": existing_item["pk"], "sk": existing_item["sk"]},
+                UpdateExpression="SET quantity = :quantity, updated_at = :updated_at",
+                ExpressionAttributeValues={
+                    ":quantity": new_quantity,
+                    ":updated_at": datetime.utcnow().isoformat(),
+                },
+            )
 
-                if not book:
-                    return {
-                        "statusCode": 404,
-                        "headers": headers,
-                        "body": json.dumps(
-                            {"error": "Book not found or not available"}
-                        ),
+            return {
+                "statusCode": 200,
+                "headers": HEADERS,
+                "body": json.dumps(
+                    {
+                        "message": "Cart item updated",
+                        "cart_item_id": existing_item["cart_item_id"],
+                        "new_quantity": new_quantity,
                     }
+                ),
+            }
+        else:
+            # Crear nuevo item en el carrito
+            cart_item_id = str(uuid.uuid4())
+
+            cart_item = {
+                "pk": f"CART#{user['tenant_id']}#{user['user_id']}",
+                "sk": f"ITEM#{cart_item_id}",
+                "cart_item_id": cart_item_id,
+                "book_id": book_id,
+                "title": book.get("title", "Unknown"),
+                "author": book.get("author", "Unknown"),
+                "category": book.get("category", ""),
+                "price": book.get("price", 0),
+                "quantity": quantity,
+                "isbn": book.get("isbn", ""),
+                "image_url": book.get("image_url", ""),
+                "added_at": datetime.utcnow().isoformat(),
+                "updated_at": datetime.utcnow().isoformat(),
+            }
 
-                # Verificar stock_quantity disponible
-                if book.get("stock_quantity", 0) < quantity:
-                    return {
-                        "statusCode": 400,
-                        "headers": headers,
-                        "body": json.dumps(
-                            {
-                                "error": "Insufficient stock_quantity",
-                                "available_stock_quantity": book.get(
-                                    "stock_quantity", 0
-                                ),
-                            }
-                        ),
+            cart_table.put_item(Item=cart_item)
+
+            return {
+                "statusCode": 201,
+                "headers": HEADERS,
+                "body": json.dumps(
+                    {
+                        "message": "Item added to cart",
+                        "cart_item_id": cart_item_id,
+                        "quantity": quantity,
                     }
+                ),
+            }
 
-                # Verificar si el item ya existe en el carrito
-                existing_response = cart_table.query(
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
-                        f"CART#{user['tenant_id']}#{user['user_id']}"
-                    ),
-                    FilterExpression=boto3.dynamodb.conditions.Attr("book_id").eq(
-                        book_id
-                    ),
-                )
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-                if existing_response["Items"]:
-                    # Actualizar cantidad existente
-                    existing_item = existing_response["Items"][0]
-                    new_quantity = int(existing_item.get("quantity", 0)) + quantity
 
-                    if book.get("stock_quantity", 0) < new_quantity:
-                        return {
-                            "statusCode": 400,
-                            "headers": headers,
-                            "body": json.dumps(
-                                {
-                                    "error": "Insufficient stock_quantity for total quantity",
-                                    "available_stock_quantity": book.get(
-                                        "stock_quantity", 0
-                                    ),
-                                    "current_in_cart": existing_item.get("quantity", 0),
-                                }
-                            ),
-                        }
+# UPDATE CART ITEM
+@router.route("PUT", "/api/v1/cart/{cart_item_id}")
+def update_cart_item(request):
+    cart_table = aws.get_table(CART_TABLE)
+    books_table = aws.get_table(BOOKS_TABLE)
 
-                    cart_table.update_item(
-                        Key={"pk": existing_item["pk"], "sk": existing_item["sk"]},
-                        UpdateExpression="SET quantity = :quantity, updated_at = :updated_at",
-                        ExpressionAttributeValues={
-                            ":quantity": new_quantity,
-                            ":updated_at": datetime.utcnow().isoformat(),
-                        },
-                    )
+    user = user_from_authorization(request.authorization)
 
-                    return {
-                        "statusCode": 200,
-                        "headers": headers,
-                        "body": json.dumps(
-                            {
-                                "message": "Cart item updated",
-                                "cart_item_id": existing_item["cart_item_id"],
-                                "new_quantity": new_quantity,
-                            }
-                        ),
-                    }
-                else:
-                    # Crear nuevo item en el carrito
-                    cart_item_id = str(uuid.uuid4())
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-                    cart_item = {
-                        "pk": f"CART#{user['tenant_id']}#{user['user_id']}",
-                        "sk": f"ITEM#{cart_item_id}",
-                        "cart_item_id": cart_item_id,
-                        "book_id": book_id,
-                        "title": book.get("title", "Unknown"),
-                        "author": book.get("author", "Unknown"),
-                        "price": book.get("price", 0),
-                        "quantity": quantity,
-                        "isbn": book.get("isbn", ""),
-                        "image_url": book.get("image_url", ""),
-                        "added_at": datetime.utcnow().isoformat(),
-                        "updated_at": datetime.utcnow().isoformat(),
-                    }
+    cart_item_id = request.params["cart_item_id"]
+    quantity = int(request.body.get("quantity", 1))
+
+    if quantity <= 0:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Quantity must be greater than 0"}),
+        }
+
+    try:
+        # Obtener item del carrito
+        response = cart_table.get_item(
+            Key={
+                "pk": f"CART#{user['tenant_id']}#{user['user_id']}",
+                "sk": f"ITEM#{cart_item_id}",
+            }
+        )
+
+        if "Item" not in response:
+            return {
+                "statusCode": 404,
+                "headers": HEADERS,
+                "body": json.dumps({"error": "Cart item not found"}),
+            }
 
-                    cart_table.put_item(Item=cart_item)
-
-                    return {
-                        "statusCode": 201,
-                        "headers": headers,
-                        "body": json.dumps(
-                            {
-                                "message": "Item added to cart",
-                                "cart_item_id": cart_item_id,
-                                "quantity": quantity,
-                            }
+        cart_item = response["Item"]
+
+        # Verificar stock_quantity disponible
+        book = get_book_info(
+            books_table,
+            user["tenant_id"],
+            cart_item["book_id"],
+            cart_item.get("isbn"),
+        )
+        if not book or book.get("stock_quantity", 0) < quantity:
+            return {
+                "statusCode": 400,
+                "headers": HEADERS,
+                "body": json.dumps(
+                    {
+                        "error": "Insufficient stock_quantity",
+                        "available_stock_quantity": (
+                            book.get("stock_quantity", 0) if book else 0
                         ),
                     }
+                ),
+            }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
-
-        # UPDATE CART ITEM
-        elif path.startswith("/api/v1/cart/") and method == "PUT":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+        # Actualizar cantidad
+        cart_table.update_item(
+            Key={"pk": cart_item["pk"], "sk": cart_item["sk"]},
+            UpdateExpression="SET quantity = :quantity, updated_at = :updated_at",
+            ExpressionAttributeValues={
+                ":quantity": quantity,
+                ":updated_at": datetime.utcnow().isoformat(),
+            },
+        )
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "message": "Cart item updated",
+                    "cart_item_id": cart_item_id,
+                    "new_quantity": quantity,
                 }
+            ),
+        }
 
-            cart_item_id = path.split("/")[-1]
-            quantity = int(request_body.get("quantity", 1))
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            if quantity <= 0:
-                return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Quantity must be greater than 0"}),
-                }
 
-            try:
-                # Obtener item del carrito
-                response = cart_table.get_item(
-                    Key={
-                        "pk": f"CART#{user['tenant_id']}#{user['user_id']}",
-                        "sk": f"ITEM#{cart_item_id}",
-                    }
-                )
+# REMOVE FROM CART
+@router.route("DELETE", "/api/v1/cart/{cart_item_id}")
+def remove_from_cart(request):
+    cart_table = aws.get_table(CART_TABLE)
 
-                if "Item" not in response:
-                    return {
-                        "statusCode": 404,
-                        "headers": headers,
-                        "body": json.dumps({"error": "Cart item not found"}),
-                    }
+    user = user_from_authorization(request.authorization)
 
-                cart_item = response["Item"]
-
-                # Verificar stock_quantity disponible
-                book = get_book_info(user["tenant_id"], cart_item["book_id"])
-                if not book or book.get("stock_quantity", 0) < quantity:
-                    return {
-                        "statusCode": 400,
-                        "headers": headers,
-                        "body": json.dumps(
-                            {
-                                "error": "Insufficient stock_quantity",
-                                "available_stock_quantity": (
-                                    book.get("stock_quantity", 0) if book else 0
-                                ),
-                            }
-                        ),
-                    }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-                # Actualizar cantidad
-                cart_table.update_item(
-                    Key={"pk": cart_item["pk"], "sk": cart_item["sk"]},
-                    UpdateExpression="SET quantity = :quantity, updated_at = :updated_at",
-                    ExpressionAttributeValues={
-                        ":quantity": quantity,
-                        ":updated_at": datetime.utcnow().isoformat(),
-                    },
-                )
+    cart_item_id = request.params["cart_item_id"]
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {
-                            "message": "Cart item updated",
-                            "cart_item_id": cart_item_id,
-                            "new_quantity": quantity,
-                        }
-                    ),
-                }
+    try:
+        cart_table.delete_item(
+            Key={
+                "pk": f"CART#{user['tenant_id']}#{user['user_id']}",
+                "sk": f"ITEM#{cart_item_id}",
+            }
+        )
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps({"message": "Item removed from cart"}),
+        }
 
-        # REMOVE FROM CART
-        elif path.startswith("/api/v1/cart/") and method == "DELETE":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
 
-            cart_item_id = path.split("/")[-1]
+# CLEAR CART
+@router.route("POST", "/api/v1/cart/clear")
+def clear_cart(request):
+    cart_table = aws.get_table(CART_TABLE)
 
-            try:
-                cart_table.delete_item(
-                    Key={
-                        "pk": f"CART#{user['tenant_id']}#{user['user_id']}",
-                        "sk": f"ITEM#{cart_item_id}",
-                    }
-                )
+    user = user_from_authorization(request.authorization)
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps({"message": "Item removed from cart"}),
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+    try:
+        # Obtener todos los items del carrito
+        response = cart_table.query(
+            KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
+                f"CART#{user['tenant_id']}#{user['user_id']}"
+            )
+        )
 
-        # CLEAR CART
-        elif path == "/api/v1/cart/clear" and method == "POST":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+        # Eliminar cada item
+        with cart_table.batch_writer() as batch:
+            for item in response["Items"]:
+                batch.delete_item(Key={"pk": item["pk"], "sk": item["sk"]})
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "message": "Cart cleared successfully",
+                    "items_removed": len(response["Items"]),
                 }
+            ),
+        }
 
-            try:
-                # Obtener todos los items del carrito
-                response = cart_table.query(
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
-                        f"CART#{user['tenant_id']}#{user['user_id']}"
-                    )
-                )
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-                # Eliminar cada item
-                with cart_table.batch_writer() as batch:
-                    for item in response["Items"]:
-                        batch.delete_item(Key={"pk": item["pk"], "sk": item["sk"]})
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {
-                            "message": "Cart cleared successfully",
-                            "items_removed": len(response["Items"]),
-                        }
-                    ),
-                }
+# ===========================================
+# CHECKOUT & ORDERS
+# ===========================================
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+# CHECKOUT PROCESS
+@router.route("POST", "/api/v1/checkout")
+def checkout(request):
+    dynamodb = aws.get_resource("dynamodb")
+    cart_table = aws.get_table(CART_TABLE)
+    purchases_table = aws.get_table(PURCHASES_TABLE)
+    books_table = aws.get_table(BOOKS_TABLE)
+
+    user = user_from_authorization(request.authorization)
 
-        # ===========================================
-        # CHECKOUT & ORDERS
-        # ===========================================
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-        # CHECKOUT PROCESS
-        elif path == "/api/v1/checkout" and method == "POST":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+    payment_method = request.body.get("payment_method", "credit_card")
+    shipping_address = request.body.get("shipping_address", {})
+    billing_address = request.body.get("billing_address", {})
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+    if not shipping_address or not billing_address:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {"error": "Shipping and billing addresses are required"}
+            ),
+        }
 
-            payment_method = request_body.get("payment_method", "credit_card")
-            shipping_address = request_body.get("shipping_address", {})
-            billing_address = request_body.get("billing_address", {})
+    try:
+        # Obtener items del carrito
+        cart_response = cart_table.query(
+            KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
+                f"CART#{user['tenant_id']}#{user['user_id']}"
+            )
+        )
 
-            if not shipping_address or not billing_address:
-                return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {"error": "Shipping and billing addresses are required"}
-                    ),
-                }
+        if not cart_response["Items"]:
+            return {
+                "statusCode": 400,
+                "headers": HEADERS,
+                "body": json.dumps({"error": "Cart is empty"}),
+            }
 
-            try:
-                # Obtener items del carrito
-                cart_response = cart_table.query(
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
-                        f"CART#{user['tenant_id']}#{user['user_id']}"
+        # Cada línea del carrito necesita la clave del libro para el
+        # decremento condicional; con el isbn guardado en el carrito
+        # no hace falta leer la tabla de libros. Las líneas antiguas sin
+        # isbn se resuelven todas juntas con batch_get_books
+        order_items = []
+        book_keys = []
+        subtotal = Decimal("0")
+
+        missing_isbn = [
+            (cart_item["book_id"], None)
+            for cart_item in cart_response["Items"]
+            if cart_item["sk"].startswith("ITEM#") and not cart_item.get("isbn")
+        ]
+        resolved_books = (
+            batch_get_books(dynamodb, books_table, user["tenant_id"], missing_isbn)
+            if missing_isbn
+            else {}
+        )
+
+        for cart_item in cart_response["Items"]:
+            if cart_item["sk"].startswith("ITEM#"):
+                if cart_item.get("isbn"):
+                    key = book_key(
+                        user["tenant_id"], cart_item["book_id"], cart_item["isbn"]
                     )
+                else:
+                    book = resolved_books.get(cart_item["book_id"])
+                    if not book:
+                        return {
+                            "statusCode": 400,
+                            "headers": HEADERS,
+                            "body": json.dumps(
+                                {
+                                    "error": f'Book {cart_item.get("title", "Unknown")} is no longer available',
+                                    "book_id": cart_item["book_id"],
+                                }
+                            ),
+                        }
+                    key = {"pk": book["pk"], "sk": book["sk"]}
+
+                quantity = int(cart_item.get("quantity", 1))
+                item_total = Decimal(str(cart_item.get("price", 0))) * quantity
+                subtotal += item_total
+                book_keys.append(key)
+
+                order_items.append(
+                    {
+                        "book_id": cart_item["book_id"],
+                        "title": cart_item.get("title", "Unknown"),
+                        "author": cart_item.get("author", "Unknown"),
+                        "category": cart_item.get("category", ""),
+                        "price": Decimal(str(cart_item.get("price", 0))),
+                        "quantity": quantity,
+                        "subtotal": item_total,
+                        "isbn": cart_item.get("isbn", ""),
+                    }
                 )
 
-                if not cart_response["Items"]:
-                    return {
-                        "statusCode": 400,
-                        "headers": headers,
-                        "body": json.dumps({"error": "Cart is empty"}),
+        if len(order_items) > MAX_CHECKOUT_LINES:
+            return {
+                "statusCode": 400,
+                "headers": HEADERS,
+                "body": json.dumps(
+                    {
+                        "error": f"Cart exceeds the maximum of {MAX_CHECKOUT_LINES} items per checkout"
                     }
+                ),
+            }
 
-                # Validar inventario y calcular total
-                order_items = []
-                subtotal = Decimal("0")
-
-                for cart_item in cart_response["Items"]:
-                    if cart_item["sk"].startswith("ITEM#"):
-                        book = get_book_info(user["tenant_id"], cart_item["book_id"])
-
-                        if not book:
-                            return {
-                                "statusCode": 400,
-                                "headers": headers,
-                                "body": json.dumps(
-                                    {
-                                        "error": f'Book {cart_item.get("title", "Unknown")} is no longer available'
-                                    }
-                                ),
-                            }
-
-                        quantity = int(cart_item.get("quantity", 1))
-                        if book.get("stock_quantity", 0) < quantity:
-                            return {
-                                "statusCode": 400,
-                                "headers": headers,
-                                "body": json.dumps(
-                                    {
-                                        "error": f'Insufficient stock_quantity for {cart_item.get("title", "Unknown")}',
-                                        "available_stock_quantity": book.get(
-                                            "stock_quantity", 0
-                                        ),
-                                    }
-                                ),
-                            }
-
-                        item_total = Decimal(str(cart_item.get("price", 0))) * quantity
-                        subtotal += item_total
-
-                        order_items.append(
-                            {
-                                "book_id": cart_item["book_id"],
-                                "title": cart_item.get("title", "Unknown"),
-                                "author": cart_item.get("author", "Unknown"),
-                                "price": Decimal(str(cart_item.get("price", 0))),
-                                "quantity": quantity,
-                                "subtotal": item_total,
-                                "isbn": cart_item.get("isbn", ""),
-                            }
-                        )
-
-                # Calcular totales
-                tax = (subtotal * Decimal("0.08")).quantize(Decimal("0.01"))
-                shipping = Decimal("5.99") if subtotal < 50 else Decimal("0")
-                total = (subtotal + tax + shipping).quantize(Decimal("0.01"))
-
-                # Crear orden
-                order_id = str(uuid.uuid4())
-                order_item = {
-                    "pk": f'ORDER#{user["tenant_id"]}#{order_id}',
-                    "sk": "DETAILS",
-                    "gsi1pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
-                    "gsi1sk": f"ORDER#{order_id}",
-                    "order_id": order_id,
-                    "user_id": user["user_id"],
-                    "tenant_id": user["tenant_id"],
-                    "status": "processing",
-                    "payment_method": payment_method,
-                    "payment_status": "pending",
-                    "subtotal": subtotal,
-                    "tax": tax,
-                    "shipping": shipping,
-                    "total": total,
-                    "items": order_items,
-                    "items_count": len(order_items),
-                    "shipping_address": shipping_address,
-                    "billing_address": billing_address,
-                    "created_at": datetime.utcnow().isoformat(),
-                    "updated_at": datetime.utcnow().isoformat(),
+        # Calcular totales
+        tax = (subtotal * Decimal("0.08")).quantize(Decimal("0.01"))
+        shipping = Decimal("5.99") if subtotal < 50 else Decimal("0")
+        total = (subtotal + tax + shipping).quantize(Decimal("0.01"))
+
+        # Crear orden
+        created_at = datetime.utcnow()
+        now = created_at.isoformat()
+        # ULID: el order_id (y gsi1sk) ordena por fecha de creación
+        order_id = ids.ulid_from_datetime(created_at)
+        order_item = {
+            "pk": f'ORDER#{user["tenant_id"]}#{order_id}',
+            "sk": "DETAILS",
+            "gsi1pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
+            "gsi1sk": f"ORDER#{order_id}",
+            "gsi2pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
+            "gsi2sk": order_status_key("processing", now, order_id),
+            "order_id": order_id,
+            "user_id": user["user_id"],
+            "tenant_id": user["tenant_id"],
+            "status": "processing",
+            "payment_method": payment_method,
+            "payment_status": "pending",
+            "subtotal": subtotal,
+            "tax": tax,
+            "shipping": shipping,
+            "total": total,
+            "items": order_items,
+            "items_count": len(order_items),
+            "shipping_address": shipping_address,
+            "billing_address": billing_address,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+        # Orden + decrementos condicionales + limpieza del carrito en
+        # una sola transacción: o se aplica todo o nada
+        transact_items = build_checkout_transaction(
+            purchases_table,
+            books_table,
+            cart_table,
+            order_item,
+            book_keys,
+            cart_response["Items"],
+        )
+
+        try:
+            dynamodb.meta.client.transact_write_items(
+                TransactItems=transact_items
+            )
+        except dynamodb.meta.client.exceptions.TransactionCanceledException as e:
+            failure = checkout_failure(
+                e.response.get("CancellationReasons", []), order_items
+            )
+            return {
+                "statusCode": failure.pop("statusCode"),
+                "headers": HEADERS,
+                "body": json.dumps(failure, default=decimal_serializer),
+            }
+
+        return {
+            "statusCode": 201,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "message": "Order created successfully",
+                    "order": {
+                        "order_id": order_id,
+                        "status": "processing",
+                        "total": float(total),
+                        "items_count": len(order_items),
+                        "estimated_delivery": (
+                            datetime.utcnow() + timedelta(days=7)
+                        ).isoformat(),
+                    },
                 }
+            ),
+        }
 
-                # Guardar orden
-                purchases_table.put_item(Item=order_item)
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Checkout error: {str(e)}"}),
+        }
 
-                # Actualizar inventario (decrementar stock_quantity)
-                for item in order_items:
-                    book = get_book_info(user["tenant_id"], item["book_id"])
-                    new_stock_quantity = (
-                        book.get("stock_quantity", 0) - item["quantity"]
-                    )
 
-                    books_table.update_item(
-                        Key={"pk": book["pk"], "sk": book["sk"]},
-                        UpdateExpression="SET stock_quantity = :stock_quantity, updated_at = :updated_at",
-                        ExpressionAttributeValues={
-                            ":stock_quantity": max(0, new_stock_quantity),
-                            ":updated_at": datetime.utcnow().isoformat(),
-                        },
-                    )
+# ===========================================
+# ORDERS & PURCHASE HISTORY
+# ===========================================
 
-                # Limpiar carrito
-                with cart_table.batch_writer() as batch:
-                    for item in cart_response["Items"]:
-                        batch.delete_item(Key={"pk": item["pk"], "sk": item["sk"]})
+# GET USER ORDERS
+@router.route("GET", "/api/v1/orders")
+def list_orders(request):
+    purchases_table = aws.get_table(PURCHASES_TABLE)
 
-                return {
-                    "statusCode": 201,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {
-                            "message": "Order created successfully",
-                            "order": {
-                                "order_id": order_id,
-                                "status": "processing",
-                                "total": float(total),
-                                "items_count": len(order_items),
-                                "estimated_delivery": (
-                                    datetime.utcnow() + timedelta(days=7)
-                                ).isoformat(),
-                            },
-                        }
-                    ),
-                }
+    user = user_from_authorization(request.authorization)
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Checkout error: {str(e)}"}),
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-        # ===========================================
-        # ORDERS & PURCHASE HISTORY
-        # ===========================================
+    try:
+        limit = min(int(request.query.get("limit", 10)), 100)
+        status = request.query.get("status", "")
+        try:
+            date_from, date_to = parse_date_range(request.query)
+        except ValueError:
+            return {
+                "statusCode": 400,
+                "headers": HEADERS,
+                "body": json.dumps({"error": "Invalid date range"}),
+            }
 
-        # GET USER ORDERS
-        elif path == "/api/v1/orders" and method == "GET":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+        # Status y fechas van en la KeyConditionExpression (GSI1 o GSI2), así
+        # que sólo se leen las órdenes que se devuelven
+        scan_params = orders_query(
+            user["tenant_id"], user["user_id"], status, date_from, date_to
+        )
+
+        # Modo compatibilidad: ?page=N lee todas las órdenes y las corta
+        if "page" in request.query:
+            page = int(request.query.get("page", 1))
+            orders = [
+                format_order_summary(item)
+                for item in query_all(purchases_table, **scan_params)
+            ]
+
+            # Ordenar por fecha de creación (más reciente primero); cubre
+            # órdenes aún no migradas con scripts/migrate_order_keys.py
+            orders.sort(key=lambda x: x["created_at"], reverse=True)
+
+            # Paginación manual
+            total_items = len(orders)
+            start_idx = (page - 1) * limit
+            end_idx = start_idx + limit
+            paginated_orders = orders[start_idx:end_idx]
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+            return {
+                "statusCode": 200,
+                "headers": HEADERS,
+                "body": json.dumps(
+                    create_pagination_response(
+                        paginated_orders, page, limit, total_items
+                    ),
+                    default=decimal_serializer,
+                ),
+            }
 
-            try:
-                page = int(query_params.get("page", 1))
-                limit = min(int(query_params.get("limit", 10)), 100)
-                status = query_params.get("status", "")
-
-                # Query usando GSI1
-                scan_params = {
-                    "IndexName": "GSI1",
-                    "KeyConditionExpression": boto3.dynamodb.conditions.Key(
-                        "gsi1pk"
-                    ).eq(f'USER#{user["tenant_id"]}#{user["user_id"]}'),
-                }
+        items, next_cursor = query_page(
+            purchases_table,
+            limit,
+            request.query.get("cursor"),
+            scope=(
+                f'USER#{user["tenant_id"]}#{user["user_id"]}#{status}#'
+                f'{request.query.get("from", "")}#{request.query.get("to", "")}'
+            ),
+            **scan_params,
+        )
 
-                if status:
-                    scan_params["FilterExpression"] = boto3.dynamodb.conditions.Attr(
-                        "status"
-                    ).eq(status)
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                create_cursor_response(
+                    [format_order_summary(item) for item in items], limit, next_cursor
+                ),
+                default=decimal_serializer,
+            ),
+        }
 
-                response = purchases_table.query(**scan_params)
-                orders = []
+    except InvalidCursor:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Invalid cursor"}),
+        }
 
-                for item in response["Items"]:
-                    orders.append(
-                        {
-                            "order_id": item.get("order_id"),
-                            "status": item.get("status", "unknown"),
-                            "payment_status": item.get("payment_status", "pending"),
-                            "total": float(item.get("total", 0)),
-                            "items_count": item.get("items_count", 0),
-                            "created_at": item.get("created_at"),
-                            "updated_at": item.get("updated_at"),
-                        }
-                    )
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-                # Ordenar por fecha de creación (más reciente primero)
-                orders.sort(key=lambda x: x["created_at"], reverse=True)
 
-                # Paginación manual
-                total_items = len(orders)
-                start_idx = (page - 1) * limit
-                end_idx = start_idx + limit
-                paginated_orders = orders[start_idx:end_idx]
+# GET ORDER DETAILS
+@router.route("GET", "/api/v1/orders/{order_id}")
+def get_order(request):
+    purchases_table = aws.get_table(PURCHASES_TABLE)
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        create_pagination_response(
-                            paginated_orders, page, limit, total_items
-                        ),
-                        default=decimal_serializer,
-                    ),
-                }
+    user = user_from_authorization(request.authorization)
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-        # GET ORDER DETAILS
-        elif path.startswith("/api/v1/orders/") and method == "GET":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+    order_id = request.params["order_id"]
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+    try:
+        response = purchases_table.get_item(
+            Key={"pk": f'ORDER#{user["tenant_id"]}#{order_id}', "sk": "DETAILS"}
+        )
 
-            order_id = path.split("/")[-1]
+        if "Item" not in response:
+            return {
+                "statusCode": 404,
+                "headers": HEADERS,
+                "body": json.dumps({"error": "Order not found"}),
+            }
 
-            try:
-                response = purchases_table.get_item(
-                    Key={"pk": f'ORDER#{user["tenant_id"]}#{order_id}', "sk": "DETAILS"}
-                )
+        order = response["Item"]
+
+        # Verificar que la orden pertenece al usuario
+        if order.get("user_id") != user["user_id"]:
+            return {
+                "statusCode": 403,
+                "headers": HEADERS,
+                "body": json.dumps({"error": "Access denied"}),
+            }
 
-                if "Item" not in response:
-                    return {
-                        "statusCode": 404,
-                        "headers": headers,
-                        "body": json.dumps({"error": "Order not found"}),
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "order": {
+                        "order_id": order.get("order_id"),
+                        "status": order.get("status"),
+                        "payment_status": order.get("payment_status"),
+                        "payment_method": order.get("payment_method"),
+                        "subtotal": order.get("subtotal", 0),
+                        "tax": order.get("tax", 0),
+                        "shipping": order.get("shipping", 0),
+                        "total": order.get("total", 0),
+                        "items": order.get("items", []),
+                        "items_count": order.get("items_count", 0),
+                        "shipping_address": order.get("shipping_address", {}),
+                        "billing_address": order.get("billing_address", {}),
+                        "created_at": order.get("created_at"),
+                        "updated_at": order.get("updated_at"),
                     }
+                },
+                default=decimal_serializer,
+            ),
+        }
 
-                order = response["Item"]
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-                # Verificar que la orden pertenece al usuario
-                if order.get("user_id") != user["user_id"]:
-                    return {
-                        "statusCode": 403,
-                        "headers": headers,
-                        "body": json.dumps({"error": "Access denied"}),
-                    }
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {
-                            "order": {
-                                "order_id": order.get("order_id"),
-                                "status": order.get("status"),
-                                "payment_status": order.get("payment_status"),
-                                "payment_method": order.get("payment_method"),
-                                "subtotal": order.get("subtotal", 0),
-                                "tax": order.get("tax", 0),
-                                "shipping": order.get("shipping", 0),
-                                "total": order.get("total", 0),
-                                "items": order.get("items", []),
-                                "items_count": order.get("items_count", 0),
-                                "shipping_address": order.get("shipping_address", {}),
-                                "billing_address": order.get("billing_address", {}),
-                                "created_at": order.get("created_at"),
-                                "updated_at": order.get("updated_at"),
-                            }
-                        },
-                        default=decimal_serializer,
-                    ),
-                }
+# ===========================================
+# ANALYTICS & REPORTS
+# ===========================================
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+# GET PURCHASE ANALYTICS
+@router.route("GET", "/api/v1/analytics/purchases")
+def get_purchase_analytics(request):
+    purchases_table = aws.get_table(PURCHASES_TABLE)
 
-        # ===========================================
-        # ANALYTICS & REPORTS
-        # ===========================================
+    user = user_from_authorization(request.authorization)
 
-        # GET PURCHASE ANALYTICS
-        elif path == "/api/v1/analytics/purchases" and method == "GET":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+    try:
+        date_from, date_to = parse_date_range(request.query)
+    except ValueError:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Invalid date range"}),
+        }
 
-            try:
-                # Obtener todas las órdenes del usuario
-                response = purchases_table.query(
-                    IndexName="GSI1",
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key("gsi1pk").eq(
-                        f'USER#{user["tenant_id"]}#{user["user_id"]}'
-                    ),
-                )
+    try:
+        # Sin rango de fechas: un get_item sobre el agregado que mantiene el checkout
+        if not date_from and not date_to:
+            response = purchases_table.get_item(
+                Key=purchase_analytics.summary_key(user["tenant_id"], user["user_id"])
+            )
+            analytics = purchase_analytics.format_summary(response.get("Item"))
+            analytics["generated_at"] = datetime.utcnow().isoformat()
+            return {
+                "statusCode": 200,
+                "headers": HEADERS,
+                "body": json.dumps({"analytics": analytics}),
+            }
 
-                orders = response["Items"]
-
-                # Calcular estadísticas
-                total_orders = len(orders)
-                total_spent = sum(float(order.get("total", 0)) for order in orders)
-                completed_orders = [
-                    order for order in orders if order.get("status") == "completed"
-                ]
-                pending_orders = [
-                    order
-                    for order in orders
-                    if order.get("status") in ["processing", "pending"]
-                ]
-
-                # Estadísticas por mes (últimos 12 meses)
-                monthly_stats = {}
-                for order in orders:
-                    if order.get("created_at"):
-                        month_key = order["created_at"][:7]  # YYYY-MM
-                        if month_key not in monthly_stats:
-                            monthly_stats[month_key] = {"orders": 0, "total": 0}
-                        monthly_stats[month_key]["orders"] += 1
-                        monthly_stats[month_key]["total"] += order.get("total", 0)
+        # Órdenes del usuario en el rango pedido (?from=&to=); sólo se
+        # proyectan los atributos que usan las estadísticas
+        orders = query_all(
+            purchases_table,
+            ProjectionExpression="#total, #status, created_at",
+            ExpressionAttributeNames={"#total": "total", "#status": "status"},
+            **orders_query(
+                user["tenant_id"], user["user_id"], date_from=date_from, date_to=date_to
+            ),
+        )
+
+        # Calcular estadísticas
+        total_orders = len(orders)
+        total_spent = sum(float(order.get("total", 0)) for order in orders)
+        completed_orders = [
+            order for order in orders if order.get("status") == "completed"
+        ]
+        pending_orders = [
+            order
+            for order in orders
+            if order.get("status") in ["processing", "pending"]
+        ]
+
+        # Estadísticas por mes
+        monthly_stats = {}
+        for order in orders:
+            if order.get("created_at"):
+                month_key = order["created_at"][:7]  # YYYY-MM
+                if month_key not in monthly_stats:
+                    monthly_stats[month_key] = {"orders": 0, "total": 0}
+                monthly_stats[month_key]["orders"] += 1
+                monthly_stats[month_key]["total"] += order.get("total", 0)
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {
-                            "analytics": {
-                                "summary": {
-                                    "total_orders": total_orders,
-                                    "total_spent": round(total_spent, 2),
-                                    "average_order_value": (
-                                        round(total_spent / total_orders, 2)
-                                        if total_orders > 0
-                                        else 0
-                                    ),
-                                    "completed_orders": len(completed_orders),
-                                    "pending_orders": len(pending_orders),
-                                },
-                                "monthly_stats": monthly_stats,
-                                "generated_at": datetime.utcnow().isoformat(),
-                            }
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "analytics": {
+                        "summary": {
+                            "total_orders": total_orders,
+                            "total_spent": round(total_spent, 2),
+                            "average_order_value": (
+                                round(total_spent / total_orders, 2)
+                                if total_orders > 0
+                                else 0
+                            ),
+                            "completed_orders": len(completed_orders),
+                            "pending_orders": len(pending_orders),
                         },
-                        default=decimal_serializer,
-                    ),
+                        "monthly_stats": monthly_stats,
+                        "generated_at": datetime.utcnow().isoformat(),
+                    }
+                },
+                default=decimal_serializer,
+            ),
+        }
+
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
+
+
+# GET TENANT REVENUE ROLLUPS
+@router.route("GET", "/api/v1/analytics/rollups")
+def get_revenue_rollups(request):
+    purchases_table = aws.get_table(PURCHASES_TABLE)
+
+    user = user_from_authorization(request.authorization)
+
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
+
+    # Datos de todo el tenant: sólo administradores
+    if user["role"] != "admin":
+        return {
+            "statusCode": 403,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Admin access required"}),
+        }
+
+    grain = request.query.get("grain", "day")
+    dimension = request.query.get("dimension", "total")
+    if grain not in purchase_analytics.ROLLUP_GRAINS:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {"error": f"grain must be one of {', '.join(purchase_analytics.ROLLUP_GRAINS)}"}
+            ),
+        }
+    if dimension not in purchase_analytics.ROLLUP_DIMENSIONS:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {"error": f"dimension must be one of {', '.join(purchase_analytics.ROLLUP_DIMENSIONS)}"}
+            ),
+        }
+
+    # ?from= y ?to= como prefijos ISO (YYYY-MM, YYYY-MM-DD o YYYY-MM-DDTHH); por defecto hoy
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    period_from = request.query.get("from", today)
+    period_to = request.query.get("to", period_from)
+    if period_from > period_to:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "from must be before to"}),
+        }
+
+    try:
+        # Una Query sobre las celdas del rango: coste proporcional a las
+        # celdas devueltas, no al número de órdenes
+        cells = query_all(
+            purchases_table,
+            **purchase_analytics.rollup_query(
+                user["tenant_id"], grain, dimension, period_from, period_to
+            ),
+        )
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "grain": grain,
+                    "dimension": dimension,
+                    "from": period_from,
+                    "to": period_to,
+                    "cells": [purchase_analytics.format_rollup_cell(cell) for cell in cells],
                 }
+            ),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
+
+
+# GET UNIQUE BUYERS AND BESTSELLERS
+@router.route("GET", "/api/v1/analytics/sketches")
+def get_analytics_sketches(request):
+    purchases_table = aws.get_table(PURCHASES_TABLE)
+
+    user = user_from_authorization(request.authorization)
+
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
+
+    if user["role"] != "admin":
+        return {
+            "statusCode": 403,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Admin access required"}),
+        }
+
+    grain = request.query.get("grain", "month")
+    if grain not in purchase_analytics.SKETCH_GRAINS:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {"error": f"grain must be one of {', '.join(purchase_analytics.SKETCH_GRAINS)}"}
+            ),
+        }
+
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    period_from = request.query.get("from", today)
+    period_to = request.query.get("to", period_from)
+    limit = min(int(request.query.get("limit", 10)), 100)
+    if period_from > period_to:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "from must be before to"}),
+        }
+
+    try:
+        # Un sketch por periodo del rango; fusionarlos da el del rango completo
+        # (compradores únicos sin contar dos veces al que repite)
+        items = query_all(
+            purchases_table,
+            **purchase_analytics.sketch_query(user["tenant_id"], grain, period_from, period_to),
+        )
+        buyers, top_books = purchase_analytics.read_sketches(None)
+        for item in items:
+            item_buyers, item_top_books = purchase_analytics.read_sketches(item)
+            buyers.merge(item_buyers)
+            top_books.merge(item_top_books)
+
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "grain": grain,
+                    "from": period_from,
+                    "to": period_to,
+                    "periods": len(items),
+                    **purchase_analytics.format_sketches(buyers, top_books, limit),
                 }
+            ),
+        }
 
-        # ===========================================
-        # ENDPOINT NOT FOUND
-        # ===========================================
-        else:
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
+
+
+def lambda_handler(event, context):
+    """
+    Handler para AWS Lambda que maneja requests HTTP para compras.
+    El dispatch se hace con la tabla de rutas compilada al importar el módulo;
+    incluye carrito, checkout, órdenes y analytics
+    """
+    request = Request(event)
+
+    try:
+        route_handler, request.params = router.resolve(request.method, request.path)
+
+        if route_handler is None:
             return {
                 "statusCode": 404,
-                "headers": headers,
+                "headers": HEADERS,
                 "body": json.dumps(
                     {
                         "error": "Endpoint not found",
-                        "path": path,
-                        "method": method,
-                        "available_endpoints": [
-                            "GET /",
-                            "GET /api/v1/cart",
-                            "POST /api/v1/cart",
-                            "PUT /api/v1/cart/{cart_item_id}",
-                            "DELETE /api/v1/cart/{cart_item_id}",
-                            "POST /api/v1/cart/clear",
-                            "POST /api/v1/checkout",
-                            "GET /api/v1/orders",
-                            "GET /api/v1/orders/{order_id}",
-                            "GET /api/v1/analytics/purchases",
-                        ],
+                        "path": request.path,
+                        "method": request.method,
+                        "available_endpoints": router.endpoints(),
                     }
                 ),
             }
 
+        return route_handler(request)
+
     except Exception as e:
         return {
             "statusCode": 500,
-            "headers": headers,
+            "headers": HEADERS,
             "body": json.dumps({"error": "Internal server error", "details": str(e)}),
         }
 
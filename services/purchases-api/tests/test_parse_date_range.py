@@ -0,0 +1,50 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(SERVICE_DIR, "..", "common", "python"))
+sys.path.insert(0, SERVICE_DIR)
+
+import app  # noqa: E402
+
+
+class Python39Datetime(datetime):
+    """fromisoformat del runtime python3.9 de Lambda: no acepta el sufijo Z"""
+
+    @classmethod
+    def fromisoformat(cls, value):
+        if value.endswith("Z"):
+            raise ValueError(f"Invalid isoformat string: {value!r}")
+        return super().fromisoformat(value)
+
+
+@pytest.fixture(autouse=True)
+def python39_fromisoformat(monkeypatch):
+    monkeypatch.setattr(app, "datetime", Python39Datetime)
+
+
+def test_z_suffix_is_utc():
+    date_from, date_to = app.parse_date_range(
+        {"from": "2024-01-01T00:00:00Z", "to": "2024-01-01T12:30:00Z"}
+    )
+    assert date_from == datetime(2024, 1, 1, 0, 0)
+    assert date_to == datetime(2024, 1, 1, 12, 30)
+
+
+def test_offset_is_converted_to_naive_utc():
+    date_from, _ = app.parse_date_range({"from": "2024-01-01T02:00:00+02:00"})
+    assert date_from == datetime(2024, 1, 1, 0, 0)
+    assert date_from.tzinfo is None
+
+
+def test_date_only_to_includes_whole_day():
+    _, date_to = app.parse_date_range({"to": "2024-01-01"})
+    assert date_to == datetime(2024, 1, 1, 23, 59, 59, 999000)
+
+
+def test_from_after_to_is_rejected():
+    with pytest.raises(ValueError):
+        app.parse_date_range({"from": "2024-01-02T00:00:00Z", "to": "2024-01-01"})
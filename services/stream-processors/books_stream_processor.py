@@ -1,7 +1,8 @@
 import json
 import os
 import logging
-from datetime import datetime
+import time
+from collections import Counter, namedtuple
 from elasticsearch import Elasticsearch, RequestsHttpConnection
 from decimal import Decimal
 
@@ -13,8 +14,55 @@ logger.setLevel(logging.INFO)
 es_host = os.environ.get("ELASTICSEARCH_HOST", "http://localhost:9200")
 es_client = None
 
+# Reintentos del _bulk: sólo se reenvían los items que fallaron con un error
+# transitorio; los que sigan fallando se devuelven en batchItemFailures
+BULK_MAX_RETRIES = int(os.environ.get("ES_BULK_MAX_RETRIES", "3"))
+BULK_RETRY_BASE_DELAY = 0.2
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+# Modo de índices:
+#   per_tenant (default) un índice books_{tenant_id} por tenant
+#   shared               un único índice ES_SHARED_INDEX para todos los tenants;
+#                        books_{tenant_id} es un alias filtrado por tenant_id con
+#                        routing=tenant_id, así que lecturas y escrituras siguen
+#                        usando el mismo nombre y cada tenant vive en un shard
+# En modo shared el book_id tiene que ser único entre tenants (son UUID)
+INDEX_MODE = os.environ.get("ES_INDEX_MODE", "per_tenant")
+SHARED_INDEX = os.environ.get("ES_SHARED_INDEX", "books")
+SHARED_INDEX_SHARDS = int(os.environ.get("ES_SHARED_INDEX_SHARDS", "1"))
+INDEX_PREFIX = "books_"
+
+# Configuración de los índices books_{tenant_id}. Se registra como index
+# template para books_*, así un índice nuevo recibe el mapping aunque lo cree
+# el propio _bulk (auto_create_index)
+INDEX_TEMPLATE_NAME = "books"
+INDEX_PATTERN = "books_*"
+INDEX_CONFIG = {
+    "mappings": {
+        "properties": {
+            "book_id": {"type": "keyword"},
+            "tenant_id": {"type": "keyword"},
+            "title": {"type": "text", "analyzer": "spanish"},
+            "author": {"type": "text", "analyzer": "spanish"},
+            "description": {"type": "text", "analyzer": "spanish"},
+            "category": {"type": "keyword"},
+            "price": {"type": "double"},
+            "rating": {"type": "double"},
+            "publication_year": {"type": "integer"},
+            "stock_quantity": {"type": "integer"},
+            "suggest": {"type": "completion", "analyzer": "simple"},
+        }
+    },
+    "settings": {"analysis": {"analyzer": {"spanish": {"type": "spanish"}}}},
+}
+
+# Estado por contenedor: el template se registra una vez y cada índice se
+# comprueba una vez; las invocaciones en caliente no hacen indices.exists
+index_template_registered = False
+known_indices = set()
+
 
-def get_elasticsearch_client(tenant_id):
+def get_elasticsearch_client(tenant_id=None):
     """Obtener cliente de Elasticsearch para un tenant específico"""
     global es_client
     try:
@@ -44,195 +92,350 @@ def decimal_to_float(obj):
     return obj
 
 
-def process_book_insert(record):
-    """Procesar inserción de libro nuevo"""
-    try:
-        book_data = record["dynamodb"]["NewImage"]
-
-        # Extraer datos del libro
-        book_doc = {
-            "book_id": book_data.get("book_id", {}).get("S", ""),
-            "tenant_id": book_data.get("tenant_id", {}).get("S", ""),
-            "isbn": book_data.get("isbn", {}).get("S", ""),
-            "title": book_data.get("title", {}).get("S", ""),
-            "author": book_data.get("author", {}).get("S", ""),
-            "editorial": book_data.get("editorial", {}).get("S", ""),
-            "category": book_data.get("category", {}).get("S", ""),
-            "price": float(book_data.get("price", {}).get("N", "0")),
-            "description": book_data.get("description", {}).get("S", ""),
-            "cover_image_url": book_data.get("cover_image_url", {}).get("S", ""),
-            "stock_quantity": int(book_data.get("stock_quantity", {}).get("N", "0")),
-            "publication_year": int(
-                book_data.get("publication_year", {}).get("N", "0")
-            ),
-            "language": book_data.get("language", {}).get("S", "es"),
-            "pages": int(book_data.get("pages", {}).get("N", "0")),
-            "rating": float(book_data.get("rating", {}).get("N", "0")),
-            "created_at": book_data.get("created_at", {}).get("S", ""),
-            "updated_at": book_data.get("updated_at", {}).get("S", ""),
-            "is_active": book_data.get("is_active", {}).get("BOOL", True),
-            "suggest": {
-                "input": [
-                    book_data.get("title", {}).get("S", ""),
-                    book_data.get("author", {}).get("S", ""),
-                    book_data.get("category", {}).get("S", ""),
-                ]
-            },
-        }
+def index_name_for(tenant_id):
+    """Nombre (índice o alias) con el que se lee y escribe el catálogo del tenant"""
+    return f"{INDEX_PREFIX}{tenant_id}"
 
-        tenant_id = book_doc["tenant_id"]
-        es_client = get_elasticsearch_client(tenant_id)
-
-        if es_client:
-            # Crear índice si no existe
-            index_name = f"books_{tenant_id}"
-
-            if not es_client.indices.exists(index=index_name):
-                # Configuración del índice
-                index_config = {
-                    "mappings": {
-                        "properties": {
-                            "book_id": {"type": "keyword"},
-                            "tenant_id": {"type": "keyword"},
-                            "title": {"type": "text", "analyzer": "spanish"},
-                            "author": {"type": "text", "analyzer": "spanish"},
-                            "description": {"type": "text", "analyzer": "spanish"},
-                            "category": {"type": "keyword"},
-                            "price": {"type": "double"},
-                            "rating": {"type": "double"},
-                            "publication_year": {"type": "integer"},
-                            "stock_quantity": {"type": "integer"},
-                            "suggest": {"type": "completion", "analyzer": "simple"},
-                        }
-                    },
-                    "settings": {
-                        "analysis": {"analyzer": {"spanish": {"type": "spanish"}}}
-                    },
-                }
-
-                es_client.indices.create(index=index_name, body=index_config)
-                logger.info(f"Índice creado: {index_name}")
-
-            # Indexar documento
-            es_client.index(index=index_name, id=book_doc["book_id"], body=book_doc)
-
-            logger.info(f"Libro indexado: {book_doc['book_id']} en {index_name}")
-        else:
-            logger.warning("No se pudo conectar a Elasticsearch, saltando indexación")
 
-    except Exception as e:
-        logger.error(f"Error procesando inserción de libro: {str(e)}")
+def tenant_alias(tenant_id):
+    """Definición del alias books_{tenant_id} sobre el índice compartido"""
+    return {"filter": {"term": {"tenant_id": tenant_id}}, "routing": tenant_id}
 
 
-def process_book_modify(record):
-    """Procesar modificación de libro"""
-    try:
-        book_data = record["dynamodb"]["NewImage"]
-        tenant_id = book_data.get("tenant_id", {}).get("S", "")
-        book_id = book_data.get("book_id", {}).get("S", "")
-
-        es_client = get_elasticsearch_client(tenant_id)
-
-        if es_client:
-            index_name = f"books_{tenant_id}"
-
-            # Actualizar documento
-            book_doc = {
-                "book_id": book_id,
-                "tenant_id": tenant_id,
-                "isbn": book_data.get("isbn", {}).get("S", ""),
-                "title": book_data.get("title", {}).get("S", ""),
-                "author": book_data.get("author", {}).get("S", ""),
-                "editorial": book_data.get("editorial", {}).get("S", ""),
-                "category": book_data.get("category", {}).get("S", ""),
-                "price": float(book_data.get("price", {}).get("N", "0")),
-                "description": book_data.get("description", {}).get("S", ""),
-                "cover_image_url": book_data.get("cover_image_url", {}).get("S", ""),
-                "stock_quantity": int(
-                    book_data.get("stock_quantity", {}).get("N", "0")
-                ),
-                "publication_year": int(
-                    book_data.get("publication_year", {}).get("N", "0")
-                ),
-                "language": book_data.get("language", {}).get("S", "es"),
-                "pages": int(book_data.get("pages", {}).get("N", "0")),
-                "rating": float(book_data.get("rating", {}).get("N", "0")),
-                "created_at": book_data.get("created_at", {}).get("S", ""),
-                "updated_at": book_data.get("updated_at", {}).get("S", ""),
-                "is_active": book_data.get("is_active", {}).get("BOOL", True),
-                "suggest": {
-                    "input": [
-                        book_data.get("title", {}).get("S", ""),
-                        book_data.get("author", {}).get("S", ""),
-                        book_data.get("category", {}).get("S", ""),
-                    ]
-                },
-            }
+def build_book_doc(book_data):
+    """Documento de Elasticsearch a partir de una imagen del stream"""
+    return {
+        "book_id": book_data.get("book_id", {}).get("S", ""),
+        "tenant_id": book_data.get("tenant_id", {}).get("S", ""),
+        "isbn": book_data.get("isbn", {}).get("S", ""),
+        "title": book_data.get("title", {}).get("S", ""),
+        "author": book_data.get("author", {}).get("S", ""),
+        "editorial": book_data.get("editorial", {}).get("S", ""),
+        "category": book_data.get("category", {}).get("S", ""),
+        "price": float(book_data.get("price", {}).get("N", "0")),
+        "description": book_data.get("description", {}).get("S", ""),
+        "cover_image_url": book_data.get("cover_image_url", {}).get("S", ""),
+        "stock_quantity": int(book_data.get("stock_quantity", {}).get("N", "0")),
+        "publication_year": int(book_data.get("publication_year", {}).get("N", "0")),
+        "language": book_data.get("language", {}).get("S", "es"),
+        "pages": int(book_data.get("pages", {}).get("N", "0")),
+        "rating": float(book_data.get("rating", {}).get("N", "0")),
+        "created_at": book_data.get("created_at", {}).get("S", ""),
+        "updated_at": book_data.get("updated_at", {}).get("S", ""),
+        "is_active": book_data.get("is_active", {}).get("BOOL", True),
+        "suggest": {
+            "input": [
+                book_data.get("title", {}).get("S", ""),
+                book_data.get("author", {}).get("S", ""),
+                book_data.get("category", {}).get("S", ""),
+            ]
+        },
+    }
 
-            es_client.index(index=index_name, id=book_id, body=book_doc)
 
-            logger.info(f"Libro actualizado en ES: {book_id}")
-        else:
-            logger.warning("No se pudo conectar a Elasticsearch")
+# Campos que se pueden actualizar con un _update parcial: numéricos o
+# volátiles, que no afectan al análisis de texto ni al suggest
+PARTIAL_UPDATE_FIELDS = {"stock_quantity", "price", "rating", "updated_at", "is_active"}
 
-    except Exception as e:
-        logger.error(f"Error procesando modificación de libro: {str(e)}")
+# Acción de _bulk. full_doc es el documento completo con el que se reintenta
+# un _update parcial si el documento todavía no existe en el índice
+BulkAction = namedtuple("BulkAction", "sequence_number metadata source full_doc")
 
 
-def process_book_remove(record):
-    """Procesar eliminación de libro"""
-    try:
-        book_data = record["dynamodb"]["OldImage"]
-        tenant_id = book_data.get("tenant_id", {}).get("S", "")
-        book_id = book_data.get("book_id", {}).get("S", "")
+def changed_fields(old_doc, new_doc):
+    return {field for field, value in new_doc.items() if old_doc.get(field) != value}
 
-        es_client = get_elasticsearch_client(tenant_id)
 
-        if es_client:
-            index_name = f"books_{tenant_id}"
+def record_action(record):
+    """
+    Clasificar un registro del stream y construir su acción de _bulk.
+    Devuelve (tipo, BulkAction o None), con tipo:
+      - full:    INSERT, o MODIFY que cambia algún campo de texto -> index
+      - partial: MODIFY que sólo cambia PARTIAL_UPDATE_FIELDS -> update parcial
+      - skipped: MODIFY sin cambios en campos indexados (p. ej. claves de GSI)
+      - delete:  REMOVE -> delete
+    """
+    event_name = record["eventName"]
+    sequence_number = record["dynamodb"]["SequenceNumber"]
 
-            try:
-                es_client.delete(index=index_name, id=book_id)
-                logger.info(f"Libro eliminado de ES: {book_id}")
-            except Exception as e:
-                if "not_found" not in str(e):
-                    raise e
-                logger.info(f"Libro no encontrado en ES (ya eliminado): {book_id}")
-        else:
-            logger.warning("No se pudo conectar a Elasticsearch")
+    if event_name in ("INSERT", "MODIFY"):
+        book_doc = build_book_doc(record["dynamodb"]["NewImage"])
+        metadata = {"_index": index_name_for(book_doc["tenant_id"]), "_id": book_doc["book_id"]}
 
-    except Exception as e:
-        logger.error(f"Error procesando eliminación de libro: {str(e)}")
+        old_image = record["dynamodb"].get("OldImage")
+        if event_name == "MODIFY" and old_image:
+            changed = changed_fields(build_book_doc(old_image), book_doc)
+            if not changed:
+                return "skipped", None
+            if changed <= PARTIAL_UPDATE_FIELDS:
+                partial_doc = {field: book_doc[field] for field in changed}
+                return "partial", BulkAction(
+                    sequence_number, {"update": metadata}, {"doc": partial_doc}, book_doc
+                )
 
+        return "full", BulkAction(sequence_number, {"index": metadata}, book_doc, None)
 
-def handler(event, context):
-    """Handler principal para procesar streams de DynamoDB"""
-    logger.info(f"Procesando {len(event['Records'])} registros del stream")
+    if event_name == "REMOVE":
+        book_data = record["dynamodb"]["OldImage"]
+        metadata = {
+            "_index": index_name_for(book_data.get("tenant_id", {}).get("S", "")),
+            "_id": book_data.get("book_id", {}).get("S", ""),
+        }
+        return "delete", BulkAction(sequence_number, {"delete": metadata}, None, None)
+
+    logger.warning(f"Evento no manejado: {event_name}")
+    return "skipped", None
+
+
+def book_key(record):
+    """(tenant_id, book_id) del documento al que afecta el registro"""
+    image = record["dynamodb"].get("NewImage") or record["dynamodb"].get("OldImage") or {}
+    return (
+        image.get("tenant_id", {}).get("S", ""),
+        image.get("book_id", {}).get("S", ""),
+    )
+
+
+def coalesce_records(records):
+    """
+    Reducir el batch al último estado de cada libro: varios MODIFY seguidos
+    (ediciones, decrementos de stock en checkouts) producen una sola escritura.
+
+    El registro resultante conserva el SequenceNumber del primero del grupo,
+    para que un fallo haga reintentar el grupo completo, y:
+      - termina en REMOVE: REMOVE con la última OldImage (INSERT + REMOVE
+        también es un delete; si el documento no llegó a indexarse, el 404 se
+        da por bueno)
+      - termina en INSERT/MODIFY: NewImage del último; si el grupo empieza con
+        un MODIFY y no hubo REMOVE entre medias, OldImage del primero, para
+        que record_action compare el estado inicial con el final. Si no, se
+        trata como INSERT (index completo)
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(book_key(record), []).append(record)
+
+    coalesced = []
+    for group in groups.values():
+        if len(group) == 1:
+            coalesced.append(group[0])
+            continue
+
+        first, last = group[0], group[-1]
+        dynamodb = {"SequenceNumber": first["dynamodb"]["SequenceNumber"]}
+        if "Keys" in last["dynamodb"]:
+            dynamodb["Keys"] = last["dynamodb"]["Keys"]
+
+        if last["eventName"] == "REMOVE":
+            event_name = "REMOVE"
+            dynamodb["OldImage"] = last["dynamodb"]["OldImage"]
+        elif all(record["eventName"] == "MODIFY" for record in group):
+            event_name = "MODIFY"
+            dynamodb["NewImage"] = last["dynamodb"]["NewImage"]
+            if "OldImage" in first["dynamodb"]:
+                dynamodb["OldImage"] = first["dynamodb"]["OldImage"]
+        else:
+            event_name = "INSERT"
+            dynamodb["NewImage"] = last["dynamodb"]["NewImage"]
 
-    for record in event["Records"]:
-        event_name = record["eventName"]
+        coalesced.append({**last, "eventName": event_name, "dynamodb": dynamodb})
+    return coalesced
+
+
+def ensure_index_template(es_client):
+    """Registrar INDEX_CONFIG como index template de books_* (una vez por contenedor)"""
+    global index_template_registered
+    if index_template_registered:
+        return
+    try:
+        es_client.indices.put_index_template(
+            name=INDEX_TEMPLATE_NAME,
+            body={"index_patterns": [INDEX_PATTERN], "template": INDEX_CONFIG},
+        )
+    except Exception as e:
+        # No es fatal: ensure_index crea los índices con el mapping explícito
+        logger.warning(f"No se pudo registrar el index template: {str(e)}")
+        return
+    index_template_registered = True
+    logger.info(f"Index template registrado: {INDEX_TEMPLATE_NAME} ({INDEX_PATTERN})")
+
+
+def ensure_shared_alias(es_client, index_name):
+    """Modo shared: índice compartido y alias filtrado del tenant"""
+    if SHARED_INDEX not in known_indices:
+        if not es_client.indices.exists(index=SHARED_INDEX):
+            body = {
+                **INDEX_CONFIG,
+                "settings": {**INDEX_CONFIG["settings"], "number_of_shards": SHARED_INDEX_SHARDS},
+            }
+            es_client.indices.create(index=SHARED_INDEX, body=body, ignore=400)
+            logger.info(f"Índice compartido creado: {SHARED_INDEX}")
+        known_indices.add(SHARED_INDEX)
+
+    if not es_client.indices.exists_alias(name=index_name):
+        tenant_id = index_name[len(INDEX_PREFIX):]
+        es_client.indices.put_alias(
+            index=SHARED_INDEX, name=index_name, body=tenant_alias(tenant_id)
+        )
+        logger.info(f"Alias creado: {index_name} -> {SHARED_INDEX}")
+    known_indices.add(index_name)
+
+
+def ensure_index(es_client, index_name):
+    """Crear el índice si todavía no existe; sólo la primera vez por contenedor"""
+    if index_name in known_indices:
+        return
+    if INDEX_MODE == "shared":
+        ensure_shared_alias(es_client, index_name)
+        return
+    if not es_client.indices.exists(index=index_name):
+        # El body es redundante con el template, pero deja el índice bien
+        # configurado aunque el template se haya borrado
+        es_client.indices.create(index=index_name, body=INDEX_CONFIG, ignore=400)
+        logger.info(f"Índice creado: {index_name}")
+    known_indices.add(index_name)
+
+
+def bulk_body(actions):
+    body = []
+    for action in actions:
+        body.append(action.metadata)
+        if action.source is not None:
+            body.append(action.source)
+    return body
+
+
+def item_succeeded(operation, result):
+    status = result.get("status", 500)
+    # Borrar un documento que ya no está en el índice no es un error
+    return 200 <= status < 300 or (operation == "delete" and status == 404)
+
+
+def send_bulk(es_client, actions):
+    """
+    Enviar las acciones en un único _bulk, reintentando con backoff sólo los
+    items que fallan con un error transitorio. Un _update parcial sobre un
+    documento que no existe se reintenta como index del documento completo.
+    Devuelve los sequence numbers de los registros que no se pudieron aplicar
+    """
+    pending = actions
+    failed = []
+
+    for attempt in range(BULK_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(BULK_RETRY_BASE_DELAY * (2 ** (attempt - 1)))
 
         try:
-            if event_name == "INSERT":
-                process_book_insert(record)
-            elif event_name == "MODIFY":
-                process_book_modify(record)
-            elif event_name == "REMOVE":
-                process_book_remove(record)
+            response = es_client.bulk(body=bulk_body(pending))
+        except Exception as e:
+            # Error de toda la petición (conexión, 429 global): se reintenta todo
+            logger.warning(f"Error en _bulk (intento {attempt + 1}): {str(e)}")
+            continue
+
+        retry = []
+        for action, item in zip(pending, response["items"]):
+            operation, result = next(iter(item.items()))
+            if item_succeeded(operation, result):
+                continue
+            if operation == "update" and result.get("status") == 404:
+                retry.append(
+                    action._replace(
+                        metadata={"index": action.metadata["update"]},
+                        source=action.full_doc,
+                        full_doc=None,
+                    )
+                )
+            elif result.get("status") in RETRYABLE_STATUSES:
+                retry.append(action)
             else:
-                logger.warning(f"Evento no manejado: {event_name}")
+                logger.error(
+                    f"Error indexando {result.get('_index')}/{result.get('_id')}: "
+                    f"{result.get('error')}"
+                )
+                failed.append(action.sequence_number)
+
+        pending = retry
+        if not pending:
+            break
 
+    failed.extend(action.sequence_number for action in pending)
+    return failed
+
+
+def handler(event, context):
+    """
+    Handler principal para procesar streams de DynamoDB.
+    Los registros del mismo libro se reducen a su último estado
+    (coalesce_records) antes de construir las escrituras.
+    Todas las escrituras del batch van en un único _bulk; los registros que
+    no se pudieron aplicar se devuelven en batchItemFailures para que Lambda
+    reintente exactamente esos (functionResponseType: ReportBatchItemFailures)
+    """
+    records = event["Records"]
+    logger.info(f"Procesando {len(records)} registros del stream")
+    started = time.perf_counter()
+
+    counters = Counter()
+    actions = []
+    failed = []
+    coalesced = coalesce_records(records)
+    counters["coalesced"] = len(records) - len(coalesced)
+    for record in coalesced:
+        try:
+            kind, action = record_action(record)
         except Exception as e:
-            logger.error(f"Error procesando registro {event_name}: {str(e)}")
-            # Continuar con el siguiente registro en lugar de fallar completamente
+            logger.error(f"Error procesando registro {record['eventName']}: {str(e)}")
+            failed.append(record["dynamodb"]["SequenceNumber"])
             continue
+        counters[kind] += 1
+        if action:
+            actions.append(action)
 
-    return {
-        "statusCode": 200,
-        "body": json.dumps(
+    if actions:
+        es_client = get_elasticsearch_client()
+        if not es_client:
+            logger.warning("No se pudo conectar a Elasticsearch")
+            failed.extend(action.sequence_number for action in actions)
+        else:
+            try:
+                ensure_index_template(es_client)
+                # También los destinos de los _update: si el documento no
+                # existe se reintentan como index y no deben autocrear un
+                # índice books_{tenant} suelto en modo shared
+                index_names = set()
+                for action in actions:
+                    operation, metadata = next(iter(action.metadata.items()))
+                    if operation != "delete":
+                        index_names.add(metadata["_index"])
+                for index_name in index_names:
+                    ensure_index(es_client, index_name)
+                failed.extend(send_bulk(es_client, actions))
+            except Exception as e:
+                logger.error(f"Error preparando índices: {str(e)}")
+                failed.extend(action.sequence_number for action in actions)
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Batch procesado: {len(actions)} escrituras en un _bulk, "
+        f"{len(failed)} fallidas, {len(actions) / elapsed if elapsed else 0:.0f} docs/s"
+    )
+    # Contadores en JSON para CloudWatch Logs Insights
+    logger.info(
+        json.dumps(
             {
-                "message": f'Procesados {len(event["Records"])} registros',
-                "timestamp": datetime.utcnow().isoformat(),
+                "metric": "books_stream_writes",
+                "full": counters["full"],
+                "partial": counters["partial"],
+                "skipped": counters["skipped"],
+                "delete": counters["delete"],
+                "coalesced": counters["coalesced"],
+                "failed": len(failed),
             }
-        ),
+        )
+    )
+
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": sequence_number} for sequence_number in failed
+        ]
     }
@@ -0,0 +1,431 @@
+"""
+Compactación de las exportaciones de compras: muchos objetos pequeños por
+partición (un JSON por compra del exportador antiguo, un .ndjson.gz por batch
+del actual) se fusionan en unos pocos compacted-{run}-{n}.ndjson.gz grandes.
+
+Por partición (tenant, día), con memoria acotada:
+  1. Se guarda un manifest (estado "writing") con los objetos de origen.
+  2. Se leen los orígenes línea a línea y se escriben comprimidos con un
+     upload multipart por fichero de salida (se pasa al siguiente al llegar
+     a target_bytes sin comprimir).
+  3. Se verifica cada salida (tamaño y número de filas releyéndola) y se
+     marca el manifest como "verified".
+  4. Sólo entonces se borran los orígenes y el manifest pasa a "done".
+
+Es reanudable por partición: un manifest "writing" (ejecución interrumpida a
+medias) descarta sus salidas parciales y se repite; uno "verified" termina de
+borrar los orígenes. Los manifests viven en compaction/manifests/, fuera del
+layout que leen purchases_parquet y Athena.
+
+Mientras una partición está entre 2 y 4 hay filas duplicadas (origen y
+salida); purchases_parquet se queda con una versión por purchase_id.
+
+Almacenes: S3Store (S3 o un S3 local con AWS_ENDPOINT_URL_S3) y LocalStore
+(un directorio con el mismo layout de claves), para pruebas locales.
+"""
+
+import gzip
+import json
+import os
+import logging
+import zlib
+from datetime import datetime, timedelta
+
+from bookstore_common import aws
+
+# Configurar logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+ANALYTICS_BUCKET = os.environ.get("ANALYTICS_BUCKET", "bookstore-analytics-dev")
+MANIFEST_PREFIX = "compaction/manifests"
+COMPACTED_PREFIX = "compacted-"
+# Un día sigue recibiendo batches hasta pasadas unas horas (y MODIFY después)
+MIN_AGE_DAYS = int(os.environ.get("COMPACTION_MIN_AGE_DAYS", "2"))
+LOOKBACK_DAYS = int(os.environ.get("COMPACTION_LOOKBACK_DAYS", "7"))
+DEFAULT_TARGET_BYTES = 256 * 2 ** 20
+DEFAULT_MIN_OBJECTS = 2
+PART_SIZE = 8 * 2 ** 20  # mínimo de S3 para partes no finales: 5 MiB
+DELETE_BATCH_SIZE = 1000
+
+# Prefijos de primer nivel del bucket que no son tenants
+NON_TENANT_PREFIXES = {"parquet/", "athena-results/", "compaction/"}
+
+
+class S3Store:
+    """Objetos del bucket de analytics"""
+
+    def __init__(self, bucket, client=None):
+        self.bucket = bucket
+        self.client = client or aws.get_client("s3")
+
+    def list(self, prefix, delimiter=None):
+        """[(clave, tamaño)] o, con delimiter, los prefijos comunes"""
+        params = {"Bucket": self.bucket, "Prefix": prefix}
+        if delimiter:
+            params["Delimiter"] = delimiter
+        results = []
+        for page in self.client.get_paginator("list_objects_v2").paginate(**params):
+            if delimiter:
+                results.extend(entry["Prefix"] for entry in page.get("CommonPrefixes", []))
+            else:
+                results.extend((entry["Key"], entry["Size"]) for entry in page.get("Contents", []))
+        return results
+
+    def open(self, key):
+        """Stream de lectura (no carga el objeto entero)"""
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+
+    def read_json(self, key):
+        try:
+            return json.loads(self.open(key).read())
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def write_json(self, key, value):
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=json.dumps(value), ContentType="application/json"
+        )
+
+    def writer(self, key):
+        return S3MultipartWriter(self.client, self.bucket, key)
+
+    def delete(self, keys):
+        for offset in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[offset:offset + DELETE_BATCH_SIZE]
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+
+
+class S3MultipartWriter:
+    """Escritura en partes de PART_SIZE; abort si algo falla antes de completar"""
+
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= PART_SIZE:
+            self._upload_part()
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType="application/x-ndjson"
+            )["UploadId"]
+        number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({"PartNumber": number, "ETag": response["ETag"]})
+        self.buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            if self.upload_id:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+                )
+            return False
+        if self.upload_id is None:
+            # Salida pequeña: un único put_object
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=bytes(self.buffer),
+                ContentType="application/x-ndjson",
+            )
+            return False
+        if self.buffer:
+            self._upload_part()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+        return False
+
+
+class LocalStore:
+    """El mismo layout de claves sobre un directorio local"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def list(self, prefix, delimiter=None):
+        directory, _, name_prefix = prefix.rpartition("/")
+        base = self._path(directory) if directory else self.root
+        if not os.path.isdir(base):
+            return []
+        if delimiter:
+            return sorted(
+                f"{directory + '/' if directory else ''}{name}/"
+                for name in os.listdir(base)
+                if name.startswith(name_prefix) and os.path.isdir(os.path.join(base, name))
+            )
+        results = []
+        for current, _, files in os.walk(base):
+            for name in files:
+                path = os.path.join(current, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if key.startswith(prefix) and not name.endswith(".tmp"):
+                    results.append((key, os.path.getsize(path)))
+        return sorted(results)
+
+    def open(self, key):
+        return open(self._path(key), "rb")
+
+    def size(self, key):
+        return os.path.getsize(self._path(key))
+
+    def read_json(self, key):
+        if not os.path.exists(self._path(key)):
+            return None
+        with self.open(key) as f:
+            return json.load(f)
+
+    def write_json(self, key, value):
+        with self.writer(key) as f:
+            f.write(json.dumps(value).encode())
+
+    def writer(self, key):
+        return LocalWriter(self._path(key))
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+
+class LocalWriter:
+    """Escribe en un .tmp y lo renombra al cerrar: nunca queda un fichero a medias"""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.tmp_path, "wb")
+        return self
+
+    def write(self, data):
+        self.file.write(data)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is not None:
+            os.remove(self.tmp_path)
+        else:
+            os.replace(self.tmp_path, self.path)
+        return False
+
+
+def partition_prefix(tenant_id, date):
+    return f"{tenant_id}/purchases/year={date:%Y}/month={date:%m}/day={date:%d}/"
+
+
+def manifest_key(tenant_id, date):
+    return f"{MANIFEST_PREFIX}/{tenant_id}/{date:%Y-%m-%d}.json"
+
+
+def source_lines(store, key):
+    """Filas (bytes, una por línea) de un objeto de origen, leídas en streaming"""
+    if key.endswith(".json"):
+        # Exportador antiguo: un documento JSON (pequeño) por objeto
+        with store.open(key) as body:
+            yield json.dumps(json.loads(body.read()), separators=(",", ":")).encode() + b"\n"
+        return
+    with store.open(key) as body:
+        stream = gzip.GzipFile(fileobj=body) if key.endswith(".gz") else body
+        for line in stream:
+            if line.strip():
+                yield line if line.endswith(b"\n") else line + b"\n"
+
+
+def count_rows(store, key):
+    with store.open(key) as body:
+        return sum(1 for line in gzip.GzipFile(fileobj=body) if line.strip())
+
+
+def write_outputs(store, prefix, run_id, sources, target_bytes):
+    """Fusionar los orígenes en ficheros comprimidos de ~target_bytes sin comprimir"""
+    outputs = []
+    source_rows = {}
+    sources = iter(sources)
+    pending = None  # (clave, iterador de líneas) del origen a medio leer
+
+    while True:
+        key = f"{prefix}{COMPACTED_PREFIX}{run_id}-{len(outputs):05d}.ndjson.gz"
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+        rows = raw_bytes = compressed_bytes = 0
+        exhausted = False
+
+        with store.writer(key) as writer:
+            while raw_bytes < target_bytes:
+                if pending is None:
+                    source = next(sources, None)
+                    if source is None:
+                        exhausted = True
+                        break
+                    pending = (source["key"], source_lines(store, source["key"]))
+                    source_rows[source["key"]] = 0
+
+                source_key, lines = pending
+                line = next(lines, None)
+                if line is None:
+                    pending = None
+                    continue
+                source_rows[source_key] += 1
+                rows += 1
+                raw_bytes += len(line)
+                chunk = compressor.compress(line)
+                if chunk:
+                    compressed_bytes += len(chunk)
+                    writer.write(chunk)
+
+            chunk = compressor.flush()
+            compressed_bytes += len(chunk)
+            writer.write(chunk)
+
+        if rows:
+            outputs.append({"key": key, "rows": rows, "size": compressed_bytes})
+        else:
+            store.delete([key])
+        if exhausted:
+            return outputs, source_rows
+
+
+def verify_outputs(store, outputs, expected_rows):
+    """Cada salida existe con su tamaño y filas, y el total cuadra con los orígenes"""
+    for output in outputs:
+        if store.size(output["key"]) != output["size"]:
+            raise ValueError(f"Tamaño inesperado en {output['key']}")
+        if count_rows(store, output["key"]) != output["rows"]:
+            raise ValueError(f"Número de filas inesperado en {output['key']}")
+    if sum(output["rows"] for output in outputs) != expected_rows:
+        raise ValueError("Las salidas no contienen todas las filas de los orígenes")
+
+
+def finish(store, key, manifest):
+    """Borrar los orígenes de un manifest verificado y marcarlo como terminado"""
+    store.delete([source["key"] for source in manifest["sources"]])
+    manifest["state"] = "done"
+    manifest["finished_at"] = datetime.utcnow().isoformat()
+    store.write_json(key, manifest)
+
+
+def compact_partition(store, tenant_id, date, target_bytes=DEFAULT_TARGET_BYTES,
+                      min_objects=DEFAULT_MIN_OBJECTS, dry_run=False):
+    """Compactar una partición; devuelve un resumen de lo hecho"""
+    prefix = partition_prefix(tenant_id, date)
+    key = manifest_key(tenant_id, date)
+    manifest = store.read_json(key)
+
+    if manifest and manifest["state"] == "verified":
+        finish(store, key, manifest)
+        return {"status": "resumed", "sources": len(manifest["sources"]), "outputs": len(manifest["outputs"])}
+    if manifest and manifest["state"] == "writing":
+        # Ejecución interrumpida: sus salidas pueden estar incompletas
+        partial = [k for k, _ in store.list(f"{prefix}{COMPACTED_PREFIX}{manifest['run_id']}-")]
+        store.delete(partial)
+        logger.warning(f"Descartadas {len(partial)} salidas parciales de {prefix}")
+
+    sources = [
+        {"key": source_key, "size": size}
+        for source_key, size in store.list(prefix)
+        if not source_key[len(prefix):].startswith(COMPACTED_PREFIX)
+    ]
+    if len(sources) < min_objects:
+        return {"status": "skipped", "sources": len(sources)}
+    if dry_run:
+        return {"status": "dry-run", "sources": len(sources), "bytes": sum(s["size"] for s in sources)}
+
+    run_id = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    manifest = {
+        "tenant_id": tenant_id,
+        "date": f"{date:%Y-%m-%d}",
+        "run_id": run_id,
+        "state": "writing",
+        "started_at": datetime.utcnow().isoformat(),
+        "sources": sources,
+        "outputs": [],
+    }
+    store.write_json(key, manifest)
+
+    outputs, source_rows = write_outputs(store, prefix, run_id, sources, target_bytes)
+    verify_outputs(store, outputs, sum(source_rows.values()))
+    for source in sources:
+        source["rows"] = source_rows.get(source["key"], 0)
+    manifest["outputs"] = outputs
+    manifest["state"] = "verified"
+    store.write_json(key, manifest)
+
+    finish(store, key, manifest)
+    return {"status": "compacted", "sources": len(sources), "outputs": len(outputs)}
+
+
+def list_tenants(store):
+    return [
+        prefix[:-1]
+        for prefix in store.list("", delimiter="/")
+        if prefix not in NON_TENANT_PREFIXES
+    ]
+
+
+def handler(event, context):
+    """
+    Handler programado: compacta los días entre COMPACTION_MIN_AGE_DAYS y
+    COMPACTION_MIN_AGE_DAYS + COMPACTION_LOOKBACK_DAYS de todos los tenants.
+    Evento opcional {"date": "YYYY-MM-DD"} para una fecha concreta
+    """
+    event = event or {}
+    store = S3Store(ANALYTICS_BUCKET)
+    if event.get("date"):
+        dates = [datetime.strptime(event["date"], "%Y-%m-%d")]
+    else:
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        dates = [today - timedelta(days=MIN_AGE_DAYS + offset) for offset in range(LOOKBACK_DAYS)]
+
+    results = {}
+    errors = 0
+    for tenant_id in list_tenants(store):
+        for date in dates:
+            try:
+                result = compact_partition(store, tenant_id, date)
+            except Exception as e:
+                errors += 1
+                logger.error(f"Error compactando {tenant_id} {date:%Y-%m-%d}: {str(e)}")
+                continue
+            results[result["status"]] = results.get(result["status"], 0) + 1
+            if result["status"] != "skipped":
+                logger.info(f"{tenant_id} {date:%Y-%m-%d}: {result}")
+
+    return {
+        "statusCode": 200 if not errors else 500,
+        "body": json.dumps({"partitions": results, "errors": errors}),
+    }
+
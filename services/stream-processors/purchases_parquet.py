@@ -0,0 +1,219 @@
+"""
+Conversión de las compras exportadas (NDJSON) a Parquet para Athena
+
+El stream processor escribe {tenant}/purchases/year=/month=/day=/*.ndjson.gz
+(una fila por INSERT/MODIFY). Esta etapa programada lee cada partición
+(tenant, día), se queda con la última versión de cada compra y escribe un
+único Parquet en
+
+    parquet/purchases/tenant_id={tenant}/year={YYYY}/month={MM}/day={DD}/part-00000.parquet
+
+con columnas planas y items como list<struct>. La tabla de Glue usa
+partition projection sobre ese layout, así que no hace falta MSCK REPAIR y
+una consulta de ingresos por día sólo lee las columnas total_amount y
+created_at de las particiones filtradas.
+
+Cada ejecución reescribe los últimos PARQUET_LOOKBACK_DAYS días, porque los
+MODIFY (cambios de status) llegan a la partición del día de creación de la
+compra. El resultado es determinista: relanzar un día lo sobrescribe igual.
+
+Evento (opcional): {"date": "YYYY-MM-DD"} o {"days": N}
+"""
+
+import gzip
+import io
+import json
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from bookstore_common import aws
+
+# Configurar logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3_client = aws.get_client("s3")
+ANALYTICS_BUCKET = os.environ.get("ANALYTICS_BUCKET", "bookstore-analytics-dev")
+PARQUET_PREFIX = "parquet/purchases"
+LOOKBACK_DAYS = int(os.environ.get("PARQUET_LOOKBACK_DAYS", "7"))
+
+# Prefijos de primer nivel del bucket que no son tenants
+NON_TENANT_PREFIXES = {"parquet/", "athena-results/", "compaction/"}
+
+ITEM_TYPE = pa.struct(
+    [
+        ("book_id", pa.string()),
+        ("quantity", pa.int32()),
+        ("unit_price", pa.float64()),
+        ("subtotal", pa.float64()),
+        ("title", pa.string()),
+        ("author", pa.string()),
+        ("category", pa.string()),
+    ]
+)
+
+# tenant_id/year/month/day son columnas de partición: van en la ruta, no en el fichero
+SCHEMA = pa.schema(
+    [
+        ("purchase_id", pa.string()),
+        ("user_id", pa.string()),
+        ("total_amount", pa.float64()),
+        ("status", pa.string()),
+        ("payment_method", pa.string()),
+        ("created_at", pa.timestamp("ms")),
+        ("updated_at", pa.string()),
+        ("items_count", pa.int32()),
+        ("items", pa.list_(ITEM_TYPE)),
+    ]
+)
+
+
+def partition_prefix(tenant_id, date):
+    return f"{tenant_id}/purchases/year={date:%Y}/month={date:%m}/day={date:%d}/"
+
+
+def parquet_key(tenant_id, date):
+    return (
+        f"{PARQUET_PREFIX}/tenant_id={tenant_id}/year={date:%Y}/month={date:%m}/day={date:%d}/"
+        "part-00000.parquet"
+    )
+
+
+def list_keys(prefix, delimiter=None):
+    """Claves (o prefijos comunes si hay delimiter) bajo prefix, paginando"""
+    params = {"Bucket": ANALYTICS_BUCKET, "Prefix": prefix}
+    if delimiter:
+        params["Delimiter"] = delimiter
+    for page in s3_client.get_paginator("list_objects_v2").paginate(**params):
+        if delimiter:
+            yield from (entry["Prefix"] for entry in page.get("CommonPrefixes", []))
+        else:
+            yield from (entry["Key"] for entry in page.get("Contents", []))
+
+
+def list_tenants():
+    return [
+        prefix[:-1]
+        for prefix in list_keys("", delimiter="/")
+        if prefix not in NON_TENANT_PREFIXES
+    ]
+
+
+def read_rows(key):
+    """Filas de un objeto exportado: NDJSON (con o sin gzip) o un JSON por compra"""
+    body = s3_client.get_object(Bucket=ANALYTICS_BUCKET, Key=key)["Body"].read()
+    if key.endswith(".gz"):
+        body = gzip.decompress(body)
+    text = body.decode()
+    if key.endswith(".json"):
+        return [json.loads(text)]
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def latest_versions(rows):
+    """Última versión de cada compra (mayor updated_at; a igualdad, la última leída)"""
+    latest = {}
+    for row in rows:
+        current = latest.get(row["purchase_id"])
+        if current is None or row.get("updated_at", "") >= current.get("updated_at", ""):
+            latest[row["purchase_id"]] = row
+    return sorted(latest.values(), key=lambda row: (row.get("created_at", ""), row["purchase_id"]))
+
+
+def parse_timestamp(value):
+    """ISO 8601 a datetime UTC sin zona (los created_at del checkout ya son UTC)"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def to_table(rows):
+    items = [
+        [
+            {
+                "book_id": item.get("book_id", ""),
+                "quantity": int(item.get("quantity", 0)),
+                "unit_price": float(item.get("unit_price", 0)),
+                "subtotal": float(item.get("subtotal", 0)),
+                "title": item.get("title", ""),
+                "author": item.get("author", ""),
+                "category": item.get("category", ""),
+            }
+            for item in row.get("items", [])
+        ]
+        for row in rows
+    ]
+    columns = {
+        "purchase_id": [row["purchase_id"] for row in rows],
+        "user_id": [row.get("user_id", "") for row in rows],
+        "total_amount": [float(row.get("total_amount", 0)) for row in rows],
+        "status": [row.get("status", "") for row in rows],
+        "payment_method": [row.get("payment_method", "") for row in rows],
+        "created_at": [parse_timestamp(row.get("created_at")) for row in rows],
+        "updated_at": [row.get("updated_at", "") for row in rows],
+        "items_count": [len(row_items) for row_items in items],
+        "items": items,
+    }
+    return pa.Table.from_pydict(columns, schema=SCHEMA)
+
+
+def convert_partition(tenant_id, date):
+    """Reescribir el Parquet de (tenant, día); devuelve el número de compras"""
+    rows = []
+    for key in list_keys(partition_prefix(tenant_id, date)):
+        rows.extend(read_rows(key))
+    if not rows:
+        return 0
+
+    table = to_table(latest_versions(rows))
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="snappy")
+    s3_client.put_object(
+        Bucket=ANALYTICS_BUCKET,
+        Key=parquet_key(tenant_id, date),
+        Body=buffer.getvalue(),
+        ContentType="application/vnd.apache.parquet",
+    )
+    return table.num_rows
+
+
+def dates_for(event):
+    if event.get("date"):
+        return [datetime.strptime(event["date"], "%Y-%m-%d")]
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    days = int(event.get("days", LOOKBACK_DAYS))
+    return [today - timedelta(days=offset) for offset in range(days)]
+
+
+def handler(event, context):
+    """Handler programado: convierte a Parquet los días recientes de todos los tenants"""
+    event = event or {}
+    dates = dates_for(event)
+    tenants = list_tenants()
+    logger.info(f"Convirtiendo a Parquet {len(dates)} días de {len(tenants)} tenants")
+
+    converted = 0
+    errors = 0
+    for tenant_id in tenants:
+        for date in dates:
+            try:
+                rows = convert_partition(tenant_id, date)
+            except Exception as e:
+                errors += 1
+                logger.error(f"Error convirtiendo {tenant_id} {date:%Y-%m-%d}: {str(e)}")
+                continue
+            if rows:
+                converted += 1
+                logger.info(f"Parquet escrito: {parquet_key(tenant_id, date)} ({rows} compras)")
+
+    return {
+        "statusCode": 200 if not errors else 500,
+        "body": json.dumps({"partitions": converted, "errors": errors}),
+    }
@@ -1,17 +1,29 @@
+import gzip
 import json
 import os
-import boto3
 import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer
+from bookstore_common import aws, purchase_analytics
+from bookstore_common.sketches import HyperLogLog
 
 # Configurar logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Configuración S3
-s3_client = boto3.client("s3")
+# Configuración S3 (cliente compartido con pool de conexiones y reintentos)
+s3_client = aws.get_client("s3")
 ANALYTICS_BUCKET = os.environ.get("ANALYTICS_BUCKET", "bookstore-analytics-dev")
+PURCHASES_TABLE = os.environ.get("PURCHASES_TABLE", "bookstore-purchases-dev")
+# Updates de celdas del cubo en paralelo (el cliente compartido admite 50 conexiones)
+ROLLUP_WRITE_WORKERS = int(os.environ.get("ROLLUP_WRITE_WORKERS", "16"))
+# Reintentos del put condicionado de un sketch si otro shard lo escribió antes
+SKETCH_WRITE_ATTEMPTS = 5
+
+deserializer = TypeDeserializer()
 
 
 def decimal_to_float(obj):
@@ -25,185 +37,338 @@ def decimal_to_float(obj):
     return obj
 
 
-def process_purchase_insert(record):
-    """Procesar nueva compra para analytics"""
-    try:
-        purchase_data = record["dynamodb"]["NewImage"]
-
-        # Extraer datos de la compra
-        purchase_doc = {
-            "purchase_id": purchase_data.get("purchase_id", {}).get("S", ""),
-            "tenant_id": purchase_data.get("tenant_id", {}).get("S", ""),
-            "user_id": purchase_data.get("user_id", {}).get("S", ""),
-            "total_amount": float(purchase_data.get("total_amount", {}).get("N", "0")),
-            "status": purchase_data.get("status", {}).get("S", ""),
-            "payment_method": purchase_data.get("payment_method", {}).get("S", ""),
-            "created_at": purchase_data.get("created_at", {}).get("S", ""),
-            "updated_at": purchase_data.get("updated_at", {}).get("S", ""),
-            "items": [],
-        }
+def build_purchase_doc(purchase_data):
+    """Fila de analytics a partir de una imagen del stream"""
+    purchase_doc = {
+        # Las órdenes del checkout usan order_id/total; se mantienen los
+        # nombres de columna de la tabla de Glue
+        "purchase_id": purchase_data.get("purchase_id", purchase_data.get("order_id", {})).get("S", ""),
+        "tenant_id": purchase_data.get("tenant_id", {}).get("S", ""),
+        "user_id": purchase_data.get("user_id", {}).get("S", ""),
+        "total_amount": float(
+            purchase_data.get("total_amount", purchase_data.get("total", {})).get("N", "0")
+        ),
+        "status": purchase_data.get("status", {}).get("S", ""),
+        "payment_method": purchase_data.get("payment_method", {}).get("S", ""),
+        "created_at": purchase_data.get("created_at", {}).get("S", ""),
+        "updated_at": purchase_data.get("updated_at", {}).get("S", ""),
+        "items": [],
+    }
 
-        # Procesar items si existen
-        if "items" in purchase_data:
-            items_list = purchase_data["items"].get("L", [])
-            for item in items_list:
-                item_data = item.get("M", {})
-                purchase_doc["items"].append(
-                    {
-                        "book_id": item_data.get("book_id", {}).get("S", ""),
-                        "quantity": int(item_data.get("quantity", {}).get("N", "0")),
-                        "unit_price": float(
-                            item_data.get("unit_price", {}).get("N", "0")
-                        ),
-                        "subtotal": float(item_data.get("subtotal", {}).get("N", "0")),
-                        "title": item_data.get("title", {}).get("S", ""),
-                        "author": item_data.get("author", {}).get("S", ""),
-                    }
-                )
+    # Procesar items si existen
+    if "items" in purchase_data:
+        items_list = purchase_data["items"].get("L", [])
+        for item in items_list:
+            item_data = item.get("M", {})
+            purchase_doc["items"].append(
+                {
+                    "book_id": item_data.get("book_id", {}).get("S", ""),
+                    "quantity": int(item_data.get("quantity", {}).get("N", "0")),
+                    # El checkout guarda el precio de la línea como price
+                    "unit_price": float(
+                        (item_data.get("unit_price") or item_data.get("price") or {}).get("N", "0")
+                    ),
+                    "subtotal": float(item_data.get("subtotal", {}).get("N", "0")),
+                    "title": item_data.get("title", {}).get("S", ""),
+                    "author": item_data.get("author", {}).get("S", ""),
+                    "category": item_data.get("category", {}).get("S", ""),
+                }
+            )
+    return purchase_doc
+
+
+def partition_of(purchase_doc):
+    """(tenant_id, year, month, day) de la compra según created_at"""
+    created_at = datetime.fromisoformat(purchase_doc["created_at"].replace("Z", "+00:00"))
+    return (
+        purchase_doc["tenant_id"],
+        created_at.strftime("%Y"),
+        created_at.strftime("%m"),
+        created_at.strftime("%d"),
+    )
+
+
+def export_key(partition, sequence_numbers):
+    """
+    Clave del objeto de un grupo: determinista a partir de los sequence
+    numbers del batch, así que un reintento del mismo batch sobrescribe el
+    mismo objeto en lugar de duplicar filas
+    """
+    tenant_id, year, month, day = partition
+    return (
+        f"{tenant_id}/purchases/year={year}/month={month}/day={day}/"
+        f"{min(sequence_numbers, key=int)}-{max(sequence_numbers, key=int)}.ndjson.gz"
+    )
+
+
+def export_purchases(rows):
+    """
+    Escribir las filas del batch agrupadas por (tenant, día): un objeto NDJSON
+    comprimido con gzip por grupo. rows = [(sequence_number, partición, purchase_doc)].
+    Devuelve las particiones que no se pudieron escribir
+    """
+    groups = defaultdict(list)
+    for sequence_number, partition, purchase_doc in rows:
+        groups[partition].append((sequence_number, purchase_doc))
+
+    failed = []
+    for partition, group in groups.items():
+        s3_key = export_key(partition, [sequence_number for sequence_number, _ in group])
+        body = "".join(json.dumps(doc, default=str) + "\n" for _, doc in group)
+        try:
+            s3_client.put_object(
+                Bucket=ANALYTICS_BUCKET,
+                Key=s3_key,
+                # mtime=0: el mismo batch produce exactamente los mismos bytes
+                Body=gzip.compress(body.encode(), mtime=0),
+                ContentType="application/x-ndjson",
+            )
+            logger.info(f"Exportadas {len(group)} compras a S3: {s3_key}")
+        except Exception as e:
+            logger.error(f"Error exportando {len(group)} compras a {s3_key}: {str(e)}")
+            failed.append(partition)
+    return failed
+
+
+def write_daily_summaries(daily):
+    """
+    Un ADD atómico por (tenant, día) con lo acumulado en el batch.
+    Devuelve los (tenant, día) que no se pudieron actualizar
+    """
+    table = aws.get_table(PURCHASES_TABLE)
+    failed = []
+    for (tenant_id, date), counters in daily.items():
+        try:
+            table.update_item(
+                **purchase_analytics.daily_summary_update(tenant_id, date, dict(counters))
+            )
+        except Exception as e:
+            logger.error(f"Error actualizando resumen diario {tenant_id}/{date}: {str(e)}")
+            failed.append((tenant_id, date))
+    return failed
+
+
+def write_rollups(rollups):
+    """
+    Un ADD por celda del cubo con los parciales del batch. Las celdas son
+    independientes, así que se escriben en paralelo con el cliente de la
+    tabla (los clientes de boto3 son thread-safe; los recursos no).
+    Devuelve las (tenant, celda) que no se pudieron actualizar
+    """
+    client = aws.get_table(PURCHASES_TABLE).meta.client
+
+    def write(entry):
+        (tenant_id, cell), counters = entry
+        try:
+            client.update_item(
+                TableName=PURCHASES_TABLE,
+                **purchase_analytics.rollup_update(tenant_id, cell, dict(counters)),
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error actualizando rollup {tenant_id} {cell}: {str(e)}")
+            return False
+
+    if not rollups:
+        return []
+    with ThreadPoolExecutor(max_workers=min(ROLLUP_WRITE_WORKERS, len(rollups))) as executor:
+        written = list(executor.map(write, rollups.items()))
+    logger.info(f"Rollups actualizados: {sum(written)}/{len(rollups)} celdas")
+    return [key for key, ok in zip(rollups, written) if not ok]
+
+
+def write_sketch(table, tenant_id, grain, period, buyers, units):
+    """
+    Fusionar los sketches de un batch con los guardados (leer, fusionar y put
+    condicionado a la versión leída; se reintenta si otro batch ganó)
+    """
+    for _ in range(SKETCH_WRITE_ATTEMPTS):
+        key = purchase_analytics.sketch_key(tenant_id, grain, period)
+        item = table.get_item(Key=key, ConsistentRead=True).get("Item")
+        stored_buyers, top_books = purchase_analytics.read_sketches(item)
+        stored_buyers.merge(buyers)
+        for book_id, quantity in units.most_common():
+            top_books.add(book_id, quantity)
+
+        version = int(item["version"]) if item else 0
+        if item:
+            condition = {
+                "ConditionExpression": "version = :version",
+                "ExpressionAttributeValues": {":version": version},
+            }
+        else:
+            condition = {"ConditionExpression": "attribute_not_exists(pk)"}
+        try:
+            table.put_item(
+                Item=purchase_analytics.sketch_item(
+                    tenant_id, grain, period, stored_buyers, top_books, version + 1
+                ),
+                **condition,
+            )
+            return
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            continue
+    raise RuntimeError(f"Conflicto persistente escribiendo el sketch {tenant_id} {grain} {period}")
 
-        # Crear estructura de particiones por fecha
-        created_at = datetime.fromisoformat(
-            purchase_doc["created_at"].replace("Z", "+00:00")
-        )
-        year = created_at.strftime("%Y")
-        month = created_at.strftime("%m")
-        day = created_at.strftime("%d")
-
-        # Construir clave S3
-        s3_key = f"{purchase_doc['tenant_id']}/purchases/year={year}/month={month}/day={day}/{purchase_doc['purchase_id']}.json"
-
-        # Subir a S3
-        s3_client.put_object(
-            Bucket=ANALYTICS_BUCKET,
-            Key=s3_key,
-            Body=json.dumps(purchase_doc, default=str),
-            ContentType="application/json",
-        )
 
-        logger.info(f"Compra exportada a S3: {s3_key}")
+def write_sketches(sketches):
+    """
+    Un read-merge-write por (tenant, granularidad, periodo) tocado en el batch.
+    Devuelve las claves de los sketches que no se pudieron escribir
+    """
+    table = aws.get_table(PURCHASES_TABLE)
+    failed = []
+    for (tenant_id, grain, period), (buyers, units) in sketches.items():
+        try:
+            write_sketch(table, tenant_id, grain, period, buyers, units)
+        except Exception as e:
+            logger.error(f"Error actualizando sketches {tenant_id} {grain} {period}: {str(e)}")
+            failed.append((tenant_id, grain, period))
+    return failed
 
-        # También crear un registro agregado para analytics rápidos
-        daily_summary_key = f"{purchase_doc['tenant_id']}/daily_summary/year={year}/month={month}/day={day}/summary.json"
 
+def export_daily_summaries(images):
+    """
+    Materializar en S3 (daily_summary/.../summary.json, para Athena) el estado
+    de los resúmenes diarios que llegan por el propio stream de la tabla
+    """
+    for image in images.values():
         try:
-            # Intentar obtener resumen existente
-            response = s3_client.get_object(
-                Bucket=ANALYTICS_BUCKET, Key=daily_summary_key
+            item = {key: deserializer.deserialize(value) for key, value in image.items()}
+            summary = purchase_analytics.format_daily_summary(item)
+            year, month, day = summary["date"].split("-")
+            s3_key = (
+                f"{summary['tenant_id']}/daily_summary/year={year}/month={month}/day={day}/summary.json"
             )
-            daily_summary = json.loads(response["Body"].read())
-        except s3_client.exceptions.NoSuchKey:
-            # Crear nuevo resumen
-            daily_summary = {
-                "date": f"{year}-{month}-{day}",
-                "tenant_id": purchase_doc["tenant_id"],
-                "total_purchases": 0,
-                "total_revenue": 0.0,
-                "total_items_sold": 0,
-                "categories": {},
-                "payment_methods": {},
-            }
+            s3_client.put_object(
+                Bucket=ANALYTICS_BUCKET,
+                Key=s3_key,
+                Body=json.dumps(summary),
+                ContentType="application/json",
+            )
+            logger.info(f"Resumen diario exportado: {s3_key}")
+        except Exception as e:
+            logger.error(f"Error exportando resumen diario: {str(e)}")
 
-        # Actualizar resumen
-        daily_summary["total_purchases"] += 1
-        daily_summary["total_revenue"] += purchase_doc["total_amount"]
-        daily_summary["total_items_sold"] += sum(
-            item["quantity"] for item in purchase_doc["items"]
-        )
 
-        # Contar método de pago
-        payment_method = purchase_doc["payment_method"]
-        daily_summary["payment_methods"][payment_method] = (
-            daily_summary["payment_methods"].get(payment_method, 0) + 1
-        )
+def write_id(*parts):
+    """Identificador de una escritura del batch en el registro de reintentos"""
+    return "|".join(parts)
+
+
+def load_retry_ledger(table, sequence_number):
+    """
+    Capas [(last_sequence, ids)] que dejó la invocación anterior si este batch
+    es su reenvío, es decir, si empieza por el registro que devolvió como fallido
+    """
+    item = table.get_item(
+        Key=purchase_analytics.retry_ledger_key(sequence_number), ConsistentRead=True
+    ).get("Item")
+    if not item:
+        return []
+    return [(int(layer["last_sequence"]), set(layer["keys"])) for layer in item["layers"]]
+
+
+def already_applied(layers, sequence_number, write):
+    return any(int(sequence_number) <= last and write in ids for last, ids in layers)
 
-        # Guardar resumen actualizado
-        s3_client.put_object(
-            Bucket=ANALYTICS_BUCKET,
-            Key=daily_summary_key,
-            Body=json.dumps(daily_summary, default=str),
-            ContentType="application/json",
-        )
 
-        logger.info(f"Resumen diario actualizado: {daily_summary_key}")
-
-    except Exception as e:
-        logger.error(f"Error procesando inserción de compra: {str(e)}")
-
-
-def process_purchase_modify(record):
-    """Procesar modificación de compra"""
-    try:
-        purchase_data = record["dynamodb"]["NewImage"]
-        purchase_id = purchase_data.get("purchase_id", {}).get("S", "")
-        tenant_id = purchase_data.get("tenant_id", {}).get("S", "")
-
-        # Similar al insert, pero actualizando el archivo existente
-        purchase_doc = {
-            "purchase_id": purchase_id,
-            "tenant_id": tenant_id,
-            "user_id": purchase_data.get("user_id", {}).get("S", ""),
-            "total_amount": float(purchase_data.get("total_amount", {}).get("N", "0")),
-            "status": purchase_data.get("status", {}).get("S", ""),
-            "payment_method": purchase_data.get("payment_method", {}).get("S", ""),
-            "created_at": purchase_data.get("created_at", {}).get("S", ""),
-            "updated_at": purchase_data.get("updated_at", {}).get("S", ""),
-            "items": [],
+def save_retry_ledger(table, sequence_number, layers):
+    table.put_item(
+        Item={
+            **purchase_analytics.retry_ledger_key(sequence_number),
+            "layers": [
+                {"last_sequence": str(last), "keys": sorted(ids)} for last, ids in layers
+            ],
         }
+    )
 
-        # Procesar items si existen
-        if "items" in purchase_data:
-            items_list = purchase_data["items"].get("L", [])
-            for item in items_list:
-                item_data = item.get("M", {})
-                purchase_doc["items"].append(
-                    {
-                        "book_id": item_data.get("book_id", {}).get("S", ""),
-                        "quantity": int(item_data.get("quantity", {}).get("N", "0")),
-                        "unit_price": float(
-                            item_data.get("unit_price", {}).get("N", "0")
-                        ),
-                        "subtotal": float(item_data.get("subtotal", {}).get("N", "0")),
-                        "title": item_data.get("title", {}).get("S", ""),
-                        "author": item_data.get("author", {}).get("S", ""),
-                    }
-                )
 
-        # Crear estructura de particiones por fecha
-        created_at = datetime.fromisoformat(
-            purchase_doc["created_at"].replace("Z", "+00:00")
-        )
-        year = created_at.strftime("%Y")
-        month = created_at.strftime("%m")
-        day = created_at.strftime("%d")
-
-        # Actualizar archivo en S3
-        s3_key = f"{tenant_id}/purchases/year={year}/month={month}/day={day}/{purchase_id}.json"
-
-        s3_client.put_object(
-            Bucket=ANALYTICS_BUCKET,
-            Key=s3_key,
-            Body=json.dumps(purchase_doc, default=str),
-            ContentType="application/json",
-        )
+def update_status_counters(record):
+    """Mover la orden entre contadores de status del agregado de analytics"""
+    old_image = record["dynamodb"].get("OldImage", {})
+    new_image = record["dynamodb"].get("NewImage", {})
+    old_status = old_image.get("status", {}).get("S")
+    new_status = new_image.get("status", {}).get("S")
 
-        logger.info(f"Compra actualizada en S3: {s3_key}")
+    if not old_status or not new_status or old_status == new_status:
+        return
 
-    except Exception as e:
-        logger.error(f"Error procesando modificación de compra: {str(e)}")
+    aws.get_table(PURCHASES_TABLE).update_item(
+        **purchase_analytics.status_changed_update(
+            new_image.get("tenant_id", {}).get("S", ""),
+            new_image.get("user_id", {}).get("S", ""),
+            old_status,
+            new_status,
+        )
+    )
+    logger.info(f"Agregado de analytics actualizado: {old_status} -> {new_status}")
 
 
 def handler(event, context):
-    """Handler principal para procesar streams de compras"""
-    logger.info(f"Procesando {len(event['Records'])} registros del stream de compras")
-
-    for record in event["Records"]:
+    """
+    Handler principal para procesar streams de compras.
+    INSERT y MODIFY se exportan juntos al final del batch (export_purchases);
+    cada fila lleva event_name y updated_at, así que en Athena el estado
+    actual de una compra es la fila más reciente de su purchase_id.
+    Los resúmenes diarios se acumulan en memoria y se escriben con un ADD por
+    (tenant, día); sus propios cambios vuelven por el stream y se exportan a S3.
+    Igual con el cubo de rollups (hora/día/mes x total/pago/categoría/libro):
+    un ADD por celda tocada en el batch, sea cual sea el número de compras.
+    Los sketches (compradores únicos y top ventas por día y mes) se fusionan
+    con una escritura condicionada por (tenant, periodo).
+
+    Si falla una escritura (un objeto de S3, un resumen diario, una celda del
+    cubo, un sketch, los contadores de status de un usuario) se devuelven en
+    batchItemFailures los registros que la alimentan (functionResponseType:
+    ReportBatchItemFailures) y Lambda reenvía el batch desde el primero.
+    Antes se guarda en RETRY#{ese registro} qué escrituras ya incluyen los
+    registros reenviados; el reenvío (que trae al menos los registros
+    restantes del batch) lo lee y sólo aplica lo que falta, así que nada se
+    cuenta ni se exporta dos veces. Queda fuera una invocación que no llega a
+    terminar (timeout): Lambda repite el batch entero sin registro y lo que
+    se aplicó se vuelve a aplicar
+    """
+    records = event["Records"]
+    logger.info(f"Procesando {len(records)} registros del stream de compras")
+    if not records:
+        return {"batchItemFailures": []}
+
+    table = aws.get_table(PURCHASES_TABLE)
+    first_sequence = records[0]["dynamodb"]["SequenceNumber"]
+    last_sequence = records[-1]["dynamodb"]["SequenceNumber"]
+    layers = load_retry_ledger(table, first_sequence)
+
+    rows = []
+    modified = []
+    daily_images = {}
+    for record in records:
         event_name = record["eventName"]
 
+        # Los agregados viven en la misma tabla: sólo se exportan órdenes
+        pk = record["dynamodb"].get("Keys", {}).get("pk", {}).get("S", "")
+        if purchase_analytics.is_daily_summary_key(pk):
+            if event_name != "REMOVE":
+                # Dentro del batch basta con el último estado de cada día
+                daily_images[pk] = record["dynamodb"]["NewImage"]
+            continue
+        if (
+            purchase_analytics.is_summary_key(pk)
+            or purchase_analytics.is_rollup_key(pk)
+            or purchase_analytics.is_sketch_key(pk)
+            or purchase_analytics.is_retry_ledger_key(pk)
+        ):
+            continue
+
         try:
-            if event_name == "INSERT":
-                process_purchase_insert(record)
-            elif event_name == "MODIFY":
-                process_purchase_modify(record)
+            if event_name in ("INSERT", "MODIFY"):
+                purchase_doc = build_purchase_doc(record["dynamodb"]["NewImage"])
+                purchase_doc["event_name"] = event_name
+                rows.append(
+                    (record["dynamodb"]["SequenceNumber"], partition_of(purchase_doc), purchase_doc)
+                )
+                if event_name == "MODIFY":
+                    modified.append(record)
             elif event_name == "REMOVE":
                 # Para compras, generalmente no eliminamos, solo cambiamos el estado
                 logger.info(f"Compra eliminada (soft delete): {record}")
@@ -214,12 +379,89 @@ def handler(event, context):
             logger.error(f"Error procesando registro {event_name}: {str(e)}")
             continue
 
+    # write_id -> registros que la alimentan en esta invocación (los que un
+    # intento anterior ya aplicó a esa escritura no cuentan)
+    sources = defaultdict(list)
+
+    def include(sequence_number, write):
+        if already_applied(layers, sequence_number, write):
+            return False
+        sources[write].append(sequence_number)
+        return True
+
+    exported = []
+    daily = defaultdict(Counter)
+    rollups = defaultdict(Counter)
+    sketches = defaultdict(lambda: (HyperLogLog(), Counter()))
+    for sequence_number, partition, purchase_doc in rows:
+        if include(sequence_number, write_id("export", *partition)):
+            exported.append((sequence_number, partition, purchase_doc))
+        if purchase_doc["event_name"] != "INSERT":
+            continue
+        tenant_id, year, month, day = partition
+        date = f"{year}-{month}-{day}"
+        if include(sequence_number, write_id("daily", tenant_id, date)):
+            daily[(tenant_id, date)].update(purchase_analytics.daily_counters(purchase_doc))
+        for cell, counters in purchase_analytics.rollup_cells(purchase_doc):
+            if include(sequence_number, write_id("rollup", tenant_id, *cell)):
+                rollups[(tenant_id, cell)].update(counters)
+        for grain, length in purchase_analytics.SKETCH_GRAINS.items():
+            period = purchase_doc["created_at"][:length]
+            if include(sequence_number, write_id("sketch", tenant_id, grain, period)):
+                buyers, units = sketches[(tenant_id, grain, period)]
+                buyers.add(purchase_doc["user_id"])
+                for item in purchase_doc["items"]:
+                    units[item["book_id"]] += item["quantity"]
+
+    failed_writes = set()
+    for record in modified:
+        sequence_number = record["dynamodb"]["SequenceNumber"]
+        write = write_id("status", sequence_number)
+        if not include(sequence_number, write):
+            continue
+        try:
+            update_status_counters(record)
+        except Exception as e:
+            logger.error(f"Error actualizando contadores de status: {str(e)}")
+            failed_writes.add(write)
+
+    failed_writes.update(
+        write_id("export", *partition) for partition in export_purchases(exported)
+    )
+    failed_writes.update(write_id("daily", *key) for key in write_daily_summaries(daily))
+    failed_writes.update(
+        write_id("rollup", tenant_id, *cell) for tenant_id, cell in write_rollups(rollups)
+    )
+    failed_writes.update(write_id("sketch", *key) for key in write_sketches(sketches))
+    export_daily_summaries(daily_images)
+
+    failed = sorted(
+        {sequence_number for write in failed_writes for sequence_number in sources[write]},
+        key=int,
+    )
+    if failed:
+        # Escrituras aplicadas que incluyen registros que se van a reenviar
+        retry_from = int(failed[0])
+        applied = {
+            write
+            for write, sequence_numbers in sources.items()
+            if write not in failed_writes and max(map(int, sequence_numbers)) >= retry_from
+        }
+        save_retry_ledger(
+            table,
+            failed[0],
+            [(last, ids) for last, ids in layers if last >= retry_from]
+            + [(int(last_sequence), applied)],
+        )
+    if layers and (not failed or failed[0] != first_sequence):
+        table.delete_item(Key=purchase_analytics.retry_ledger_key(first_sequence))
+
+    logger.info(
+        f"Procesados {len(records)} registros de compras, "
+        f"{len(failed)} para reintentar"
+    )
     return {
-        "statusCode": 200,
-        "body": json.dumps(
-            {
-                "message": f'Procesados {len(event["Records"])} registros de compras',
-                "timestamp": datetime.utcnow().isoformat(),
-            }
-        ),
+        "batchItemFailures": [
+            {"itemIdentifier": sequence_number} for sequence_number in failed
+        ]
     }
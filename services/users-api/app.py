@@ -1,5 +1,6 @@
 import json
 import os
+import random
 import uuid
 import hashlib
 import time
@@ -7,1119 +8,1250 @@ from datetime import datetime, timedelta
 import boto3
 from decimal import Decimal
 import re
+from bookstore_common import aws, user_search
+from bookstore_common.pagination import (
+    InvalidCursor,
+    create_cursor_response,
+    query_all,
+    query_page,
+)
+from bookstore_common.routing import ANY, Request, Router
+from bookstore_common.tokens import issue_token, user_from_authorization
+
+
+USERS_TABLE = os.environ.get("USERS_TABLE", "bookstore-users-dev")
+FAVORITES_TABLE = os.environ.get("FAVORITES_TABLE", "bookstore-user-favorites-dev")
+WISHLIST_TABLE = os.environ.get("WISHLIST_TABLE", "bookstore-user-wishlist-dev")
+
+# Headers de respuesta básicos
+HEADERS = {
+    "Content-Type": "application/json",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+    "Access-Control-Allow-Methods": "GET,HEAD,OPTIONS,POST,PUT,DELETE",
+}
+
+# BatchGetItem: reintentos de UnprocessedKeys antes de fallar
+PROFILE_BATCH_GET_MAX_RETRIES = 5
+
+EMAIL_PATTERN = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+
+
+def validate_email(email):
+    """Validar formato de email"""
+    return EMAIL_PATTERN.match(email) is not None
+
+
+def validate_password(password):
+    """Validar password: mínimo 8 caracteres, con letras y números"""
+    if len(password) < 8:
+        return False, "Password must be at least 8 characters long"
+    if not re.search(r"[A-Za-z]", password):
+        return False, "Password must contain letters"
+    if not re.search(r"\d", password):
+        return False, "Password must contain numbers"
+    return True, "Valid password"
+
+
+def email_sentinel(tenant_id, email, user_id):
+    """Item que reserva un email dentro del tenant (unicidad exacta)"""
+    return {
+        "pk": f"EMAIL#{tenant_id}#{email}",
+        "sk": "EMAIL",
+        "user_id": user_id,
+        "tenant_id": tenant_id,
+        "entity_type": "USER_EMAIL",
+    }
 
 
-def lambda_handler(event, context):
+def get_profiles(users_table, tenant_id, user_ids):
     """
-    Handler mejorado para AWS Lambda que maneja requests HTTP para usuarios
-    Incluye funcionalidades completas para un sistema robusto
+    Perfiles de `user_ids` con BatchGetItem (hasta 100), en el mismo orden.
+    Las UnprocessedKeys se reintentan con backoff exponencial y jitter; si
+    siguen sin procesarse tras PROFILE_BATCH_GET_MAX_RETRIES se lanza RuntimeError
     """
+    if not user_ids:
+        return []
+
+    request_items = {
+        users_table.name: {
+            "Keys": [
+                {"pk": f"USER#{tenant_id}#{user_id}", "sk": "PROFILE"}
+                for user_id in user_ids
+            ]
+        }
+    }
+    profiles = {}
+    retries = 0
+    while request_items:
+        response = users_table.meta.client.batch_get_item(RequestItems=request_items)
+        for item in response["Responses"].get(users_table.name, []):
+            profiles[item["user_id"]] = item
+        request_items = response.get("UnprocessedKeys")
+        if request_items:
+            retries += 1
+            if retries > PROFILE_BATCH_GET_MAX_RETRIES:
+                raise RuntimeError("BatchGetItem: unprocessed keys after retries")
+            # Full jitter: esperar un tiempo aleatorio hasta el tope exponencial
+            time.sleep(random.uniform(0, min(0.05 * (2**retries), 1.0)))
+
+    return [profiles[user_id] for user_id in user_ids if user_id in profiles]
+
+
+def create_pagination_response(items, page, limit, total_items):
+    """Crear respuesta de paginación"""
+    total_pages = (total_items + limit - 1) // limit
+    has_next = page < total_pages
+    has_previous = page > 1
+
+    return {
+        "items": items,
+        "pagination": {
+            "current_page": page,
+            "total_pages": total_pages,
+            "total_items": total_items,
+            "items_per_page": limit,
+            "has_next": has_next,
+            "has_previous": has_previous,
+        },
+    }
 
-    # Configuración básica
-    dynamodb = boto3.resource(
-        "dynamodb", region_name=os.environ.get("DYNAMODB_REGION", "us-east-1")
-    )
-    users_table = dynamodb.Table(os.environ.get("USERS_TABLE", "bookstore-users-dev"))
-    favorites_table = dynamodb.Table(
-        os.environ.get("FAVORITES_TABLE", "bookstore-user-favorites-dev")
-    )
-    wishlist_table = dynamodb.Table(
-        os.environ.get("WISHLIST_TABLE", "bookstore-user-wishlist-dev")
-    )
 
-    # Obtener información del request
-    method = event.get("httpMethod", "GET")
-    path = event.get("path", "/")
-    body = event.get("body", "{}")
-    query_params = event.get("queryStringParameters") or {}
+def format_user(item):
+    """Usuario tal como lo devuelve el listado de administración"""
+    return {
+        "user_id": item["user_id"],
+        "username": item["username"],
+        "email": item["email"],
+        "first_name": item.get("first_name", ""),
+        "last_name": item.get("last_name", ""),
+        "role": item.get("role", "user"),
+        "is_active": item.get("is_active", True),
+        "created_at": item["created_at"],
+    }
 
-    # Parsear body si existe
-    try:
-        if body:
-            request_body = json.loads(body)
-        else:
-            request_body = {}
-    except:
-        request_body = {}
-
-    # Headers de respuesta básicos
-    headers = {
-        "Content-Type": "application/json",
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-        "Access-Control-Allow-Methods": "GET,HEAD,OPTIONS,POST,PUT,DELETE",
+
+def format_favorite(item):
+    """Item de favoritos tal como lo devuelve la API"""
+    return {
+        "book_id": item.get("book_id"),
+        "title": item.get("title", "Unknown"),
+        "author": item.get("author", "Unknown"),
+        "price": float(item.get("price", 0)),
+        "added_at": item.get("added_at"),
     }
 
-    # Función para validar email
-    def validate_email(email):
-        pattern = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
-        return re.match(pattern, email) is not None
-
-    # Función para validar password
-    def validate_password(password):
-        if len(password) < 8:
-            return False, "Password must be at least 8 characters long"
-        if not re.search(r"[A-Za-z]", password):
-            return False, "Password must contain letters"
-        if not re.search(r"\d", password):
-            return False, "Password must contain numbers"
-        return True, "Valid password"
-
-    # Función para extraer user_id del token
-    def extract_user_from_token(auth_header):
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return None
-
-        token = auth_header.replace("Bearer ", "")
-        if not token.startswith("simple_token_"):
-            return None
 
-        try:
-            token_parts = token.replace("simple_token_", "").split("_")
-            if len(token_parts) < 2:
-                return None
-            return {"user_id": token_parts[0], "tenant_id": token_parts[1]}
-        except:
-            return None
-
-    # Función para crear respuesta de paginación
-    def create_pagination_response(items, page, limit, total_items):
-        total_pages = (total_items + limit - 1) // limit
-        has_next = page < total_pages
-        has_previous = page > 1
+def format_wishlist_item(item):
+    """Item de la lista de deseos tal como lo devuelve la API"""
+    return {
+        "book_id": item.get("book_id"),
+        "title": item.get("title", "Unknown"),
+        "author": item.get("author", "Unknown"),
+        "price": float(item.get("price", 0)),
+        "priority": item.get("priority", "medium"),
+        "added_at": item.get("added_at"),
+    }
+
 
+router = Router()
+
+
+# ===========================================
+# HEALTH CHECK ENDPOINT
+# ===========================================
+@router.route(ANY, "/")
+@router.route(ANY, "/health")
+def health_check(request):
+    return {
+        "statusCode": 200,
+        "headers": HEADERS,
+        "body": json.dumps(
+            {
+                "message": "Users API v2.0.0 - Enhanced",
+                "status": "healthy",
+                "timestamp": datetime.utcnow().isoformat(),
+                "method": request.method,
+                "path": request.path,
+                "features": [
+                    "User Registration & Authentication",
+                    "Profile Management",
+                    "Favorites & Wishlist",
+                    "User Management (Admin)",
+                    "Enhanced Security",
+                ],
+            }
+        ),
+    }
+
+
+# ===========================================
+# USER REGISTRATION
+# ===========================================
+@router.route("POST", "/api/v1/register")
+def register(request):
+    users_table = aws.get_table(USERS_TABLE)
+
+    username = request.body.get("username", "").strip()
+    email = request.body.get("email", "").strip().lower()
+    password = request.body.get("password", "")
+    tenant_id = request.body.get("tenant_id", "default")
+    first_name = request.body.get("first_name", "").strip()
+    last_name = request.body.get("last_name", "").strip()
+
+    # Validaciones
+    if not username or not email or not password:
         return {
-            "items": items,
-            "pagination": {
-                "current_page": page,
-                "total_pages": total_pages,
-                "total_items": total_items,
-                "items_per_page": limit,
-                "has_next": has_next,
-                "has_previous": has_previous,
-            },
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {"error": "Missing required fields: username, email, password"}
+            ),
         }
 
-    try:
-        # ===========================================
-        # HEALTH CHECK ENDPOINT
-        # ===========================================
-        if path == "/" or path == "/health":
-            return {
-                "statusCode": 200,
-                "headers": headers,
-                "body": json.dumps(
-                    {
-                        "message": "Users API v2.0.0 - Enhanced",
-                        "status": "healthy",
-                        "timestamp": datetime.utcnow().isoformat(),
-                        "method": method,
-                        "path": path,
-                        "features": [
-                            "User Registration & Authentication",
-                            "Profile Management",
-                            "Favorites & Wishlist",
-                            "User Management (Admin)",
-                            "Enhanced Security",
-                        ],
-                    }
-                ),
+    if not validate_email(email):
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Invalid email format"}),
+        }
+
+    is_valid, password_msg = validate_password(password)
+    if not is_valid:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": password_msg}),
+        }
+
+    # Hash de la contraseña
+    password_hash = hashlib.sha256(password.encode()).hexdigest()
+
+    # Crear usuario
+    user_id = str(uuid.uuid4())
+    created_at = datetime.utcnow().isoformat()
+    user_item = {
+        "pk": f"USER#{tenant_id}#{user_id}",
+        "sk": "PROFILE",
+        "gsi1pk": f"EMAIL#{tenant_id}#{email}",
+        "gsi1sk": f"USER#{user_id}",
+        "user_id": user_id,
+        "tenant_id": tenant_id,
+        "username": username,
+        "email": email,
+        "password": password_hash,
+        "first_name": first_name,
+        "last_name": last_name,
+        "role": "user",
+        "is_active": True,
+        "email_verified": False,
+        "created_at": created_at,
+        "updated_at": created_at,
+        "entity_type": "USER",
+        **user_search.listing_keys(tenant_id, user_id, created_at),
+    }
+
+    # Perfil, centinela del email y tokens de búsqueda en una sola
+    # transacción: si el email ya está reservado no se escribe nada
+    transact_items = [
+        {
+            "Put": {
+                "TableName": users_table.name,
+                "Item": user_item,
+                "ConditionExpression": "attribute_not_exists(pk)",
+            }
+        },
+        {
+            "Put": {
+                "TableName": users_table.name,
+                "Item": email_sentinel(tenant_id, email, user_id),
+                "ConditionExpression": "attribute_not_exists(pk)",
             }
+        },
+    ]
+    transact_items.extend(
+        {"Put": {"TableName": users_table.name, "Item": token_item}}
+        for token_item in user_search.token_items(user_item)
+    )
 
-        # ===========================================
-        # USER REGISTRATION
-        # ===========================================
-        elif path == "/api/v1/register" and method == "POST":
-            username = request_body.get("username", "").strip()
-            email = request_body.get("email", "").strip().lower()
-            password = request_body.get("password", "")
-            tenant_id = request_body.get("tenant_id", "default")
-            first_name = request_body.get("first_name", "").strip()
-            last_name = request_body.get("last_name", "").strip()
-
-            # Validaciones
-            if not username or not email or not password:
+    try:
+        client = users_table.meta.client
+        try:
+            client.transact_write_items(TransactItems=transact_items)
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get("CancellationReasons", [])
+            if len(reasons) > 1 and reasons[1].get("Code") == "ConditionalCheckFailed":
                 return {
                     "statusCode": 400,
-                    "headers": headers,
+                    "headers": HEADERS,
                     "body": json.dumps(
-                        {"error": "Missing required fields: username, email, password"}
+                        {"error": "User already exists with this email"}
                     ),
                 }
-
-            if not validate_email(email):
+            if any(reason.get("Code") == "TransactionConflict" for reason in reasons):
                 return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Invalid email format"}),
+                    "statusCode": 409,
+                    "headers": HEADERS,
+                    "body": json.dumps(
+                        {"error": "Registration conflicted with a concurrent request, please retry"}
+                    ),
                 }
+            raise
 
-            is_valid, password_msg = validate_password(password)
-            if not is_valid:
-                return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps({"error": password_msg}),
+        return {
+            "statusCode": 201,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "message": "User created successfully",
+                    "user": {
+                        "user_id": user_id,
+                        "username": username,
+                        "email": email,
+                        "first_name": first_name,
+                        "last_name": last_name,
+                        "tenant_id": tenant_id,
+                        "role": "user",
+                        "created_at": user_item["created_at"],
+                    },
+                    "token": issue_token(
+                        user_id, tenant_id, "user", username=username, email=email
+                    ),
                 }
+            ),
+        }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            # Hash de la contraseña
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
 
-            # Crear usuario
-            user_id = str(uuid.uuid4())
-            user_item = {
-                "pk": f"USER#{tenant_id}#{user_id}",
-                "sk": "PROFILE",
-                "gsi1pk": f"EMAIL#{tenant_id}#{email}",
-                "gsi1sk": f"USER#{user_id}",
-                "user_id": user_id,
-                "tenant_id": tenant_id,
-                "username": username,
-                "email": email,
-                "password": password_hash,
-                "first_name": first_name,
-                "last_name": last_name,
-                "role": "user",
-                "is_active": True,
-                "email_verified": False,
-                "created_at": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat(),
-                "entity_type": "USER",
-            }
+# ===========================================
+# USER LOGIN
+# ===========================================
+@router.route("POST", "/api/v1/login")
+def login(request):
+    users_table = aws.get_table(USERS_TABLE)
 
-            try:
-                # Verificar si el usuario ya existe
-                response = users_table.query(
-                    IndexName="GSI1",
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key("gsi1pk").eq(
-                        f"EMAIL#{tenant_id}#{email}"
-                    ),
-                )
+    email = request.body.get("email", "").strip().lower()
+    password = request.body.get("password", "")
+    tenant_id = request.body.get("tenant_id", "default")
 
-                if response["Items"]:
-                    return {
-                        "statusCode": 400,
-                        "headers": headers,
-                        "body": json.dumps(
-                            {"error": "User already exists with this email"}
-                        ),
-                    }
+    if not email or not password:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Missing email or password"}),
+        }
+
+    password_hash = hashlib.sha256(password.encode()).hexdigest()
 
-                users_table.put_item(Item=user_item)
+    try:
+        response = users_table.query(
+            IndexName="GSI1",
+            KeyConditionExpression=boto3.dynamodb.conditions.Key("gsi1pk").eq(
+                f"EMAIL#{tenant_id}#{email}"
+            ),
+        )
+
+        if response["Items"]:
+            user = response["Items"][0]
+            if not user.get("is_active", True):
+                return {
+                    "statusCode": 401,
+                    "headers": HEADERS,
+                    "body": json.dumps({"error": "Account is deactivated"}),
+                }
 
+            if user["password"] == password_hash:
                 return {
-                    "statusCode": 201,
-                    "headers": headers,
+                    "statusCode": 200,
+                    "headers": HEADERS,
                     "body": json.dumps(
                         {
-                            "message": "User created successfully",
+                            "message": "Login successful",
                             "user": {
-                                "user_id": user_id,
-                                "username": username,
-                                "email": email,
-                                "first_name": first_name,
-                                "last_name": last_name,
-                                "tenant_id": tenant_id,
-                                "role": "user",
-                                "created_at": user_item["created_at"],
+                                "user_id": user["user_id"],
+                                "username": user["username"],
+                                "email": user["email"],
+                                "first_name": user.get("first_name", ""),
+                                "last_name": user.get("last_name", ""),
+                                "role": user.get("role", "user"),
+                                "tenant_id": user["tenant_id"],
                             },
-                            "token": f"simple_token_{user_id}_{tenant_id}",
+                            "token": issue_token(
+                                user["user_id"],
+                                user["tenant_id"],
+                                user.get("role", "user"),
+                                username=user["username"],
+                                email=user["email"],
+                            ),
                         }
                     ),
                 }
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
 
-        # ===========================================
-        # USER LOGIN
-        # ===========================================
-        elif path == "/api/v1/login" and method == "POST":
-            email = request_body.get("email", "").strip().lower()
-            password = request_body.get("password", "")
-            tenant_id = request_body.get("tenant_id", "default")
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Invalid credentials"}),
+        }
 
-            if not email or not password:
-                return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Missing email or password"}),
-                }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
 
-            try:
-                response = users_table.query(
-                    IndexName="GSI1",
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key("gsi1pk").eq(
-                        f"EMAIL#{tenant_id}#{email}"
-                    ),
-                )
+# ===========================================
+# GET USER PROFILE
+# ===========================================
+@router.route("GET", "/api/v1/profile")
+def get_profile(request):
+    users_table = aws.get_table(USERS_TABLE)
 
-                if response["Items"]:
-                    user = response["Items"][0]
-                    if not user.get("is_active", True):
-                        return {
-                            "statusCode": 401,
-                            "headers": headers,
-                            "body": json.dumps({"error": "Account is deactivated"}),
-                        }
+    user = user_from_authorization(request.authorization)
 
-                    if user["password"] == password_hash:
-                        return {
-                            "statusCode": 200,
-                            "headers": headers,
-                            "body": json.dumps(
-                                {
-                                    "message": "Login successful",
-                                    "user": {
-                                        "user_id": user["user_id"],
-                                        "username": user["username"],
-                                        "email": user["email"],
-                                        "first_name": user.get("first_name", ""),
-                                        "last_name": user.get("last_name", ""),
-                                        "role": user.get("role", "user"),
-                                        "tenant_id": user["tenant_id"],
-                                    },
-                                    "token": f'simple_token_{user["user_id"]}_{tenant_id}',
-                                }
-                            ),
-                        }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Invalid credentials"}),
-                }
+    try:
+        response = users_table.get_item(
+            Key={
+                "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
+                "sk": "PROFILE",
+            }
+        )
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        if "Item" not in response:
+            return {
+                "statusCode": 404,
+                "headers": HEADERS,
+                "body": json.dumps({"error": "User not found"}),
+            }
+
+        user_data = response["Item"]
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "user": {
+                        "user_id": user_data["user_id"],
+                        "username": user_data["username"],
+                        "email": user_data["email"],
+                        "first_name": user_data.get("first_name", ""),
+                        "last_name": user_data.get("last_name", ""),
+                        "role": user_data.get("role", "user"),
+                        "tenant_id": user_data["tenant_id"],
+                        "is_active": user_data.get("is_active", True),
+                        "email_verified": user_data.get(
+                            "email_verified", False
+                        ),
+                        "created_at": user_data["created_at"],
+                        "updated_at": user_data.get(
+                            "updated_at", user_data["created_at"]
+                        ),
+                    }
                 }
+            ),
+        }
 
-        # ===========================================
-        # GET USER PROFILE
-        # ===========================================
-        elif path == "/api/v1/profile" and method == "GET":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
 
-            try:
-                response = users_table.get_item(
-                    Key={
-                        "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
-                        "sk": "PROFILE",
-                    }
-                )
+# ===========================================
+# UPDATE USER PROFILE
+# ===========================================
+@router.route("PUT", "/api/v1/profile")
+def update_profile(request):
+    users_table = aws.get_table(USERS_TABLE)
 
-                if "Item" not in response:
-                    return {
-                        "statusCode": 404,
-                        "headers": headers,
-                        "body": json.dumps({"error": "User not found"}),
-                    }
+    user = user_from_authorization(request.authorization)
 
-                user_data = response["Item"]
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {
-                            "user": {
-                                "user_id": user_data["user_id"],
-                                "username": user_data["username"],
-                                "email": user_data["email"],
-                                "first_name": user_data.get("first_name", ""),
-                                "last_name": user_data.get("last_name", ""),
-                                "role": user_data.get("role", "user"),
-                                "tenant_id": user_data["tenant_id"],
-                                "is_active": user_data.get("is_active", True),
-                                "email_verified": user_data.get(
-                                    "email_verified", False
-                                ),
-                                "created_at": user_data["created_at"],
-                                "updated_at": user_data.get(
-                                    "updated_at", user_data["created_at"]
-                                ),
-                            }
-                        }
-                    ),
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+    username = request.body.get("username", "").strip()
+    first_name = request.body.get("first_name", "").strip()
+    last_name = request.body.get("last_name", "").strip()
 
-        # ===========================================
-        # UPDATE USER PROFILE
-        # ===========================================
-        elif path == "/api/v1/profile" and method == "PUT":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+    if not username:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Username is required"}),
+        }
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+    try:
+        # Actualizar perfil
+        response = users_table.update_item(
+            Key={
+                "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
+                "sk": "PROFILE",
+            },
+            UpdateExpression="SET username = :username, first_name = :first_name, last_name = :last_name, updated_at = :updated_at",
+            ExpressionAttributeValues={
+                ":username": username,
+                ":first_name": first_name,
+                ":last_name": last_name,
+                ":updated_at": datetime.utcnow().isoformat(),
+            },
+            ReturnValues="ALL_NEW",
+        )
 
-            username = request_body.get("username", "").strip()
-            first_name = request_body.get("first_name", "").strip()
-            last_name = request_body.get("last_name", "").strip()
+        user_data = response["Attributes"]
 
-            if not username:
-                return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Username is required"}),
-                }
+        # Reescribir sólo los tokens de búsqueda que cambian
+        user_search.sync_search_tokens(users_table, user_data)
 
-            try:
-                # Actualizar perfil
-                response = users_table.update_item(
-                    Key={
-                        "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
-                        "sk": "PROFILE",
-                    },
-                    UpdateExpression="SET username = :username, first_name = :first_name, last_name = :last_name, updated_at = :updated_at",
-                    ExpressionAttributeValues={
-                        ":username": username,
-                        ":first_name": first_name,
-                        ":last_name": last_name,
-                        ":updated_at": datetime.utcnow().isoformat(),
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "message": "Profile updated successfully",
+                    "user": {
+                        "user_id": user_data["user_id"],
+                        "username": user_data["username"],
+                        "email": user_data["email"],
+                        "first_name": user_data.get("first_name", ""),
+                        "last_name": user_data.get("last_name", ""),
+                        "updated_at": user_data["updated_at"],
                     },
-                    ReturnValues="ALL_NEW",
-                )
-
-                user_data = response["Attributes"]
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {
-                            "message": "Profile updated successfully",
-                            "user": {
-                                "user_id": user_data["user_id"],
-                                "username": user_data["username"],
-                                "email": user_data["email"],
-                                "first_name": user_data.get("first_name", ""),
-                                "last_name": user_data.get("last_name", ""),
-                                "updated_at": user_data["updated_at"],
-                            },
-                        }
-                    ),
                 }
+            ),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-        # ===========================================
-        # CHANGE PASSWORD
-        # ===========================================
-        elif path == "/api/v1/change-password" and method == "POST":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+# ===========================================
+# CHANGE PASSWORD
+# ===========================================
+@router.route("POST", "/api/v1/change-password")
+def change_password(request):
+    users_table = aws.get_table(USERS_TABLE)
 
-            current_password = request_body.get("current_password", "")
-            new_password = request_body.get("new_password", "")
+    user = user_from_authorization(request.authorization)
 
-            if not current_password or not new_password:
-                return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {"error": "Current password and new password are required"}
-                    ),
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-            is_valid, password_msg = validate_password(new_password)
-            if not is_valid:
-                return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps({"error": password_msg}),
-                }
+    current_password = request.body.get("current_password", "")
+    new_password = request.body.get("new_password", "")
 
-            try:
-                # Verificar contraseña actual
-                response = users_table.get_item(
-                    Key={
-                        "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
-                        "sk": "PROFILE",
-                    }
-                )
+    if not current_password or not new_password:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {"error": "Current password and new password are required"}
+            ),
+        }
 
-                if "Item" not in response:
-                    return {
-                        "statusCode": 404,
-                        "headers": headers,
-                        "body": json.dumps({"error": "User not found"}),
-                    }
+    is_valid, password_msg = validate_password(new_password)
+    if not is_valid:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": password_msg}),
+        }
 
-                user_data = response["Item"]
-                current_password_hash = hashlib.sha256(
-                    current_password.encode()
-                ).hexdigest()
+    try:
+        # Verificar contraseña actual
+        response = users_table.get_item(
+            Key={
+                "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
+                "sk": "PROFILE",
+            }
+        )
 
-                if user_data["password"] != current_password_hash:
-                    return {
-                        "statusCode": 401,
-                        "headers": headers,
-                        "body": json.dumps({"error": "Current password is incorrect"}),
-                    }
+        if "Item" not in response:
+            return {
+                "statusCode": 404,
+                "headers": HEADERS,
+                "body": json.dumps({"error": "User not found"}),
+            }
 
-                # Actualizar contraseña
-                new_password_hash = hashlib.sha256(new_password.encode()).hexdigest()
-                users_table.update_item(
-                    Key={
-                        "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
-                        "sk": "PROFILE",
-                    },
-                    UpdateExpression="SET password = :password, updated_at = :updated_at",
-                    ExpressionAttributeValues={
-                        ":password": new_password_hash,
-                        ":updated_at": datetime.utcnow().isoformat(),
-                    },
-                )
+        user_data = response["Item"]
+        current_password_hash = hashlib.sha256(
+            current_password.encode()
+        ).hexdigest()
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps({"message": "Password changed successfully"}),
-                }
+        if user_data["password"] != current_password_hash:
+            return {
+                "statusCode": 401,
+                "headers": HEADERS,
+                "body": json.dumps({"error": "Current password is incorrect"}),
+            }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+        # Actualizar contraseña
+        new_password_hash = hashlib.sha256(new_password.encode()).hexdigest()
+        users_table.update_item(
+            Key={
+                "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
+                "sk": "PROFILE",
+            },
+            UpdateExpression="SET password = :password, updated_at = :updated_at",
+            ExpressionAttributeValues={
+                ":password": new_password_hash,
+                ":updated_at": datetime.utcnow().isoformat(),
+            },
+        )
 
-        # ===========================================
-        # LIST USERS (Admin Only)
-        # ===========================================
-        elif path == "/api/v1/users" and method == "GET":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps({"message": "Password changed successfully"}),
+        }
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            # Verificar si es admin
-            try:
-                response = users_table.get_item(
-                    Key={
-                        "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
-                        "sk": "PROFILE",
-                    }
-                )
 
-                if "Item" not in response or response["Item"].get("role") != "admin":
-                    return {
-                        "statusCode": 403,
-                        "headers": headers,
-                        "body": json.dumps({"error": "Admin access required"}),
-                    }
+# ===========================================
+# LIST USERS (Admin Only)
+# ===========================================
+@router.route("GET", "/api/v1/users")
+def list_users(request):
+    users_table = aws.get_table(USERS_TABLE)
 
-                # Parámetros de paginación
-                page = int(query_params.get("page", 1))
-                limit = min(int(query_params.get("limit", 10)), 100)
-                search = query_params.get("search", "").strip()
+    user = user_from_authorization(request.authorization)
 
-                # Scan usuarios del tenant
-                scan_params = {
-                    "FilterExpression": boto3.dynamodb.conditions.Attr("tenant_id").eq(
-                        user["tenant_id"]
-                    )
-                    & boto3.dynamodb.conditions.Attr("sk").eq("PROFILE")
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-                if search:
-                    scan_params["FilterExpression"] = scan_params[
-                        "FilterExpression"
-                    ] & (
-                        boto3.dynamodb.conditions.Attr("username").contains(search)
-                        | boto3.dynamodb.conditions.Attr("email").contains(search)
-                        | boto3.dynamodb.conditions.Attr("first_name").contains(search)
-                        | boto3.dynamodb.conditions.Attr("last_name").contains(search)
-                    )
+    # Verificar si es admin (el rol viaja firmado en el token)
+    if user["role"] != "admin":
+        return {
+            "statusCode": 403,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Admin access required"}),
+        }
 
-                response = users_table.scan(**scan_params)
-                all_users = response["Items"]
+    try:
+        limit = min(int(request.query.get("limit", 10)), 100)
+        search = user_search.normalize(request.query.get("search", ""))
 
-                # Paginación manual
-                total_items = len(all_users)
-                start_idx = (page - 1) * limit
-                end_idx = start_idx + limit
-                paginated_users = all_users[start_idx:end_idx]
+        # Listado: GSI2 (USERS#{tenant}); búsqueda: tokens por prefijo en GSI1.
+        # En ambos casos sólo se leen los usuarios del tenant que se devuelven
+        if search:
+            query_params = user_search.search_query(user["tenant_id"], search)
+        else:
+            query_params = user_search.listing_query(user["tenant_id"])
+
+        def user_ids(items):
+            # Un usuario puede coincidir por varios tokens (username y nombre)
+            return list(dict.fromkeys(item["user_id"] for item in items))
+
+        # Modo compatibilidad: ?page=N lee el índice completo del tenant y lo corta
+        if "page" in request.query:
+            page = int(request.query.get("page", 1))
+            items = query_all(users_table, **query_params)
+            if search:
+                items = user_ids(items)
+            total_items = len(items)
+            start_idx = (page - 1) * limit
+            paginated_users = items[start_idx:start_idx + limit]
+            if search:
+                paginated_users = get_profiles(
+                    users_table, user["tenant_id"], paginated_users
+                )
 
-                # Formatear usuarios
-                users_list = []
-                for user_item in paginated_users:
-                    users_list.append(
-                        {
-                            "user_id": user_item["user_id"],
-                            "username": user_item["username"],
-                            "email": user_item["email"],
-                            "first_name": user_item.get("first_name", ""),
-                            "last_name": user_item.get("last_name", ""),
-                            "role": user_item.get("role", "user"),
-                            "is_active": user_item.get("is_active", True),
-                            "created_at": user_item["created_at"],
-                        }
+            return {
+                "statusCode": 200,
+                "headers": HEADERS,
+                "body": json.dumps(
+                    create_pagination_response(
+                        [format_user(item) for item in paginated_users],
+                        page,
+                        limit,
+                        total_items,
                     )
+                ),
+            }
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        create_pagination_response(users_list, page, limit, total_items)
-                    ),
-                }
+        items, next_cursor = query_page(
+            users_table,
+            limit,
+            request.query.get("cursor"),
+            scope=f'USERS#{user["tenant_id"]}#{search}',
+            **query_params,
+        )
+        if search:
+            items = get_profiles(users_table, user["tenant_id"], user_ids(items))
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                create_cursor_response(
+                    [format_user(item) for item in items], limit, next_cursor
+                )
+            ),
+        }
+
+    except InvalidCursor:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Invalid cursor"}),
+        }
 
-        # ===========================================
-        # FAVORITES MANAGEMENT
-        # ===========================================
-        elif path == "/api/v1/favorites" and method == "GET":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
 
-            try:
-                page = int(query_params.get("page", 1))
-                limit = min(int(query_params.get("limit", 10)), 100)
+# ===========================================
+# FAVORITES MANAGEMENT
+# ===========================================
+@router.route("GET", "/api/v1/favorites")
+def list_favorites(request):
+    favorites_table = aws.get_table(FAVORITES_TABLE)
+
+    user = user_from_authorization(request.authorization)
+
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
+
+    try:
+        limit = min(int(request.query.get("limit", 10)), 100)
+        pk = f'FAVORITES#{user["tenant_id"]}#{user["user_id"]}'
+        key_condition = boto3.dynamodb.conditions.Key("pk").eq(
+            pk
+        ) & boto3.dynamodb.conditions.Key("sk").begins_with("BOOK#")
+
+        # Modo compatibilidad: ?page=N lee la partición completa y la corta
+        if "page" in request.query:
+            page = int(request.query.get("page", 1))
+            favorites = [
+                format_favorite(item)
+                for item in query_all(
+                    favorites_table, KeyConditionExpression=key_condition
+                )
+            ]
+
+            # Paginación manual
+            total_items = len(favorites)
+            start_idx = (page - 1) * limit
+            end_idx = start_idx + limit
+            paginated_favorites = favorites[start_idx:end_idx]
 
-                response = favorites_table.query(
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
-                        f'FAVORITES#{user["tenant_id"]}#{user["user_id"]}'
+            return {
+                "statusCode": 200,
+                "headers": HEADERS,
+                "body": json.dumps(
+                    create_pagination_response(
+                        paginated_favorites, page, limit, total_items
                     )
+                ),
+            }
+
+        items, next_cursor = query_page(
+            favorites_table,
+            limit,
+            request.query.get("cursor"),
+            scope=pk,
+            KeyConditionExpression=key_condition,
+        )
+
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                create_cursor_response(
+                    [format_favorite(item) for item in items], limit, next_cursor
                 )
+            ),
+        }
 
-                favorites = []
-                for item in response["Items"]:
-                    if item["sk"].startswith("BOOK#"):
-                        favorites.append(
-                            {
-                                "book_id": item.get("book_id"),
-                                "title": item.get("title", "Unknown"),
-                                "author": item.get("author", "Unknown"),
-                                "price": float(item.get("price", 0)),
-                                "added_at": item.get("added_at"),
-                            }
-                        )
-
-                # Paginación manual
-                total_items = len(favorites)
-                start_idx = (page - 1) * limit
-                end_idx = start_idx + limit
-                paginated_favorites = favorites[start_idx:end_idx]
+    except InvalidCursor:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Invalid cursor"}),
+        }
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        create_pagination_response(
-                            paginated_favorites, page, limit, total_items
-                        )
-                    ),
-                }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
 
-        elif path == "/api/v1/favorites" and method == "POST":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+@router.route("POST", "/api/v1/favorites")
+def add_favorite(request):
+    favorites_table = aws.get_table(FAVORITES_TABLE)
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+    user = user_from_authorization(request.authorization)
 
-            book_id = request_body.get("book_id")
-            if not book_id:
-                return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps({"error": "book_id is required"}),
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-            try:
-                # Agregar a favoritos
-                favorite_item = {
-                    "pk": f'FAVORITES#{user["tenant_id"]}#{user["user_id"]}',
-                    "sk": f"BOOK#{book_id}",
-                    "book_id": book_id,
-                    "title": request_body.get("title", "Unknown"),
-                    "author": request_body.get("author", "Unknown"),
-                    "price": request_body.get("price", 0),
-                    "added_at": datetime.utcnow().isoformat(),
-                }
+    book_id = request.body.get("book_id")
+    if not book_id:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "book_id is required"}),
+        }
 
-                favorites_table.put_item(Item=favorite_item)
+    try:
+        # Agregar a favoritos
+        favorite_item = {
+            "pk": f'FAVORITES#{user["tenant_id"]}#{user["user_id"]}',
+            "sk": f"BOOK#{book_id}",
+            "book_id": book_id,
+            "title": request.body.get("title", "Unknown"),
+            "author": request.body.get("author", "Unknown"),
+            "price": request.body.get("price", 0),
+            "added_at": datetime.utcnow().isoformat(),
+        }
 
-                return {
-                    "statusCode": 201,
-                    "headers": headers,
-                    "body": json.dumps({"message": "Book added to favorites"}),
-                }
+        favorites_table.put_item(Item=favorite_item)
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+        return {
+            "statusCode": 201,
+            "headers": HEADERS,
+            "body": json.dumps({"message": "Book added to favorites"}),
+        }
 
-        elif path.startswith("/api/v1/favorites/") and method == "DELETE":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
 
-            book_id = path.split("/")[-1]
+@router.route("DELETE", "/api/v1/favorites/{book_id}")
+def remove_favorite(request):
+    favorites_table = aws.get_table(FAVORITES_TABLE)
 
-            try:
-                favorites_table.delete_item(
-                    Key={
-                        "pk": f'FAVORITES#{user["tenant_id"]}#{user["user_id"]}',
-                        "sk": f"BOOK#{book_id}",
-                    }
-                )
+    user = user_from_authorization(request.authorization)
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps({"message": "Book removed from favorites"}),
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+    book_id = request.params["book_id"]
+
+    try:
+        favorites_table.delete_item(
+            Key={
+                "pk": f'FAVORITES#{user["tenant_id"]}#{user["user_id"]}',
+                "sk": f"BOOK#{book_id}",
+            }
+        )
 
-        # ===========================================
-        # WISHLIST MANAGEMENT (Similar to Favorites)
-        # ===========================================
-        elif path == "/api/v1/wishlist" and method == "GET":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps({"message": "Book removed from favorites"}),
+        }
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
+
+
+# ===========================================
+# WISHLIST MANAGEMENT (Similar to Favorites)
+# ===========================================
+@router.route("GET", "/api/v1/wishlist")
+def list_wishlist(request):
+    wishlist_table = aws.get_table(WISHLIST_TABLE)
 
-            try:
-                page = int(query_params.get("page", 1))
-                limit = min(int(query_params.get("limit", 10)), 100)
+    user = user_from_authorization(request.authorization)
+
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-                response = wishlist_table.query(
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key("pk").eq(
-                        f'WISHLIST#{user["tenant_id"]}#{user["user_id"]}'
+    try:
+        limit = min(int(request.query.get("limit", 10)), 100)
+        pk = f'WISHLIST#{user["tenant_id"]}#{user["user_id"]}'
+        key_condition = boto3.dynamodb.conditions.Key("pk").eq(
+            pk
+        ) & boto3.dynamodb.conditions.Key("sk").begins_with("BOOK#")
+
+        # Modo compatibilidad: ?page=N lee la partición completa y la corta
+        if "page" in request.query:
+            page = int(request.query.get("page", 1))
+            wishlist = [
+                format_wishlist_item(item)
+                for item in query_all(
+                    wishlist_table, KeyConditionExpression=key_condition
+                )
+            ]
+
+            # Paginación manual
+            total_items = len(wishlist)
+            start_idx = (page - 1) * limit
+            end_idx = start_idx + limit
+            paginated_wishlist = wishlist[start_idx:end_idx]
+
+            return {
+                "statusCode": 200,
+                "headers": HEADERS,
+                "body": json.dumps(
+                    create_pagination_response(
+                        paginated_wishlist, page, limit, total_items
                     )
+                ),
+            }
+
+        items, next_cursor = query_page(
+            wishlist_table,
+            limit,
+            request.query.get("cursor"),
+            scope=pk,
+            KeyConditionExpression=key_condition,
+        )
+
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                create_cursor_response(
+                    [format_wishlist_item(item) for item in items], limit, next_cursor
                 )
+            ),
+        }
 
-                wishlist = []
-                for item in response["Items"]:
-                    if item["sk"].startswith("BOOK#"):
-                        wishlist.append(
-                            {
-                                "book_id": item.get("book_id"),
-                                "title": item.get("title", "Unknown"),
-                                "author": item.get("author", "Unknown"),
-                                "price": float(item.get("price", 0)),
-                                "priority": item.get("priority", "medium"),
-                                "added_at": item.get("added_at"),
-                            }
-                        )
-
-                # Paginación manual
-                total_items = len(wishlist)
-                start_idx = (page - 1) * limit
-                end_idx = start_idx + limit
-                paginated_wishlist = wishlist[start_idx:end_idx]
+    except InvalidCursor:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Invalid cursor"}),
+        }
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        create_pagination_response(
-                            paginated_wishlist, page, limit, total_items
-                        )
-                    ),
-                }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
 
-        # ===========================================
-        # ADD TO WISHLIST
-        # ===========================================
-        elif path == "/api/v1/wishlist" and method == "POST":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+# ===========================================
+# ADD TO WISHLIST
+# ===========================================
+@router.route("POST", "/api/v1/wishlist")
+def add_to_wishlist(request):
+    wishlist_table = aws.get_table(WISHLIST_TABLE)
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+    user = user_from_authorization(request.authorization)
 
-            book_id = request_body.get("book_id", "").strip()
-            title = request_body.get("title", "").strip()
-            author = request_body.get("author", "").strip()
-            price = request_body.get("price", 0)
-            priority = request_body.get("priority", "medium").strip()
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-            # Validaciones
-            if not all([book_id, title, author]):
-                return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {"error": "book_id, title, and author are required"}
-                    ),
-                }
+    book_id = request.body.get("book_id", "").strip()
+    title = request.body.get("title", "").strip()
+    author = request.body.get("author", "").strip()
+    price = request.body.get("price", 0)
+    priority = request.body.get("priority", "medium").strip()
 
-            if priority not in ["low", "medium", "high"]:
-                priority = "medium"
+    # Validaciones
+    if not all([book_id, title, author]):
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {"error": "book_id, title, and author are required"}
+            ),
+        }
 
-            try:
-                # Convertir price a Decimal para DynamoDB
-                from decimal import Decimal
+    if priority not in ["low", "medium", "high"]:
+        priority = "medium"
 
-                if isinstance(price, (int, float)):
-                    price = Decimal(str(price))
-                elif isinstance(price, str):
-                    price = Decimal(price)
+    try:
+        # Convertir price a Decimal para DynamoDB
+        from decimal import Decimal
+
+        if isinstance(price, (int, float)):
+            price = Decimal(str(price))
+        elif isinstance(price, str):
+            price = Decimal(price)
+
+        # Verificar si ya está en wishlist
+        existing_response = wishlist_table.get_item(
+            Key={
+                "pk": f'WISHLIST#{user["tenant_id"]}#{user["user_id"]}',
+                "sk": f"BOOK#{book_id}",
+            }
+        )
 
-                # Verificar si ya está en wishlist
-                existing_response = wishlist_table.get_item(
-                    Key={
-                        "pk": f'WISHLIST#{user["tenant_id"]}#{user["user_id"]}',
-                        "sk": f"BOOK#{book_id}",
-                    }
-                )
+        if "Item" in existing_response:
+            return {
+                "statusCode": 400,
+                "headers": HEADERS,
+                "body": json.dumps({"error": "Book already in wishlist"}),
+            }
 
-                if "Item" in existing_response:
-                    return {
-                        "statusCode": 400,
-                        "headers": headers,
-                        "body": json.dumps({"error": "Book already in wishlist"}),
-                    }
+        # Agregar a wishlist
+        wishlist_item = {
+            "pk": f'WISHLIST#{user["tenant_id"]}#{user["user_id"]}',
+            "sk": f"BOOK#{book_id}",
+            "book_id": book_id,
+            "title": title,
+            "author": author,
+            "price": price,
+            "priority": priority,
+            "added_at": datetime.utcnow().isoformat(),
+            "tenant_id": user["tenant_id"],
+            "user_id": user["user_id"],
+        }
 
-                # Agregar a wishlist
-                wishlist_item = {
-                    "pk": f'WISHLIST#{user["tenant_id"]}#{user["user_id"]}',
-                    "sk": f"BOOK#{book_id}",
-                    "book_id": book_id,
-                    "title": title,
-                    "author": author,
-                    "price": price,
-                    "priority": priority,
-                    "added_at": datetime.utcnow().isoformat(),
-                    "tenant_id": user["tenant_id"],
-                    "user_id": user["user_id"],
-                }
+        wishlist_table.put_item(Item=wishlist_item)
 
-                wishlist_table.put_item(Item=wishlist_item)
+        return {
+            "statusCode": 201,
+            "headers": HEADERS,
+            "body": json.dumps({"message": "Book added to wishlist"}),
+        }
 
-                return {
-                    "statusCode": 201,
-                    "headers": headers,
-                    "body": json.dumps({"message": "Book added to wishlist"}),
-                }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
 
-        # ===========================================
-        # REMOVE FROM WISHLIST
-        # ===========================================
-        elif path.startswith("/api/v1/wishlist/") and method == "DELETE":
-            book_id = path.split("/")[-1]
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
-
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+# ===========================================
+# REMOVE FROM WISHLIST
+# ===========================================
+@router.route("DELETE", "/api/v1/wishlist/{book_id}")
+def remove_from_wishlist(request):
+    wishlist_table = aws.get_table(WISHLIST_TABLE)
 
-            try:
-                # Eliminar de wishlist
-                wishlist_table.delete_item(
-                    Key={
-                        "pk": f'WISHLIST#{user["tenant_id"]}#{user["user_id"]}',
-                        "sk": f"BOOK#{book_id}",
-                    }
-                )
+    book_id = request.params["book_id"]
+    user = user_from_authorization(request.authorization)
 
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps({"message": "Book removed from wishlist"}),
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+    try:
+        # Eliminar de wishlist
+        wishlist_table.delete_item(
+            Key={
+                "pk": f'WISHLIST#{user["tenant_id"]}#{user["user_id"]}',
+                "sk": f"BOOK#{book_id}",
+            }
+        )
 
-        # ===========================================
-        # TOKEN VALIDATION
-        # ===========================================
-        elif path == "/api/v1/validate-token" and method == "GET":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps({"message": "Book removed from wishlist"}),
+        }
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Invalid token", "valid": False}),
-                }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
 
-            try:
-                response = users_table.get_item(
-                    Key={
-                        "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
-                        "sk": "PROFILE",
-                    }
-                )
 
-                if "Item" not in response:
-                    return {
-                        "statusCode": 401,
-                        "headers": headers,
-                        "body": json.dumps({"error": "User not found", "valid": False}),
-                    }
+# ===========================================
+# TOKEN VALIDATION
+# ===========================================
+@router.route("GET", "/api/v1/validate-token")
+def validate_token(request):
+    # Firma y expiración se comprueban en local, sin leer la tabla de usuarios
+    user = user_from_authorization(request.authorization)
 
-                user_data = response["Item"]
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {
-                            "valid": True,
-                            "user": {
-                                "user_id": user_data["user_id"],
-                                "username": user_data["username"],
-                                "email": user_data["email"],
-                                "role": user_data.get("role", "user"),
-                                "tenant_id": user_data["tenant_id"],
-                            },
-                        }
-                    ),
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Invalid token", "valid": False}),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
-                }
+    return {
+        "statusCode": 200,
+        "headers": HEADERS,
+        "body": json.dumps(
+            {
+                "valid": True,
+                "user": {
+                    "user_id": user["user_id"],
+                    "username": user.get("username", ""),
+                    "email": user.get("email", ""),
+                    "role": user["role"],
+                    "tenant_id": user["tenant_id"],
+                },
+                "expires_at": user.get("exp"),
+            }
+        ),
+    }
 
-        # ===========================================
-        # UPDATE PROFILE IMAGE
-        # ===========================================
-        elif path == "/api/v1/profile/image" and method == "PUT":
-            auth_header = event.get("headers", {}).get(
-                "authorization", ""
-            ) or event.get("headers", {}).get("Authorization", "")
-            user = extract_user_from_token(auth_header)
 
-            if not user:
-                return {
-                    "statusCode": 401,
-                    "headers": headers,
-                    "body": json.dumps({"error": "Unauthorized"}),
-                }
+# ===========================================
+# UPDATE PROFILE IMAGE
+# ===========================================
+@router.route("PUT", "/api/v1/profile/image")
+def update_profile_image(request):
+    users_table = aws.get_table(USERS_TABLE)
 
-            image_url = request_body.get("image_url", "").strip()
+    user = user_from_authorization(request.authorization)
 
-            if not image_url:
-                return {
-                    "statusCode": 400,
-                    "headers": headers,
-                    "body": json.dumps({"error": "image_url is required"}),
-                }
+    if not user:
+        return {
+            "statusCode": 401,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "Unauthorized"}),
+        }
 
-            try:
-                # Actualizar imagen de perfil
-                response = users_table.update_item(
-                    Key={
-                        "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
-                        "sk": "PROFILE",
-                    },
-                    UpdateExpression="SET profile_image_url = :image_url, updated_at = :updated_at",
-                    ExpressionAttributeValues={
-                        ":image_url": image_url,
-                        ":updated_at": datetime.utcnow().isoformat(),
-                    },
-                    ReturnValues="ALL_NEW",
-                )
+    image_url = request.body.get("image_url", "").strip()
 
-                user_data = response["Attributes"]
-                return {
-                    "statusCode": 200,
-                    "headers": headers,
-                    "body": json.dumps(
-                        {
-                            "message": "Profile image updated successfully",
-                            "profile_image_url": image_url,
-                            "user": {
-                                "user_id": user_data["user_id"],
-                                "username": user_data["username"],
-                                "email": user_data["email"],
-                                "profile_image_url": user_data.get(
-                                    "profile_image_url", ""
-                                ),
-                                "updated_at": user_data["updated_at"],
-                            },
-                        }
-                    ),
-                }
+    if not image_url:
+        return {
+            "statusCode": 400,
+            "headers": HEADERS,
+            "body": json.dumps({"error": "image_url is required"}),
+        }
 
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "headers": headers,
-                    "body": json.dumps({"error": f"Database error: {str(e)}"}),
+    try:
+        # Actualizar imagen de perfil
+        response = users_table.update_item(
+            Key={
+                "pk": f'USER#{user["tenant_id"]}#{user["user_id"]}',
+                "sk": "PROFILE",
+            },
+            UpdateExpression="SET profile_image_url = :image_url, updated_at = :updated_at",
+            ExpressionAttributeValues={
+                ":image_url": image_url,
+                ":updated_at": datetime.utcnow().isoformat(),
+            },
+            ReturnValues="ALL_NEW",
+        )
+
+        user_data = response["Attributes"]
+        return {
+            "statusCode": 200,
+            "headers": HEADERS,
+            "body": json.dumps(
+                {
+                    "message": "Profile image updated successfully",
+                    "profile_image_url": image_url,
+                    "user": {
+                        "user_id": user_data["user_id"],
+                        "username": user_data["username"],
+                        "email": user_data["email"],
+                        "profile_image_url": user_data.get(
+                            "profile_image_url", ""
+                        ),
+                        "updated_at": user_data["updated_at"],
+                    },
                 }
+            ),
+        }
 
-        # ===========================================
-        # ENDPOINT NOT FOUND
-        # ===========================================
-        else:
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "headers": HEADERS,
+            "body": json.dumps({"error": f"Database error: {str(e)}"}),
+        }
+
+
+def lambda_handler(event, context):
+    """
+    Handler para AWS Lambda que maneja requests HTTP para usuarios.
+    El dispatch se hace con la tabla de rutas compilada al importar el módulo
+    """
+    request = Request(event)
+
+    try:
+        route_handler, request.params = router.resolve(request.method, request.path)
+
+        if route_handler is None:
             return {
                 "statusCode": 404,
-                "headers": headers,
+                "headers": HEADERS,
                 "body": json.dumps(
                     {
                         "error": "Endpoint not found",
-                        "path": path,
-                        "method": method,
-                        "available_endpoints": [
-                            "GET /",
-                            "POST /api/v1/register",
-                            "POST /api/v1/login",
-                            "GET /api/v1/profile",
-                            "PUT /api/v1/profile",
-                            "PUT /api/v1/profile/image",
-                            "POST /api/v1/change-password",
-                            "GET /api/v1/users",
-                            "GET /api/v1/favorites",
-                            "POST /api/v1/favorites",
-                            "DELETE /api/v1/favorites/{book_id}",
-                            "GET /api/v1/wishlist",
-                            "POST /api/v1/wishlist",
-                            "DELETE /api/v1/wishlist/{book_id}",
-                            "GET /api/v1/validate-token",
-                        ],
+                        "path": request.path,
+                        "method": request.method,
+                        "available_endpoints": router.endpoints(),
                     }
                 ),
             }
 
+        return route_handler(request)
+
     except Exception as e:
         return {
             "statusCode": 500,
-            "headers": headers,
+            "headers": HEADERS,
             "body": json.dumps({"error": "Internal server error", "details": str(e)}),
         }
 